@@ -1,5 +1,13 @@
+from .adv import *
+from .autoconf_cache import *
+from .autotools_cache import *
 from .compile import *
+from .configure_cache import *
+from .elf import *
+from .manifest import *
 from .repo import *
+from .snapshot import *
+from .variants import *
 from . import parse
 from . import utils
 
@@ -0,0 +1,222 @@
+import json
+import multiprocessing
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import flutes
+
+from .parse.lexer import LexerWrapper, LexToken
+
+__all__ = [
+    "obfuscate_source",
+    "obfuscate_file",
+    "obfuscate_repo",
+]
+
+# Parenthesized constructs where string literals must stay literals: `asm("...")`, `__attribute__((section("...")))`,
+# `_Static_assert(..., "...")`, `sizeof("...")`, and literals that are already wrapped.
+_LITERAL_ONLY_CALLS = {"asm", "__asm", "__asm__", "volatile", "__volatile__", "__attribute__", "__declspec", "_Pragma",
+                       "_Static_assert", "static_assert", "sizeof", "OBFUSCATED"}
+# Statement boundaries, used to find the start of a declaration.
+_BOUNDARY_TOKENS = {"SEMI", "LBRACE", "RBRACE"}
+
+
+def _mask_source(code: str) -> str:
+    r"""Replace comments and preprocessor directives with spaces, and remove line continuations in string literals,
+    keeping the positions of all other characters. The result only contains code that ``pycparser``'s lexer can handle.
+    """
+    out = list(code)
+    n = len(code)
+    idx = 0
+    line_start = True  # only whitespace since the last newline
+    directive = False
+
+    def blank(start: int, end: int, keep_newlines: bool = True) -> None:
+        for pos in range(start, end):
+            if not (keep_newlines and out[pos] == "\n"):
+                out[pos] = " "
+
+    while idx < n:
+        ch = code[idx]
+        if ch == "\\" and code.startswith("\n", idx + 1):
+            blank(idx, idx + 2, keep_newlines=False)  # line continuation; a directive continues on the next line
+            idx += 2
+        elif ch == "\n":
+            line_start, directive = True, False
+            idx += 1
+        elif code.startswith("/*", idx):
+            end = code.find("*/", idx + 2)
+            end = n if end == -1 else end + 2
+            blank(idx, end)
+            idx = end
+        elif code.startswith("//", idx):
+            end = code.find("\n", idx)
+            end = n if end == -1 else end
+            blank(idx, end)
+            idx = end
+        elif ch == '"' or ch == "'":
+            end = idx + 1
+            while end < n and code[end] != ch and code[end] != "\n":
+                if code[end] == "\\":
+                    if code.startswith("\n", end + 1):
+                        blank(end, end + 2, keep_newlines=False)
+                    end += 2
+                else:
+                    end += 1
+            if end < n and code[end] == ch:
+                end += 1  # an unterminated literal (e.g. an apostrophe in `#warning`) ends before the newline
+            if directive:
+                blank(idx, end)
+            line_start = False
+            idx = end
+        else:
+            if ch == "#" and line_start:
+                directive = True
+            if not ch.isspace():
+                line_start = False
+                if directive:
+                    out[idx] = " "
+            idx += 1
+    return "".join(out)
+
+
+def _is_char_array_init(tokens: List[LexToken], equals_idx: int) -> bool:
+    r"""Whether the ``=`` token initializes an array of characters, e.g. ``char name[] = "..."``, as opposed to an
+    array of pointers, e.g. ``const char *names[] = {"..."}``."""
+    if equals_idx == 0 or tokens[equals_idx - 1].type != "RBRACKET":
+        return False
+    idx = equals_idx - 1
+    while idx >= 0 and tokens[idx].type not in _BOUNDARY_TOKENS:
+        if tokens[idx].type == "TIMES":
+            return False
+        idx -= 1
+    return True
+
+
+def _find_literals(code: str, lexer: LexerWrapper) -> List[Tuple[int, int]]:
+    r"""Find spans of string literals to obfuscate. Adjacent literals that are concatenated, possibly with macros in
+    between (e.g. ``"%" PRIu64 "\n"``), form a single span."""
+    tokens = list(lexer.lex_tokens(_mask_source(code)))
+    spans: List[Tuple[int, int]] = []
+    literal_only: List[bool] = []  # whether literals are kept within each level of parentheses or braces
+    idx = 0
+    while idx < len(tokens):
+        token = tokens[idx]
+        prev = tokens[idx - 1] if idx > 0 else None
+        if token.type in ("LPAREN", "LBRACE"):
+            inherited = len(literal_only) > 0 and literal_only[-1]
+            if token.type == "LPAREN":
+                skip = prev is not None and prev.value in _LITERAL_ONLY_CALLS
+            else:
+                skip = prev is not None and prev.type == "EQUALS" and _is_char_array_init(tokens, idx - 1)
+            literal_only.append(inherited or skip)
+        elif token.type in ("RPAREN", "RBRACE"):
+            if len(literal_only) > 0:
+                literal_only.pop()
+        elif token.type == "STRING_LITERAL":
+            last = idx
+            end = idx + 1
+            while end < len(tokens) and tokens[end].type in ("STRING_LITERAL", "ID"):
+                if tokens[end].type == "STRING_LITERAL":
+                    last = end
+                end += 1
+            keep = ((len(literal_only) > 0 and literal_only[-1]) or
+                    (prev is not None and prev.value == "extern") or  # extern "C"
+                    (prev is not None and prev.type == "EQUALS" and _is_char_array_init(tokens, idx - 1)))
+            if not keep:
+                spans.append((token.lexpos, tokens[last].lexpos + len(tokens[last].value)))
+            idx = last
+        idx += 1
+    return spans
+
+
+def obfuscate_source(code: str, prelude: str, lexer: Optional[LexerWrapper] = None) -> Tuple[str, int, bool]:
+    r"""Wrap string literals in C code with the ``OBFUSCATED`` macro of ADVobfuscator, and prepend the prelude that
+    includes the ADVobfuscator library.
+
+    Literals in comments and preprocessor directives, wide literals, and literals that must stay literals (e.g. in
+    ``asm`` statements or initializers of ``char`` arrays) are not wrapped. Rewriting is idempotent.
+
+    :param code: The source code.
+    :param prelude: The code to prepend, usually the contents of ``adv-obfuscation/headers.c``.
+    :param lexer: The lexer to use. If ``None``, a new lexer is created.
+    :return: A tuple of the rewritten code, the number of wrapped literals, and whether the prelude was added.
+    """
+    lexer = lexer or LexerWrapper()
+    add_prelude = not code.startswith(prelude)
+    spans = _find_literals(code, lexer)
+    pieces: List[str] = [prelude] if add_prelude else []
+    pos = 0
+    for start, end in spans:
+        pieces += [code[pos:start], "OBFUSCATED(", code[start:end], ")"]
+        pos = end
+    pieces.append(code[pos:])
+    return "".join(pieces), len(spans), add_prelude
+
+
+class _Rewriter(flutes.PoolState):
+    def __init__(self, repo_path: str, prelude: str) -> None:
+        self.repo_path = repo_path
+        self.prelude = prelude
+        self.lexer = LexerWrapper()
+
+    def rewrite(self, file: str) -> Dict[str, Any]:
+        num_literals, header = obfuscate_file(os.path.join(self.repo_path, file), self.prelude, self.lexer)
+        return {"file": file, "literals": num_literals, "header": header}
+
+
+def obfuscate_file(path: str, prelude: str, lexer: Optional[LexerWrapper] = None) -> Tuple[int, bool]:
+    r"""Rewrite a C file in place with :meth:`obfuscate_source`. The file is replaced atomically, and only if it
+    changes.
+
+    :return: A tuple of the number of wrapped literals, and whether the prelude was added.
+    """
+    # Latin-1 maps bytes to characters one-to-one, so files in any encoding are written back unchanged.
+    with open(path, "rb") as f:
+        code = f.read().decode("latin-1")
+    rewritten, num_literals, header = obfuscate_source(code, prelude, lexer)
+    if rewritten != code:
+        temp_path = f"{path}.{os.getpid()}.adv.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(rewritten.encode("latin-1"))
+        os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(temp_path, path)
+    return num_literals, header
+
+
+def _find_c_files(repo_path: str) -> List[str]:
+    files: List[str] = []
+    for subdir, dirs, names in os.walk(repo_path):
+        dirs[:] = [name for name in dirs if name != ".git"]
+        for name in names:
+            if name.endswith(".c") and not os.path.islink(os.path.join(subdir, name)):
+                files.append(os.path.relpath(os.path.join(subdir, name), repo_path))
+    return sorted(files)
+
+
+def obfuscate_repo(repo_path: str, prelude: str, n_procs: int = 0,
+                   manifest_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    r"""Apply ADVobfuscator string obfuscation to all C files in the repository, in place.
+
+    :param repo_path: Path to the repository.
+    :param prelude: The code to prepend to each file, usually the contents of ``adv-obfuscation/headers.c``.
+    :param n_procs: Number of worker processes. Files are rewritten in the current process if this is 0. Workers are
+        started by a fork server, so this is safe to call from threads.
+    :param manifest_path: If not ``None``, the manifest is also written to this path as JSON, atomically.
+    :return: The manifest of rewritten files: a list of entries with keys ``file`` (path relative to the repository),
+        ``literals`` (the number of wrapped literals), and ``header`` (whether the prelude was added).
+    """
+    repo_path = os.path.abspath(repo_path)
+    files = _find_c_files(repo_path)
+    manifest: List[Dict[str, Any]] = []
+    with flutes.safe_pool(min(n_procs, len(files)), state_class=_Rewriter, init_args=(repo_path, prelude),
+                          context=multiprocessing.get_context("forkserver")) as pool:
+        for entry in pool.imap_unordered(_Rewriter.rewrite, files, chunksize=16):
+            manifest.append(entry)
+    manifest.sort(key=lambda entry: entry["file"])
+    if manifest_path is not None:
+        temp_path = manifest_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, manifest_path)
+    return manifest
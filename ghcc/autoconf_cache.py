@@ -0,0 +1,174 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import re
+import shlex
+import shutil
+import tempfile
+from typing import Dict, Iterator, List, Optional
+
+__all__ = [
+    "AutoconfCache",
+]
+
+# Lines in autoconf cache files look like `ac_cv_header_stdlib_h=${ac_cv_header_stdlib_h=yes}`.
+_CACHE_LINE_REGEX = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)=")
+# Results of probes of the system (headers, library functions, and types), which are the same for all repositories.
+# Other results, e.g. `ac_cv_lib_*`, `ac_cv_path_*`, precious variables, and checks defined by the project, are not
+# shared.
+_SHARED_PREFIXES = ("ac_cv_header_", "ac_cv_func_", "ac_cv_sizeof_", "ac_cv_alignof_", "ac_cv_type_",
+                    "ac_cv_member_", "ac_cv_have_decl_")
+# The cache file is sourced by configure scripts, so shared lines must be plain assignments of literal values.
+_SHARED_LINE_REGEX = re.compile(r"^([A-Za-z0-9_]+)=\$\{\1=([A-Za-z0-9_.+-]*|'[A-Za-z0-9_.+ -]*')\}$")
+# Environment variables that change the results of probes, e.g. through `-I` or `-m32`. Runs with different values use
+# different cache files.
+_FLAG_VARIABLES = ("CC", "CXX", "CPP", "CPPFLAGS", "CFLAGS", "CXXFLAGS", "LDFLAGS", "LIBS", "MOCK_GCC_OVERRIDE_FLAGS")
+# Flags that configure scripts commonly extend themselves, e.g. with include directories of the project. Their final
+# values are listed in `config.log`, and results are only shared if they are unchanged.
+_CHECKED_VARIABLES = ("CPPFLAGS", "LDFLAGS", "LIBS")
+_OUTPUT_VARIABLE_REGEX = re.compile(r"^([A-Z_]+)=(.*)$")
+
+
+def _parse_cache(path: str) -> Dict[str, str]:
+    entries: Dict[str, str] = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, errors="replace") as f:
+        for line in f:
+            match = _CACHE_LINE_REGEX.match(line)
+            if match is not None:
+                entries[match.group(1)] = line.rstrip("\n")
+    return entries
+
+
+def _is_shared_entry(name: str, line: str) -> bool:
+    return name.startswith(_SHARED_PREFIXES) and _SHARED_LINE_REGEX.match(line) is not None
+
+
+def _flags_unchanged(directory: str, env: Dict[str, str]) -> bool:
+    # Compare the final values of flags in `config.log` with the values passed to configure.
+    values: Dict[str, str] = {}
+    try:
+        with open(os.path.join(directory, "config.log"), errors="replace") as f:
+            for line in f:
+                match = _OUTPUT_VARIABLE_REGEX.match(line.rstrip("\n"))
+                if match is not None and match.group(1) in _CHECKED_VARIABLES:
+                    values[match.group(1)] = match.group(2)
+    except FileNotFoundError:
+        return False
+    for name in _CHECKED_VARIABLES:
+        if name not in values:
+            return False
+        try:
+            value = " ".join(shlex.split(values[name]))
+        except ValueError:
+            return False
+        if value.split() != env.get(name, "").split():
+            return False
+    return True
+
+
+class AutoconfCache:
+    r"""A cache of autoconf feature test results (``checking for stdlib.h...``, ``checking size of long...``) shared
+    by all repositories, with one cache file per compiler seen by configure scripts and set of compiler flags.
+
+    Each run of ``./configure`` gets a private copy of the shared cache through a ``config.site`` file, which points
+    ``cache_file`` to the copy. Results of successful runs are merged back into the shared cache under a file lock.
+    Only results of system probes (headers, functions, sizes, and types) with literal values are shared, excluding
+    results containing the path of the configured directory. Entries are validated again when loaded, since the cache
+    file is sourced by configure scripts.
+
+    Results are only valid for the Docker image they are computed in, so the cache directory should be specific to the
+    image (see :meth:`ghcc.utils.get_image_id`). Results also depend on compiler flags, so runs with different flags in
+    the environment use different cache files, and results of runs where the configure script adds its own
+    preprocessor flags, linker flags, or libraries are not shared.
+
+    Containers of different repositories run as different users in the group of the host user, so files are
+    group-writable, and the directory passes its group on to new files.
+
+    :param path: Path to the directory where cache files are stored. It is created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+            os.chmod(self.path, 0o2770)
+
+    def _cache_name(self, compiler: str, env: Optional[Dict[str, str]] = None) -> str:
+        env = env or {}
+        flags = [f"{name}={env[name]}" for name in _FLAG_VARIABLES if len(env.get(name, "").strip()) > 0]
+        if len(flags) == 0:
+            return compiler
+        return compiler + "-" + hashlib.sha256("\0".join(flags).encode('utf-8')).hexdigest()[:16]
+
+    def cache_path(self, compiler: str, env: Optional[Dict[str, str]] = None) -> str:
+        r"""Return the path to the shared cache file for the compiler and the compiler flags in the environment."""
+        return os.path.join(self.path, f"{self._cache_name(compiler, env)}.cache")
+
+    @contextlib.contextmanager
+    def _lock(self, name: str) -> Iterator[None]:
+        lock_path = os.path.join(self.path, f"{name}.lock")
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o660)
+        try:
+            with contextlib.suppress(PermissionError):
+                os.chmod(lock_path, 0o660)  # not affected by umask; fails if created by another user, which is fine
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _shared_entries(self, directory: str, entries: Dict[str, str]) -> Dict[str, str]:
+        return {name: line for name, line in entries.items()
+                if _is_shared_entry(name, line) and directory not in line}
+
+    @contextlib.contextmanager
+    def configure_env(self, compiler: str, directory: str,
+                      env: Optional[Dict[str, str]] = None) -> Iterator[Dict[str, str]]:
+        r"""Prepare a private copy of the cache for one run of ``./configure``. Results of the run are merged into the
+        shared cache if the block exits without an exception.
+
+        :param compiler: The compiler seen by the configure script, i.e., the value of the ``COMPILER`` variable.
+        :param directory: The directory where ``./configure`` runs.
+        :param env: Environment variables that ``./configure`` runs with.
+        :return: Environment variables to set for ``./configure``.
+        """
+        directory = os.path.abspath(directory)
+        env = env or {}
+        cache_path = self.cache_path(compiler, env)
+        temp_dir = tempfile.mkdtemp(prefix="ghcc-autoconf-")
+        try:
+            private_cache = os.path.join(temp_dir, "config.cache")
+            # Reading doesn't need the lock, since the shared cache is replaced atomically.
+            entries = {name: line for name, line in _parse_cache(cache_path).items()
+                       if _is_shared_entry(name, line)}
+            with open(private_cache, "w") as f:
+                f.write("".join(line + "\n" for line in entries.values()))
+            site_file = os.path.join(temp_dir, "config.site")
+            with open(site_file, "w") as f:
+                # Don't override a cache file specified on the command line.
+                f.write(f'if test "$cache_file" = /dev/null; then\n'
+                        f'  cache_file={shlex.quote(private_cache)}\n'
+                        f'fi\n')
+            yield {"CONFIG_SITE": site_file}
+            if _flags_unchanged(directory, env):
+                self._merge(cache_path, self._shared_entries(directory, _parse_cache(private_cache)))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _merge(self, cache_path: str, new_entries: Dict[str, str]) -> None:
+        with self._lock(os.path.splitext(os.path.basename(cache_path))[0]):
+            existing = _parse_cache(cache_path)
+            # Invalid entries are dropped, in case the shared cache was modified by other means.
+            entries = {name: line for name, line in existing.items() if _is_shared_entry(name, line)}
+            added: List[str] = [name for name in new_entries if name not in entries]
+            if len(added) == 0 and len(entries) == len(existing):
+                return
+            # Existing results are kept, so the results seen by concurrent runs stay consistent.
+            entries.update((name, new_entries[name]) for name in added)
+            temp_path = cache_path + f".{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                f.write("".join(line + "\n" for line in entries.values()))
+            os.chmod(temp_path, 0o660)
+            os.replace(temp_path, cache_path)
@@ -0,0 +1,172 @@
+import contextlib
+import fcntl
+import hashlib
+import io
+import os
+import tarfile
+import time
+from typing import Dict, Iterator, List, Optional
+
+from .utils.archive import extract_archive
+
+__all__ = [
+    "AutotoolsCache",
+]
+
+# Inputs of `autoreconf`, in addition to local m4 macros (`*.m4`).
+INPUT_FILE_NAMES = {"configure.ac", "configure.in", "Makefile.am", "autogen.sh"}
+# Caches of `autom4te` contain absolute paths and are not needed to run `./configure`.
+EXCLUDED_DIRS = {".git", "autom4te.cache"}
+
+
+def _walk_files(directory: str) -> Iterator[str]:
+    for subdir, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d not in EXCLUDED_DIRS)
+        for name in sorted(files):
+            yield os.path.relpath(os.path.join(subdir, name), directory)
+
+
+class AutotoolsCache:
+    r"""A content-addressed cache of files generated by ``autogen.sh`` or ``autoreconf --force --install``, i.e., the
+    ``configure`` script, ``Makefile.in`` files, ``aclocal.m4``, ``config.h.in``, and auxiliary scripts.
+
+    Outputs are keyed by a hash of the inputs of autotools: ``configure.ac``/``configure.in``, ``Makefile.am`` files,
+    local m4 macros, and ``autogen.sh``. The cache can thus be shared by all variants, forks, and reruns of a
+    repository. Archives are evicted in least-recently-used order when the total size exceeds ``max_size``.
+
+    Results are only valid for the Docker image they are computed in, since they depend on the installed versions of
+    autotools. Containers of different repositories run as different users in the group of the host user, so files are
+    group-writable, and the directory passes its group on to new files. The SHA-256 digest of each archive is recorded
+    when it is saved, and archives that don't match their digest are not restored.
+
+    :param path: Path to the directory where archives are stored. It is created if it does not exist.
+    :param max_size: Maximum total size of archives (in bytes). If ``None``, the size is unbounded.
+    """
+
+    def __init__(self, path: str, max_size: Optional[int] = None):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+            os.chmod(self.path, 0o2770)
+
+    def key(self, directory: str) -> str:
+        r"""Compute the cache key for the directory from the contents of autotools inputs."""
+        hash_obj = hashlib.sha256()
+        for file in _walk_files(directory):
+            name = os.path.basename(file)
+            if name in INPUT_FILE_NAMES or name.endswith(".m4"):
+                hash_obj.update(file.encode('utf-8') + b"\0")
+                with open(os.path.join(directory, file), "rb") as f:
+                    hash_obj.update(hashlib.sha256(f.read()).digest())
+        return hash_obj.hexdigest()
+
+    def _archive_path(self, key: str) -> str:
+        return os.path.join(self.path, key + ".tar")
+
+    def _digest_path(self, key: str) -> str:
+        return os.path.join(self.path, key + ".sha256")
+
+    @contextlib.contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        r"""Hold an exclusive lock on the entry, so that the same outputs are not generated concurrently."""
+        lock_path = os.path.join(self.path, key + ".lock")
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o660)
+        try:
+            with contextlib.suppress(PermissionError):
+                os.chmod(lock_path, 0o660)  # not affected by umask; fails if created by another user, which is fine
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def restore(self, directory: str, key: str) -> bool:
+        r"""Restore the cached outputs into the directory, if they exist.
+
+        Restored files are given current timestamps, keeping their relative order, so that ``make`` does not consider
+        them older than the inputs of autotools and try to regenerate them.
+
+        :return: Whether the outputs were restored.
+        """
+        archive_path = self._archive_path(key)
+        try:
+            # The archive is read into memory, so the verified contents are the ones extracted.
+            with open(archive_path, "rb") as f:
+                contents = f.read()
+            with open(self._digest_path(key)) as f:
+                digest = f.read().strip()
+        except FileNotFoundError:
+            return False
+        if hashlib.sha256(contents).hexdigest() != digest:
+            return False  # modified after it was saved; regenerate and overwrite the archive
+        with tarfile.open(fileobj=io.BytesIO(contents)) as tar:
+            try:
+                members = extract_archive(tar, directory)
+            except tarfile.TarError:
+                return False  # regenerate and overwrite the archive
+        with contextlib.suppress(FileNotFoundError, PermissionError):
+            os.utime(archive_path)  # mark as recently used
+        files = [member for member in members if member.isfile()]
+        if len(files) > 0:
+            now = time.time()
+            oldest = min(member.mtime for member in files)
+            for member in files:
+                timestamp = now + (member.mtime - oldest)
+                os.utime(os.path.join(directory, member.name), (timestamp, timestamp))
+        return True
+
+    def snapshot(self, directory: str) -> Dict[str, int]:
+        r"""Record modification times of files in the directory, to be passed to :meth:`save`."""
+        return {file: os.lstat(os.path.join(directory, file)).st_mtime_ns for file in _walk_files(directory)}
+
+    def save(self, directory: str, key: str, snapshot: Dict[str, int]) -> bool:
+        r"""Save files created or modified in the directory since the snapshot was taken.
+
+        Outputs are not saved if ``./configure`` was also run (which some ``autogen.sh`` scripts do), since its results
+        depend on the configured directory.
+
+        :return: Whether the outputs were saved.
+        """
+        files: List[str] = [file for file in _walk_files(directory)
+                            if snapshot.get(file) != os.lstat(os.path.join(directory, file)).st_mtime_ns]
+        if len(files) == 0 or any(os.path.basename(file) == "config.status" for file in files):
+            return False
+        archive_path = self._archive_path(key)
+        temp_path = archive_path + f".{os.getpid()}.tmp"
+        # Symlinks (e.g. auxiliary scripts installed without `--copy`) are stored as the files they point to, since links
+        # are not extracted when restoring.
+        with tarfile.open(temp_path, "w", format=tarfile.PAX_FORMAT, dereference=True) as tar:
+            for file in files:
+                path = os.path.join(directory, file)
+                if os.path.isfile(path):
+                    tar.add(path, arcname=file, recursive=False)
+        with open(temp_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        os.chmod(temp_path, 0o660)
+        os.replace(temp_path, archive_path)
+        # The digest is written last, so the archive is only restored after it's completely saved.
+        digest_path = self._digest_path(key)
+        with open(temp_path, "w") as f:
+            f.write(digest + "\n")
+        os.chmod(temp_path, 0o660)
+        os.replace(temp_path, digest_path)
+        self._evict()
+        return True
+
+    def _evict(self) -> None:
+        if self.max_size is None:
+            return
+        archives = []
+        for name in os.listdir(self.path):
+            if name.endswith(".tar"):
+                with contextlib.suppress(FileNotFoundError):
+                    stat = os.stat(os.path.join(self.path, name))
+                    archives.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum(size for _, size, _ in archives)
+        for _, size, name in sorted(archives):
+            if total_size <= self.max_size:
+                break
+            with contextlib.suppress(FileNotFoundError, PermissionError):
+                os.remove(os.path.join(self.path, name))
+                os.remove(os.path.join(self.path, name[:-len(".tar")] + ".sha256"))
+            total_size -= size
@@ -1,23 +1,40 @@
+import errno
+import functools
 import hashlib
+import json
 import os
-import pickle
 import shutil
+import contextlib
 import subprocess
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum, auto
-from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+from typing import Any, Callable, Collection, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 from flutes.run import run_command
 
+from .adv import obfuscate_repo
+from .autoconf_cache import AutoconfCache
+from .autotools_cache import AutotoolsCache
+from .configure_cache import ConfigureCache
+from .elf import ElfInfo, ElfType, read_elf_info
 from .repo import clean
-from .utils.docker import run_docker_command, run_docker_command_other
+from .utils.docker import ContainerPool, DockerClient, run_docker_command, run_docker_command_other
+from .utils.job_budget import JobBudget
+from .utils.run import StallError, run_streaming_command
 
 MOCK_PATH = os.path.abspath(os.path.join(os.path.split(__file__)[0], "..", "..", "scripts", "mock_path"))
 
-ELF_FILE_TAG = b"ELF"  # Linux
+HASH_CHUNK_SIZE = 1 << 20  # binaries are hashed and copied in chunks of this size (1MB)
+MIN_MAKEFILE_TIMEOUT = 60.0  # each Makefile may run for at least this long (if time remains), regardless of its share
+BATCH_RESULTS_FILE = "results.jsonl"  # written by `batch_make.py` under the binary directory, one line per Makefile
+CONFIGURE_COMPILER = "gcc"  # compiler seen by configure scripts when their results are shared across variants
 
 __all__ = [
     "contains_files",
+    "RepoScan",
+    "scan_repo",
     "find_makefiles",
     "CompileErrorType",
     "CompileResult",
@@ -42,22 +59,88 @@ def contains_files(path: str, names: List[str]) -> bool:
     return False
 
 
+class RepoScan(NamedTuple):
+    makefile_dirs: List[str]  # absolute paths to directories containing Makefiles
+    automake_dirs: List[str]  # Makefile directories that also contain `configure.ac` or `configure.in`
+    configure_dirs: List[str]  # Makefile directories that also contain a `configure` script
+    has_gitmodules: bool  # whether the repository root contains `.gitmodules`
+    num_c_files: int
+    num_cpp_files: int
+    size: int  # total size of all files and directories in bytes, including `.git`, as reported by `du -bs`
+
+
+C_EXTENSIONS = (".c",)
+CPP_EXTENSIONS = (".cc", ".cpp", ".cxx", ".c++")
+
+
+def _folder_size(path: str) -> int:
+    size = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            size += entry.stat(follow_symlinks=False).st_size
+            if entry.is_dir(follow_symlinks=False):
+                size += _folder_size(entry.path)
+    return size
+
+
+def scan_repo(path: str) -> RepoScan:
+    r"""Scan the repository in a single pass, and gather the information needed to compile it. Git metadata under
+    ``.git`` is only counted towards the size.
+
+    :param path: Path to the repository.
+    :return: A :class:`RepoScan` object. Makefile directories are listed in the same order as :meth:`os.walk`.
+    """
+    path = os.path.abspath(path)
+    makefile_dirs: List[str] = []
+    automake_dirs: List[str] = []
+    configure_dirs: List[str] = []
+    num_c_files = num_cpp_files = 0
+    size = os.lstat(path).st_size
+    stack = [path]
+    while len(stack) > 0:
+        directory = stack.pop()
+        subdirs: List[str] = []
+        names: Set[str] = set()
+        with os.scandir(directory) as it:
+            for entry in it:
+                size += entry.stat(follow_symlinks=False).st_size
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name == ".git":
+                        size += _folder_size(entry.path)
+                    else:
+                        subdirs.append(entry.path)
+                elif entry.is_file():
+                    name = entry.name.lower()
+                    names.add(name)
+                    if name.endswith(C_EXTENSIONS):
+                        num_c_files += 1
+                    elif name.endswith(CPP_EXTENSIONS):
+                        num_cpp_files += 1
+        if "makefile" in names:
+            makefile_dirs.append(directory)
+            if "configure.ac" in names or "configure.in" in names:
+                automake_dirs.append(directory)
+            if "configure" in names:
+                configure_dirs.append(directory)
+        stack.extend(reversed(subdirs))
+    return RepoScan(makefile_dirs, automake_dirs, configure_dirs,
+                    has_gitmodules=os.path.isfile(os.path.join(path, ".gitmodules")),
+                    num_c_files=num_c_files, num_cpp_files=num_cpp_files, size=size)
+
+
 def find_makefiles(path: str) -> List[str]:
     r"""Find all subdirectories under the given directory that contains Makefiles.
 
     :param path: Path to the directory to scan.
     :return: A list of absolute paths to subdirectories that contain Makefiles.
     """
-    directories = []
-    for subdir, dirs, files in os.walk(path):
-        if contains_files(subdir, ["makefile"]):
-            directories.append(subdir)
-    return directories
+    return scan_repo(path).makefile_dirs
 
 
 class CompileErrorType(Enum):
     Timeout = auto()
     CompileFailed = auto()
+    Stalled = auto()
     Unknown = auto()
 
 
@@ -66,34 +149,69 @@ class CompileResult(NamedTuple):
     elf_files: List[str]  # list of paths to ELF files
     error_type: Optional[CompileErrorType] = None
     captured_output: Optional[str] = None
+    elf_info: Optional[List[Optional[ElfInfo]]] = None  # information of each ELF file, `None` if not checked
+    stall_reason: Optional[str] = None  # why the build was killed, if `error_type` is `Stalled`
 
 
 def _create_result(success: bool = False, elf_files: Optional[List[str]] = None,
                    error_type: Optional[CompileErrorType] = None,
-                   captured_output: Optional[str] = None) -> CompileResult:
+                   captured_output: Optional[str] = None,
+                   elf_info: Optional[List[Optional[ElfInfo]]] = None,
+                   stall_reason: Optional[str] = None) -> CompileResult:
     if elf_files is None:
         elf_files = []
-    return CompileResult(success, elf_files=elf_files, error_type=error_type, captured_output=captured_output)
+    if elf_info is None:
+        elf_info = []
+    return CompileResult(success, elf_files=elf_files, error_type=error_type, captured_output=captured_output,
+                         elf_info=elf_info, stall_reason=stall_reason)
 
 
-def _check_elf_fn(directory: str, file: str) -> bool:
+def _check_elf_fn(directory: str, file: str, elf_types: Optional[Collection[ElfType]] = None) -> Optional[ElfInfo]:
     r"""Checks whether the specified file is a binary file.
 
     :param directory: The directory containing the Makefile.
     :param file: The path to the file to check, relative to the directory.
-    :return: If ``True``, the file is a binary (ELF) file.
+    :param elf_types: If not ``None``, only ELF files of these types are accepted.
+    :return: Information of the file if it is a binary (ELF) file, or ``None`` otherwise.
+    """
+    return read_elf_info(os.path.join(directory, file), elf_types)
+
+
+def _snapshot_files(directory: str) -> Dict[str, Tuple[int, int, int]]:
+    r"""Record the inode, modification time, and size of each regular file under the directory (except for ``.git``)
+    in a single ``os.scandir`` pass.
+
+    :return: A dictionary mapping paths relative to the directory to the recorded stats.
     """
-    path = os.path.join(directory, file)
-    output = subprocess.check_output(["file", path], timeout=10)
-    output = output[len(path):]  # first part is file name
-    return ELF_FILE_TAG in output
+    files: Dict[str, Tuple[int, int, int]] = {}
+    stack = [""]
+    while len(stack) > 0:
+        subdir = stack.pop()
+        try:
+            it = os.scandir(os.path.join(directory, subdir))
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != ".git":
+                        stack.append(os.path.join(subdir, entry.name))
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files[os.path.join(subdir, entry.name)] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    return files
 
 
 def _make_skeleton(directory: str, timeout: Optional[float] = None,
                    env: Optional[Dict[str, str]] = None,
-                   verbose: bool = True,
-                   *, make_fn,
-                   check_file_fn: Callable[[str, str], bool] = _check_elf_fn) -> CompileResult:
+                   verbose: bool = True, clean_repo: bool = True,
+                   configure_cache: Optional[ConfigureCache] = None,
+                   autoconf_cache: Optional[AutoconfCache] = None,
+                   autotools_cache: Optional[AutotoolsCache] = None,
+                   job_budget: Optional[JobBudget] = None,
+                   elf_types: Optional[Collection[ElfType]] = None,
+                   stall_timeout: Optional[float] = None, *, make_fn,
+                   check_file_fn: Optional[Callable[[str, str], Any]] = None) -> CompileResult:
     r"""A composable routine for different compilation methods. Different routines can be composed by specifying
     different ``make_fn``\ s and ``check_file_fn``\ s.
 
@@ -101,23 +219,42 @@ def _make_skeleton(directory: str, timeout: Optional[float] = None,
     :param timeout: Maximum compilation time.
     :param env: A dictionary of environment variables.
     :param verbose: If ``True``, print out executed commands and outputs.
+    :param clean_repo: If ``True``, unversioned files by previous compilations are cleaned before compilation. This can
+        be skipped if the directory is in a fresh snapshot of the repository, or if the repository is cleaned once
+        before all compilations. Either way, only files created or changed by this compilation are collected.
+    :param configure_cache: If not ``None``, results of the configure steps are shared through this cache.
+    :param autoconf_cache: If not ``None``, autoconf feature test results are shared through this cache.
+    :param autotools_cache: If not ``None``, outputs of autotools are shared through this cache.
+    :param job_budget: If not ``None``, the number of ``make`` jobs is taken from this budget.
+    :param elf_types: If not ``None``, only ELF files of these types are collected by the default ``check_file_fn``.
+    :param stall_timeout: If not ``None``, ``make`` is killed if it makes no progress for this many seconds.
     :param make_fn: The function to call for compilation. The function takes as input variables ``directory``,
-        ``timeout``, and ``env``.
+        ``timeout``, ``env``, ``verbose``, ``configure_cache``, ``autoconf_cache``, ``autotools_cache``,
+        ``job_budget``, and ``stall_timeout``.
     :param check_file_fn: A function to determine whether a generated file should be collected, i.e., whether it is a
         binary file. The function takes as input variables ``directory`` and ``file``, where ``file`` is the path of the
-        file to check, relative to ``directory``. Defaults to :meth:`_check_elf_fn`, which checks whether the file is an
-        ELF file.
+        file to check, relative to ``directory``. The file is collected if the return value is truthy, and if it is an
+        :class:`ghcc.ElfInfo`, it is recorded in ``elf_info`` of the result. Defaults to :meth:`_check_elf_fn`, which
+        returns information of ELF files.
     """
     directory = os.path.abspath(directory)
+    if check_file_fn is None:
+        check_file_fn = functools.partial(_check_elf_fn, elf_types=elf_types)
 
     try:
         # Clean unversioned files by previous compilations.
-        clean(directory)
+        if clean_repo:
+            clean(directory)
+        snapshot = _snapshot_files(directory)
 
         # Call the actual function for `make`.
-        make_fn(directory, timeout=timeout, env=env, verbose=verbose)
+        make_fn(directory, timeout=timeout, env=env, verbose=verbose, configure_cache=configure_cache,
+                autoconf_cache=autoconf_cache, autotools_cache=autotools_cache, job_budget=job_budget,
+                stall_timeout=stall_timeout)
         result = _create_result(True)
 
+    except StallError as e:
+        result = _create_result(error_type=CompileErrorType.Stalled, captured_output=e.output, stall_reason=e.reason)
     except subprocess.TimeoutExpired as e:
         # Even if exceptions occur, we still check for ELF files, just in case.
         result = _create_result(error_type=CompileErrorType.Timeout, captured_output=e.output)
@@ -127,48 +264,79 @@ def _make_skeleton(directory: str, timeout: Optional[float] = None,
         result = _create_result(error_type=CompileErrorType.Unknown, captured_output=str(e))
 
     try:
-        # Use Git to find all unversioned files -- these would be the products of compilation.
-        output = run_command(["git", "ls-files", "--others"], cwd=directory,
-                             timeout=timeout, return_output=True).captured_output
-        assert output is not None
-        diff_files = [
-            # files containing escape characters are in quotes
-            file if file[0] != '"' else file[1:-1]
-            for file in output.decode('unicode_escape').split("\n") if file]  # file names could contain spaces
+        # Files that are new or changed since the snapshot -- these would be the products of compilation.
+        diff_files = sorted(file for file, stat in _snapshot_files(directory).items() if snapshot.get(file) != stat)
 
         # Inspect each file and find ELF files.
         for file in diff_files:
-            if check_file_fn(directory, file):
+            info = check_file_fn(directory, file)
+            if info:
                 result.elf_files.append(file)
-    except subprocess.TimeoutExpired as e:
-        return _create_result(elf_files=result.elf_files, error_type=CompileErrorType.Timeout, captured_output=e.output)
-    except subprocess.CalledProcessError as e:
-        return _create_result(elf_files=result.elf_files, error_type=CompileErrorType.Unknown, captured_output=e.output)
+                result.elf_info.append(info if isinstance(info, ElfInfo) else None)
     except OSError as e:
-        return _create_result(elf_files=result.elf_files, error_type=CompileErrorType.Unknown, captured_output=str(e))
+        return _create_result(elf_files=result.elf_files, error_type=CompileErrorType.Unknown, captured_output=str(e),
+                              elf_info=result.elf_info, stall_reason=result.stall_reason)
 
     return result
 
 
-def _unsafe_make(directory: str, timeout: Optional[float] = None, env: Optional[Dict[str, str]] = None,
-                 verbose: bool = False) -> None:
-    env = {"PATH": f"{MOCK_PATH}:{os.environ['PATH']}", **(env or {})}
-    #print("IN _unsafe_make")
+def _needs_configure(directory: str) -> bool:
+    return (contains_files(directory, ["configure.ac", "configure.in"]) or
+            os.path.isfile(os.path.join(directory, "configure")))
+
+
+def _run_configure_script(directory: str, timeout: Optional[float], env: Dict[str, str], verbose: bool) -> None:
+    run_command(["chmod", "+x", "./configure"], env=env, cwd=directory, verbose=verbose)
+    start_time = time.time()
+    ret = run_command(["./configure", "--disable-werror"], env=env, cwd=directory, timeout=timeout,
+                      verbose=verbose, ignore_errors=True)
+    #print("after run command for gnu configure")
+    if ret.return_code != 0 and time.time() - start_time <= 2:
+        # The configure file might not support `--disable-werror` and died instantly. Try again without the flag.
+        #print("before run command for gnu configure")
+        run_command(["./configure"], env=env, cwd=directory, timeout=timeout, verbose=verbose)
+        #print("after run command for gnu configure")
+
 
+def _run_autotools(directory: str, timeout: Optional[float], env: Dict[str, str], verbose: bool) -> bool:
+    if os.path.isfile(os.path.join(directory, "autogen.sh")):
+        # Some projects with non-trivial build instructions provide an "autogen.sh" script.
+        #print("before run command for gnu autogen")
+        run_command(["chmod", "+x", "./autogen.sh"], env=env, cwd=directory, verbose=verbose)
+        ret = run_command(["./autogen.sh"], env=env, cwd=directory, timeout=timeout, verbose=verbose,
+                          ignore_errors=True)
+        #print("after run command for gnu autogen")
+    else:
+        #print("before run command for else gnu autogen")
+        ret = run_command(["autoreconf", "--force", "--install"],
+                          env=env, cwd=directory, timeout=timeout, ignore_errors=True, verbose=verbose)
+        #print("after run command for else gnu autogen")
+    return ret.return_code == 0
+
+
+def _configure(directory: str, timeout: Optional[float], env: Dict[str, str], verbose: bool,
+               autoconf_cache: Optional[AutoconfCache] = None,
+               autotools_cache: Optional[AutotoolsCache] = None) -> Optional[float]:
+    r"""Run the configure steps (``autogen.sh``/``autoreconf`` and ``./configure``) in the directory, if applicable.
+
+    :param autoconf_cache: If not ``None``, ``./configure`` reuses feature test results through this cache.
+    :param autotools_cache: If not ``None``, outputs of ``autogen.sh``/``autoreconf`` are restored from this cache
+        when their inputs are unchanged.
+    :return: The remaining time for compilation.
+    """
     # Try GNU Automake first. Note that errors are ignored because it's possible that the original files still work.
     if contains_files(directory, ["configure.ac", "configure.in"]):
         start_time = time.time()
-        if os.path.isfile(os.path.join(directory, "autogen.sh")):
-            # Some projects with non-trivial build instructions provide an "autogen.sh" script.
-            #print("before run command for gnu autogen")
-            run_command(["chmod", "+x", "./autogen.sh"], env=env, cwd=directory, verbose=verbose)
-            run_command(["./autogen.sh"], env=env, cwd=directory, timeout=timeout, verbose=verbose, ignore_errors=True)
-            #print("after run command for gnu autogen")
+        if autotools_cache is None:
+            _run_autotools(directory, timeout, env, verbose)
         else:
-            #print("before run command for else gnu autogen")
-            run_command(["autoreconf", "--force", "--install"],
-                        env=env, cwd=directory, timeout=timeout, ignore_errors=True, verbose=verbose)
-            #print("after run command for else gnu autogen")
+            key = autotools_cache.key(directory)
+            # If the same inputs are being processed elsewhere, wait for the outputs instead of generating them again.
+            with autotools_cache.lock(key):
+                if not autotools_cache.restore(directory, key):
+                    snapshot = autotools_cache.snapshot(directory)
+                    if _run_autotools(directory, timeout, env, verbose):
+                        autotools_cache.save(directory, key, snapshot)
         end_time = time.time()
         if timeout is not None:
             timeout = max(1.0, timeout - int(end_time - start_time))
@@ -177,43 +345,117 @@ def _unsafe_make(directory: str, timeout: Optional[float] = None, env: Optional[
     if os.path.isfile(os.path.join(directory, "configure")):
         start_time = time.time()
         #print("before run command for gnu configure")
-        run_command(["chmod", "+x", "./configure"], env=env, cwd=directory, verbose=verbose)
-        ret = run_command(["./configure", "--disable-werror"], env=env, cwd=directory, timeout=timeout,
-                          verbose=verbose, ignore_errors=True)
-        #print("after run command for gnu configure")
+        if autoconf_cache is None:
+            _run_configure_script(directory, timeout, env, verbose)
+        else:
+            try:
+                with autoconf_cache.configure_env(env.get("COMPILER", "gcc"), directory, env) as site_env:
+                    _run_configure_script(directory, timeout, {**env, **site_env}, verbose)
+            except subprocess.CalledProcessError:
+                # Cached results of a check could be wrong for this repository, e.g. if it defines its own check with a
+                # common name. Try again from scratch.
+                if timeout is not None:
+                    timeout = max(1.0, timeout - int(time.time() - start_time))
+                _run_configure_script(directory, timeout, env, verbose)
         end_time = time.time()
-        if ret.return_code != 0 and end_time - start_time <= 2:
-            # The configure file might not support `--disable-werror` and died instantly. Try again without the flag.
-            #print("before run command for gnu configure")
-            run_command(["./configure"], env=env, cwd=directory, timeout=timeout, verbose=verbose)
-            #print("after run command for gnu configure")
-            end_time = time.time()
         if timeout is not None:
             timeout = max(1.0, timeout - int(end_time - start_time))
 
+    return timeout
+
+
+def _acquire_jobs(job_budget: Optional[JobBudget]):
+    return job_budget.acquire() if job_budget is not None else contextlib.nullcontext(1)
+
+
+def _run_make(args: List[str], jobs: int, directory: str, timeout: Optional[float], env: Dict[str, str],
+              verbose: bool, stall_timeout: Optional[float] = None) -> None:
+    # Builds must not wait for input, and are killed by the stall watchdog if they hang otherwise.
+    run_fn = functools.partial(run_streaming_command, env=env, cwd=directory, verbose=verbose,
+                               stall_timeout=stall_timeout, stdin=subprocess.DEVNULL)
+    if jobs > 1:
+        start_time = time.time()
+        try:
+            run_fn(args + [f"-j{jobs}"], timeout=timeout)
+            return
+        except subprocess.CalledProcessError as err:
+            if err.output is not None and b"missing separator" in err.output:
+                raise err  # not a GNU Makefile, no need to try again
+            # The failure might be a race in the parallel build, e.g. due to missing dependencies between targets.
+            # Continue with a single job, which only rebuilds targets that failed.
+            if timeout is not None:
+                timeout = max(1.0, timeout - int(time.time() - start_time))
+    run_fn(args + ["-j1"], timeout=timeout)
+
+
+def _make_command(jobs: int) -> str:
+    # Same as `_run_make`, for commands run through a shell.
+    command = "make --keep-going -j1"
+    if jobs > 1:
+        command = f"make --keep-going -j{jobs} || {command}"
+    return command
+
+
+def _unsafe_make(directory: str, timeout: Optional[float] = None, env: Optional[Dict[str, str]] = None,
+                 verbose: bool = False, configure_cache: Optional[ConfigureCache] = None,
+                 autoconf_cache: Optional[AutoconfCache] = None,
+                 autotools_cache: Optional[AutotoolsCache] = None,
+                 job_budget: Optional[JobBudget] = None, stall_timeout: Optional[float] = None) -> None:
+    env = {"PATH": f"{MOCK_PATH}:{os.environ['PATH']}", **(env or {})}
+    #print("IN _unsafe_make")
+
+    if configure_cache is None or not _needs_configure(directory):
+        timeout = _configure(directory, timeout, env, verbose, autoconf_cache, autotools_cache)
+    else:
+        start_time = time.time()
+        # If another variant is configuring this directory, wait for it and reuse its results.
+        with configure_cache.lock(directory):
+            if not configure_cache.restore(directory):
+                # The results are shared by all variants, so they shouldn't depend on which variant configures first.
+                # The actual compiler and flags are chosen by the mock GCC wrapper when `make` runs.
+                configure_env = {**env, "COMPILER": CONFIGURE_COMPILER}
+                configure_env.pop("MOCK_GCC_OVERRIDE_FLAGS", None)
+                configure_start = configure_cache.start(directory)
+                try:
+                    _configure(directory, timeout, configure_env, verbose, autoconf_cache, autotools_cache)
+                except subprocess.CalledProcessError as e:
+                    configure_cache.save(directory, configure_start, error=e)
+                    raise
+                configure_cache.save(directory, configure_start)
+        if timeout is not None:
+            timeout = max(1.0, timeout - int(time.time() - start_time))
+
     # Make while ignoring errors.
     # `-B/--always-make` could give strange errors for certain Makefiles, e.g. ones containing "%:"
-    try:
-        #print("before run command make")
-        #print(f"directory: {directory}")
-        run_command(["make", "--keep-going", "-j1"], env=env, cwd=directory, timeout=timeout, verbose=verbose)
-        #subprocess.run(["make", "--keep-going", "-j1"], env=env, cwd=directory, timeout=timeout)
-        #print("after run command make")
-    except subprocess.CalledProcessError as err:
-        expected_msg = b"missing separator"
-        if not (err.output is not None and expected_msg in err.output):
-            #print(err.output)
-            raise err
-        else:
-            # Try again using BSD Make instead of GNU Make. Note BSD Make does not have a flag equivalent to
-            # `-B/--always-make`.
-            #print("else bmake")
-            #print(err.output)
-            run_command(["bmake", "-k", "-j1"], env=env, cwd=directory, timeout=timeout, verbose=verbose)
+    # Use more jobs when there are idle cores in the machine.
+    with _acquire_jobs(job_budget) as jobs:
+        try:
+            #print("before run command make")
+            #print(f"directory: {directory}")
+            _run_make(["make", "--keep-going"], jobs, directory, timeout, env, verbose, stall_timeout)
+            #subprocess.run(["make", "--keep-going", "-j1"], env=env, cwd=directory, timeout=timeout)
+            #print("after run command make")
+        except subprocess.CalledProcessError as err:
+            expected_msg = b"missing separator"
+            if not (err.output is not None and expected_msg in err.output):
+                #print(err.output)
+                raise err
+            else:
+                # Try again using BSD Make instead of GNU Make. Note BSD Make does not have a flag equivalent to
+                # `-B/--always-make`.
+                #print("else bmake")
+                #print(err.output)
+                _run_make(["bmake", "-k"], jobs, directory, timeout, env, verbose, stall_timeout)
 
 
 def unsafe_make(directory: str, timeout: Optional[float] = None, env: Optional[Dict[str, str]] = None,
-                verbose: bool = False) -> CompileResult:
+                verbose: bool = False, clean_repo: bool = True,
+                configure_cache: Optional[ConfigureCache] = None,
+                autoconf_cache: Optional[AutoconfCache] = None,
+                autotools_cache: Optional[AutotoolsCache] = None,
+                job_budget: Optional[JobBudget] = None,
+                elf_types: Optional[Collection[ElfType]] = None,
+                stall_timeout: Optional[float] = None) -> CompileResult:
     r"""Run ``make`` in the given directory and collect compilation outputs.
 
     .. warning::
@@ -224,23 +466,51 @@ def unsafe_make(directory: str, timeout: Optional[float] = None, env: Optional[D
     :param timeout: Maximum time allowed for compilation, in seconds. Defaults to ``None`` (unlimited time).
     :param env: The environment variables to use when calling ``make``.
     :param verbose: If ``True``, print out executed commands and outputs.
+    :param clean_repo: If ``True``, unversioned files are cleaned before compilation.
+    :param configure_cache: If not ``None``, the configure steps are only run if no other variant has run them for
+        this directory, and their results are restored from the cache otherwise. See :class:`ghcc.ConfigureCache`.
+    :param autoconf_cache: If not ``None``, ``./configure`` reuses feature test results of other repositories through
+        this cache. See :class:`ghcc.AutoconfCache`.
+    :param autotools_cache: If not ``None``, outputs of ``autogen.sh``/``autoreconf`` are restored from this cache when
+        their inputs are unchanged. See :class:`ghcc.AutotoolsCache`.
+    :param job_budget: If not ``None``, ``make`` runs with as many jobs as tokens are available in the budget. See
+        :class:`ghcc.utils.JobBudget`.
+    :param elf_types: If not ``None``, only ELF files of these types are collected. Otherwise, all ELF files are.
+    :param stall_timeout: If not ``None``, ``make`` is killed if it produces no output, uses no CPU time, and opens no
+        new files for this many seconds. See :class:`ghcc.utils.StallWatchdog`.
     :return: An instance of :class:`CompileResult` indicating the result. Fields ``success`` and ``elf_files`` are not
         ``None``.
 
         - If compilation failed, the fields ``error_type`` and ``captured_output`` are also not ``None``.
+        - If ``make`` was killed because it stalled, ``stall_reason`` describes the stall.
     """
-    return _make_skeleton(directory, timeout, env, verbose, make_fn=_unsafe_make)
+    return _make_skeleton(directory, timeout, env, verbose, clean_repo, configure_cache, autoconf_cache,
+                          autotools_cache, job_budget, elf_types, stall_timeout, make_fn=_unsafe_make)
 
 
 def _docker_make(directory: str, timeout: Optional[float] = None, env: Optional[Dict[str, str]] = None,
-                 verbose: bool = False) -> None:
+                 verbose: bool = False, configure_cache: Optional[ConfigureCache] = None,
+                 autoconf_cache: Optional[AutoconfCache] = None,
+                 autotools_cache: Optional[AutotoolsCache] = None,
+                 job_budget: Optional[JobBudget] = None, stall_timeout: Optional[float] = None) -> None:
+    if configure_cache is not None or autoconf_cache is not None or autotools_cache is not None:
+        raise ValueError("Configure caching is not supported by `docker_make`, use `docker_batch_compile` instead")
+    if stall_timeout is not None:
+        raise ValueError("Stall detection is not supported by `docker_make`, use `docker_batch_compile` instead")
     #print("_docker_make ********************************")
+    with _acquire_jobs(job_budget) as jobs:
+        _docker_make_with_jobs(directory, jobs, timeout, env, verbose)
+
+
+def _docker_make_with_jobs(directory: str, jobs: int, timeout: Optional[float] = None,
+                           env: Optional[Dict[str, str]] = None, verbose: bool = False) -> None:
     if os.path.isfile(os.path.join(directory, "configure")):
         # Try running `./configure` if it exists.
         # run_docker_command("chmod +x configure && ./configure && make --keep-going -j1",
         #                    user=0, cwd="/usr/src", directory_mapping={directory: "/usr/src"},
         #                    timeout=timeout, shell=True, env=env, verbose=verbose)
-        run_docker_command_other("chmod +x configure && ./configure && echo HELLLOOOOOOOO && make --keep-going -j1",
+        run_docker_command_other(f"chmod +x configure && ./configure && echo HELLLOOOOOOOO && "
+                                 f"({_make_command(jobs)})",
                            user=0, cwd="/usr/src", directory_mapping={directory: "/usr/src"},
                            timeout=timeout, shell=True, env=env, verbose=verbose)
     else:
@@ -249,13 +519,19 @@ def _docker_make(directory: str, timeout: Optional[float] = None, env: Optional[
         # run_docker_command(["make", "--keep-going", "-j1"],
         #                    user=0, cwd="/usr/src", directory_mapping={directory: "/usr/src"},
         #                    timeout=timeout, env=env, verbose=verbose)
-        run_docker_command_other(["make", "--keep-going", "-j1", "&&", "echo", "HELLLOOOOOOOOO"],
+        run_docker_command_other(f"({_make_command(jobs)}) && echo HELLLOOOOOOOOO",
                            user=0, cwd="/usr/src", directory_mapping={directory: "/usr/src"},
                            timeout=timeout, env=env, verbose=verbose)
 
 
 def docker_make(directory: str, timeout: Optional[float] = None, env: Optional[Dict[str, str]] = None,
-                verbose: bool = False) -> CompileResult:
+                verbose: bool = False, clean_repo: bool = True,
+                configure_cache: Optional[ConfigureCache] = None,
+                autoconf_cache: Optional[AutoconfCache] = None,
+                autotools_cache: Optional[AutotoolsCache] = None,
+                job_budget: Optional[JobBudget] = None,
+                elf_types: Optional[Collection[ElfType]] = None,
+                stall_timeout: Optional[float] = None) -> CompileResult:
     r"""Run ``make`` within Docker and collect compilation outputs.
 
     .. note::
@@ -269,13 +545,22 @@ def docker_make(directory: str, timeout: Optional[float] = None, env: Optional[D
     :param timeout: Maximum time allowed for compilation, in seconds. Defaults to ``None`` (unlimited time).
     :param env: The environment variables to use when calling ``make``.
     :param verbose: If ``True``, print out executed commands and outputs.
+    :param clean_repo: If ``True``, unversioned files are cleaned before compilation.
+    :param configure_cache: Not supported, must be ``None``.
+    :param autoconf_cache: Not supported, must be ``None``.
+    :param autotools_cache: Not supported, must be ``None``.
+    :param job_budget: If not ``None``, ``make`` runs with as many jobs as tokens are available in the budget. See
+        :class:`ghcc.utils.JobBudget`.
+    :param elf_types: If not ``None``, only ELF files of these types are collected. Otherwise, all ELF files are.
+    :param stall_timeout: Not supported, must be ``None``.
     :return: An instance of :class:`CompileResult` indicating the result. Fields ``success`` and ``elf_files`` are not
         ``None``.
 
         - If compilation failed, the fields ``error_type`` and ``captured_output`` are also not ``None``.
     """
     #print("docker_make ***************")
-    return _make_skeleton(directory, timeout, env, verbose, make_fn=_docker_make)
+    return _make_skeleton(directory, timeout, env, verbose, clean_repo, configure_cache, autoconf_cache,
+                          autotools_cache, job_budget, elf_types, stall_timeout, make_fn=_docker_make)
 
 
 def _hash_file_sha256(directory: str, path: str) -> str:
@@ -287,15 +572,95 @@ def _hash_file_sha256(directory: str, path: str) -> str:
     path = os.path.join(directory, path)
     hash_obj = hashlib.sha256()
     with open(path, "rb") as f:
-        hash_obj.update(f.read())
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hash_obj.update(chunk)
     return hash_obj.hexdigest()
 
 
+def _copy_with_sha256(path: str, target_dir: str) -> str:
+    r"""Copy the file into the target directory, named after its SHA256 hash, and remove the original file. The file is
+    hashed while being copied, so it is only read once.
+
+    :return: The SHA256 signature.
+    """
+    hash_obj = hashlib.sha256()
+    temp_path = os.path.join(target_dir, f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(path, "rb") as src, open(temp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(HASH_CHUNK_SIZE), b""):
+                hash_obj.update(chunk)
+                dst.write(chunk)
+        shutil.copymode(path, temp_path)
+        signature = hash_obj.hexdigest()
+        os.replace(temp_path, os.path.join(target_dir, signature))
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.remove(path)
+    return signature
+
+
+def _hash_and_move(directory: str, path: str, target_dir: str, hash_fn: Callable[[str, str], str]) -> Tuple[str, int]:
+    r"""Move a binary into the target directory, renamed to its hash signature. Files are renamed if the source and
+    target are on the same file system (and mount). Otherwise, they are copied, and with the default ``hash_fn``,
+    hashed in the same pass.
+
+    :return: A tuple of the hash signature, and the size of the file in bytes.
+    """
+    full_path = os.path.join(directory, path)
+    size = os.path.getsize(full_path)
+    if hash_fn is _hash_file_sha256:
+        # Rename into the target directory first, so the file can be hashed and renamed there.
+        temp_name = f".{uuid.uuid4().hex}.tmp"
+        try:
+            os.rename(full_path, os.path.join(target_dir, temp_name))
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            return _copy_with_sha256(full_path, target_dir), size
+        signature = hash_fn(target_dir, temp_name)
+        os.replace(os.path.join(target_dir, temp_name), os.path.join(target_dir, signature))
+        return signature, size
+    signature = hash_fn(directory, path)
+    shutil.move(full_path, os.path.join(target_dir, signature))  # `shutil.move` renames when possible
+    return signature, size
+
+
+def _estimate_costs(repo_path: str, makefile_dirs: List[str]) -> List[float]:
+    r"""Estimate the relative cost of building each Makefile directory: one plus the number of C/C++ files under the
+    directory, doubled if the directory is configured before ``make``.
+    """
+    repo_path = os.path.abspath(repo_path)
+    index = {os.path.abspath(directory): idx for idx, directory in enumerate(makefile_dirs)}
+    counts = [1] * len(makefile_dirs)
+    for subdir, dirs, files in os.walk(repo_path):
+        dirs[:] = [name for name in dirs if name != ".git"]
+        num_files = sum(name.lower().endswith(C_EXTENSIONS + CPP_EXTENSIONS) for name in files)
+        if num_files == 0:
+            continue
+        # Sources count towards all Makefile directories containing them.
+        path = subdir
+        while True:
+            if path in index:
+                counts[index[path]] += num_files
+            if len(path) <= len(repo_path):
+                break
+            path = os.path.dirname(path)
+    return [count * (2 if _needs_configure(directory) else 1) for count, directory in zip(counts, makefile_dirs)]
+
+
 def compile_and_move(repo_binary_dir: str, repo_path: str, makefile_dirs: List[str], compiler: str,
                      compile_timeout: Optional[float] = None, record_libraries: bool = False,
                      gcc_override_flags: Optional[str] = None,
-                     compile_fn=docker_make, hash_fn: Callable[[str, str], str] = _hash_file_sha256) \
-        -> Iterator:
+                     compile_fn=docker_make, hash_fn: Callable[[str, str], str] = _hash_file_sha256,
+                     clean_repo: bool = True, configure_cache: Optional[ConfigureCache] = None,
+                     autoconf_cache: Optional[AutoconfCache] = None,
+                     autotools_cache: Optional[AutotoolsCache] = None,
+                     job_budget: Optional[JobBudget] = None, object_cache_dir: Optional[str] = None,
+                     bitcode_cache_dir: Optional[str] = None, adv_prelude: Optional[str] = None,
+                     adv_procs: int = 0, elf_types: Optional[Collection[ElfType]] = None,
+                     move_threads: int = 4, stall_timeout: Optional[float] = None) -> Iterator:
     r"""Compile all Makefiles as provided, and move generated binaries to the binary directory.
 
     :param repo_binary_dir: Path to the directory where generated binaries for the repository will be stored.
@@ -303,7 +668,9 @@ def compile_and_move(repo_binary_dir: str, repo_path: str, makefile_dirs: List[s
     :param makefile_dirs: A list of all subdirectories containing Makefiles.
     :param compiler: Type of compiler to use ("gcc" or "g++")
     :param compile_timeout: Maximum time allowed for compilation of all Makefiles, in seconds. Defaults to ``None``
-        (unlimited time).
+        (unlimited time). Each Makefile is allowed a share of the remaining time in proportion to its estimated cost (see
+        :meth:`_estimate_costs`), but at least :attr:`MIN_MAKEFILE_TIMEOUT`. Time left unused by a Makefile is shared
+        by later ones.
     :param record_libraries: If ``True``, A file named ``libraries.txt`` will be generated under
         :attr:`repo_binary_dir`, recording the libraries used in compilation. Defaults to ``False``.
     :param gcc_override_flags: If not ``None``, these flags will be appended to each invocation of GCC.
@@ -313,7 +680,34 @@ def compile_and_move(repo_binary_dir: str, repo_path: str, makefile_dirs: List[s
         to :attr:`repo_binary_dir` and renamed to the generated hash signature. The function takes as input variables
         ``directory`` and ``file``, where ``directory`` is the path of the directory containing the Makefile, and
         ``file`` is the path of the binary, relative to ``directory``.
-    :return: A list of Makefile compilation results.
+    :param clean_repo: If ``True``, the repository is cleaned once before and once after all compilations. Set this to
+        ``False`` if ``repo_path`` is a throwaway snapshot of the repository, to skip the costly reset passes.
+    :param configure_cache: If not ``None``, results of the configure steps are shared with other variants of the
+        repository through this cache. Only supported by :meth:`ghcc.unsafe_make`.
+    :param autoconf_cache: If not ``None``, autoconf feature test results are shared with other repositories through
+        this cache. Only supported by :meth:`ghcc.unsafe_make`.
+    :param autotools_cache: If not ``None``, outputs of autotools are shared with other variants, forks, and reruns
+        through this cache. Only supported by :meth:`ghcc.unsafe_make`.
+    :param job_budget: If not ``None``, each Makefile is built with as many jobs as tokens are available in the budget.
+    :param object_cache_dir: If not ``None``, path to the directory where the mock compilers cache object files. Paths
+        under ``repo_path`` are not part of the cache keys, so objects are shared between variants, forks, and reruns.
+        Cache hits and misses are recorded in a file named ``object_cache_stats.txt`` under :attr:`repo_binary_dir`.
+    :param bitcode_cache_dir: If not ``None``, path to the directory where LLVM bitcode of each source file is shared
+        between variants compiled with clang. Each variant runs its ``-mllvm`` passes through ``opt`` on the shared
+        bitcode, so the clang frontend runs once per source file.
+    :param adv_prelude: If not ``None``, C files in the repository are rewritten by :meth:`ghcc.obfuscate_repo` with
+        this prelude once before all compilations. The rewrite is undone when the repository is cleaned after all
+        compilations. The list of rewritten files is written to ``adv_manifest.json``, and C sources compiled by the
+        mock compilers are recorded in ``compiled_sources.txt``, both under :attr:`repo_binary_dir`.
+    :param adv_procs: Number of processes that rewrite files when ``adv_prelude`` is given.
+    :param elf_types: If not ``None``, only ELF files of these types are collected by ``compile_fn``.
+    :param move_threads: Number of threads that hash and move the binaries of each Makefile.
+    :param stall_timeout: If not ``None``, builds that make no progress for this many seconds are killed before their
+        timeout. Only supported by :meth:`ghcc.unsafe_make`.
+    :return: A list of Makefile compilation results. Besides the paths and hashes of binaries, each entry records the
+        ELF type, architecture, and presence of debugging information of each binary under ``elf_info``, and the total
+        size of the binaries and the time spent moving them under ``bytes_moved`` and ``move_time``. If the build was
+        killed because it stalled, the reason is recorded under ``stall_reason``.
     """
     #print("compile_and_move **************")
     env = {}
@@ -321,33 +715,91 @@ def compile_and_move(repo_binary_dir: str, repo_path: str, makefile_dirs: List[s
         env["MOCK_GCC_LIBRARY_LOG"] = os.path.join(repo_binary_dir, "libraries.txt")
     if gcc_override_flags is not None:
         env["MOCK_GCC_OVERRIDE_FLAGS"] = gcc_override_flags
+    if object_cache_dir is not None:
+        env["MOCK_GCC_OBJECT_CACHE"] = os.path.abspath(object_cache_dir)
+        env["MOCK_GCC_CACHE_STATS"] = os.path.join(repo_binary_dir, "object_cache_stats.txt")
+    if bitcode_cache_dir is not None:
+        env["MOCK_GCC_BITCODE_CACHE"] = os.path.abspath(bitcode_cache_dir)
+    # The repository root is also remapped in debug info, so the base directory is set even if caches are disabled.
+    env["MOCK_GCC_CACHE_BASEDIR"] = os.path.abspath(repo_path)
+    if adv_prelude is not None:
+        env["MOCK_GCC_SOURCE_LOG"] = os.path.join(repo_binary_dir, "compiled_sources.txt")
+        env["MOCK_GCC_SOURCE_BASEDIR"] = os.path.abspath(repo_path)
+        env["MOCK_GCC_ADV_PCH"] = "1"  # sources are rewritten with the includes of the precompiled header
 
     env["COMPILER"] = compiler
     remaining_time = compile_timeout
-    for make_dir in makefile_dirs:
-        if remaining_time is not None and remaining_time <= 0.0:
-            break
-        start_time = time.time()
-        compile_result = compile_fn(make_dir, timeout=remaining_time, env=env)
-        elapsed_time = time.time() - start_time
-        if remaining_time is not None:
-            remaining_time -= elapsed_time
-        # Only record Makefiles that either successfully compiled or yielded binaries.
-        # Successful compilations might not generate binaries, while failed compilations may also yield binaries.
-        if len(compile_result.elf_files) > 0 or compile_result.success:
-            hashes: List[str] = []
-            for path in compile_result.elf_files:
-                signature = hash_fn(make_dir, path)
-                hashes.append(signature)
-                full_path = os.path.join(make_dir, path)
-                shutil.move(full_path, os.path.join(repo_binary_dir, signature))
-            yield {
-                "directory": make_dir,
-                "success": compile_result.success,
-                "binaries": compile_result.elf_files,
-                "sha256": hashes,
-            }
-    clean(repo_path)
+    start_time = time.time()
+    if clean_repo:
+        # Clean the whole repository once. Products of each compilation are found by comparing snapshots of the
+        # directory, so products of earlier compilations are not collected again.
+        clean(repo_path)
+    if adv_prelude is not None:
+        obfuscate_repo(repo_path, adv_prelude, n_procs=adv_procs,
+                       manifest_path=os.path.join(repo_binary_dir, "adv_manifest.json"))
+    if remaining_time is not None:
+        remaining_time -= time.time() - start_time
+    costs = _estimate_costs(repo_path, makefile_dirs) if compile_timeout is not None else None
+    with ThreadPoolExecutor(max_workers=max(1, move_threads)) as executor:
+        for idx, make_dir in enumerate(makefile_dirs):
+            if remaining_time is not None and remaining_time <= 0.0:
+                break
+            timeout = remaining_time
+            if remaining_time is not None and costs is not None:
+                # Don't let a single (e.g. hanging) build starve the following ones.
+                share = remaining_time * costs[idx] / sum(costs[idx:])
+                timeout = min(remaining_time, max(share, MIN_MAKEFILE_TIMEOUT))
+            start_time = time.time()
+            compile_result = compile_fn(make_dir, timeout=timeout, env=env,
+                                        clean_repo=False,
+                                        configure_cache=configure_cache, autoconf_cache=autoconf_cache,
+                                        autotools_cache=autotools_cache, job_budget=job_budget, elf_types=elf_types,
+                                        stall_timeout=stall_timeout)
+            elapsed_time = time.time() - start_time
+            if remaining_time is not None:
+                remaining_time -= elapsed_time
+            # Only record Makefiles that either successfully compiled or yielded binaries.
+            # Successful compilations might not generate binaries, while failed compilations may also yield binaries.
+            if len(compile_result.elf_files) > 0 or compile_result.success:
+                elf_info: List[Optional[Dict[str, Any]]] = []
+                for binary_idx, path in enumerate(compile_result.elf_files):
+                    info = compile_result.elf_info[binary_idx] if compile_result.elf_info else None
+                    if info is None:  # not checked by `compile_fn`
+                        info = read_elf_info(os.path.join(make_dir, path))
+                    elf_info.append({"type": info.type.value, "machine": info.machine, "bits": info.bits,
+                                     "debug_info": info.debug_info} if info is not None else None)
+                move_start_time = time.time()
+                moved = list(executor.map(lambda path: _hash_and_move(make_dir, path, repo_binary_dir, hash_fn),
+                                          compile_result.elf_files))
+                yield {
+                    "directory": make_dir,
+                    "success": compile_result.success,
+                    "binaries": compile_result.elf_files,
+                    "sha256": [signature for signature, _ in moved],
+                    "elf_info": elf_info,
+                    "bytes_moved": sum(size for _, size in moved),
+                    "move_time": time.time() - move_start_time,
+                    "stall_reason": compile_result.stall_reason,
+                }
+    if clean_repo:
+        clean(repo_path)
+
+
+def _read_batch_results(path: str) -> List[Dict[str, Any]]:
+    r"""Read the Makefile entries written by ``batch_make.py``, one JSON record per line. Records are written as soon as
+    each Makefile finishes, so results of finished Makefiles are kept even if the compilation was killed. A record
+    that was cut off by the kill is skipped.
+    """
+    makefiles: List[Dict[str, Any]] = []
+    if not os.path.exists(path):
+        return makefiles
+    with open(path) as f:
+        for line in f:
+            try:
+                makefiles.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass  # partially written record
+    return makefiles
 
 
 def docker_batch_compile(repo_binary_dir: str, repo_path: str, compiler: str,
@@ -355,7 +807,16 @@ def docker_batch_compile(repo_binary_dir: str, repo_path: str, compiler: str,
                          gcc_override_flags: Optional[str] = None,
                          use_makefile_info_pkl: bool = False, verbose: bool = False,
                          user_id: Optional[int] = None, directory_mapping: Optional[Dict[str, str]] = None,
-                         exception_log_fn=None) -> List:
+                         exception_log_fn=None, pool: Optional[ContainerPool] = None,
+                         log_path: Optional[str] = None, client: Optional[DockerClient] = None,
+                         clean_repo: bool = True, configure_cache_dir: Optional[str] = None,
+                         autoconf_cache_dir: Optional[str] = None, autotools_cache_dir: Optional[str] = None,
+                         autotools_cache_size: Optional[int] = None, job_budget: Optional[JobBudget] = None,
+                         object_cache_dir: Optional[str] = None, bitcode_cache_dir: Optional[str] = None,
+                         adv_obfuscation: bool = False, adv_procs: int = 0,
+                         makefile_dirs: Optional[List[str]] = None,
+                         elf_types: Optional[Collection[ElfType]] = None,
+                         stall_timeout: Optional[float] = None) -> List:
     r"""Run batch compilation in Docker.
 
     :param repo_binary_dir: Path to store collected binaries.
@@ -373,10 +834,51 @@ def docker_batch_compile(repo_binary_dir: str, repo_path: str, compiler: str,
     :param directory_mapping: Additional directory mappings for Docker. Optional.
     :param exception_log_fn: A function to log exceptions occurred in Docker. The function takes the exception object
         as input and returns nothing.
-    :return: A list of Makefile entries.
+    :param pool: If not ``None``, compilation is run in a long-lived container from the pool instead of a fresh
+        container. Both ``repo_path`` and ``repo_binary_dir`` must be under directories mounted by the pool, and
+        ``directory_mapping`` is not supported.
+    :param log_path: Path to the file where output of the compilation is appended. If ``None``, only the tail of the
+        output is kept for error messages.
+    :param client: If not ``None``, the container is run through the Docker Engine API instead of the ``docker`` CLI.
+        Ignored when ``pool`` is specified, since the pool has its own client.
+    :param clean_repo: If ``True``, the repository is cleaned before and after all compilations. Set this to
+        ``False`` if ``repo_path`` is a throwaway snapshot of the repository.
+    :param configure_cache_dir: If not ``None``, path to the directory where results of the configure steps are
+        shared between variants of the repository. See :class:`ghcc.ConfigureCache`. When using a container pool, the
+        directory must be under directories mounted by the pool.
+    :param autoconf_cache_dir: If not ``None``, path to the directory where autoconf feature test results are shared
+        between repositories. See :class:`ghcc.AutoconfCache`. When using a container pool, the directory must be under
+        directories mounted by the pool. Its ownership is not transferred, since it is shared by all users.
+    :param autotools_cache_dir: If not ``None``, path to the directory where outputs of autotools are shared between
+        repositories. See :class:`ghcc.AutotoolsCache`. The same constraints as ``autoconf_cache_dir`` apply.
+    :param autotools_cache_size: Maximum total size (in bytes) of the autotools cache. If ``None``, it is unbounded.
+    :param job_budget: If not ``None``, each Makefile is built with as many jobs as tokens are available in the budget.
+        See :class:`ghcc.utils.JobBudget`. The same constraints as ``autoconf_cache_dir`` apply to its path.
+    :param object_cache_dir: If not ``None``, path to the directory where object files are cached by the mock compilers.
+        See :meth:`compile_and_move`. The same constraints as ``autoconf_cache_dir`` apply.
+    :param bitcode_cache_dir: If not ``None``, path to the directory where LLVM bitcode is shared between variants of
+        the repository. See :meth:`compile_and_move`. The same constraints as ``configure_cache_dir`` apply.
+    :param adv_obfuscation: If ``True``, C files are rewritten by ADVobfuscator in the container before compilation,
+        using the library installed under ``/Lib``. See :meth:`compile_and_move`.
+    :param adv_procs: Number of processes that rewrite files when ``adv_obfuscation`` is ``True``.
+    :param makefile_dirs: If not ``None``, the directories containing Makefiles, e.g. from :meth:`scan_repo`. They are
+        passed to the container through ``makefile_dirs.json`` under ``repo_binary_dir``, so the repository is not
+        scanned again. Not supported with ``use_makefile_info_pkl``.
+    :param elf_types: If not ``None``, only ELF files of these types are collected. Otherwise, all ELF files are.
+    :param stall_timeout: If not ``None``, builds that make no progress for this many seconds are killed before their
+        timeout. See :meth:`compile_and_move`.
+    :return: A list of Makefile entries, read from ``results.jsonl`` written by the container under
+        ``repo_binary_dir``. If compilation timed out or was killed, entries of Makefiles that finished are returned.
     """
     #print("docker_batch_compile *****************")
     start_time = time.time()
+    results_path = os.path.join(repo_binary_dir, BATCH_RESULTS_FILE)
+    if os.path.exists(results_path):
+        os.remove(results_path)  # left over from an interrupted run
+    makefile_dirs_path = os.path.join(repo_binary_dir, "makefile_dirs.json")
+    if makefile_dirs is not None:
+        with open(makefile_dirs_path, "w") as f:
+            json.dump([os.path.relpath(directory, repo_path) for directory in makefile_dirs], f)
     try:
         # Don't rely on Docker timeout, but instead constrain running time in script run in Docker. Otherwise we won't
         # get the results file if any compilation task timeouts.
@@ -388,15 +890,67 @@ def docker_batch_compile(repo_binary_dir: str, repo_path: str, compiler: str,
             # incorrectly interpreted by `argparse`.
             *([f'--gcc-override-flags="{gcc_override_flags}"'] if gcc_override_flags is not None else []),
             *(["--use-makefile-info-pkl"] if use_makefile_info_pkl else []),
+            *(["--use-makefile-dirs-json"] if makefile_dirs is not None else []),
+            *([f"--elf-types={','.join(elf_type.value for elf_type in elf_types)}"] if elf_types is not None else []),
             *(["--verbose"] if verbose else []),
+            *(["--no-clean"] if not clean_repo else []),
+            *([f"--autotools-cache-size={autotools_cache_size}"] if autotools_cache_size is not None else []),
+            *([f"--job-budget-size={job_budget.size}", f"--max-make-jobs={job_budget.max_jobs}"]
+              if job_budget is not None else []),
+            *(["--adv-obfuscation", f"--adv-procs={adv_procs}"] if adv_obfuscation else []),
+            *([f"--stall-timeout={stall_timeout}"] if stall_timeout is not None else []),
             *([f"--compiler={compiler}"])
         ]
         # ret = run_docker_command(cmd, user=user_id, return_output=True,
         #                          directory_mapping={repo_path: "/usr/src/repo", repo_binary_dir: "/usr/src/bin",
         #                                             **(directory_mapping or {})})
-        ret = run_docker_command_other(cmd, user=user_id, return_output=True,
-                                 directory_mapping={repo_path: "/usr/src/repo", repo_binary_dir: "/usr/src/bin",
-                                                    **(directory_mapping or {})})
+        if pool is not None:
+            if directory_mapping:
+                raise ValueError("Additional directory mappings are not supported when using a container pool")
+            container_repo_path = pool.container_path(repo_path)
+            container_binary_path = pool.container_path(repo_binary_dir)
+            cmd.extend([f"--repo-path={container_repo_path}", f"--binary-path={container_binary_path}"])
+            chown_paths = [container_repo_path, container_binary_path]
+            if configure_cache_dir is not None:
+                container_cache_path = pool.container_path(configure_cache_dir)
+                cmd.append(f"--configure-cache={container_cache_path}")
+                chown_paths.append(container_cache_path)
+            if autoconf_cache_dir is not None:
+                cmd.append(f"--autoconf-cache={pool.container_path(autoconf_cache_dir)}")
+            if autotools_cache_dir is not None:
+                cmd.append(f"--autotools-cache={pool.container_path(autotools_cache_dir)}")
+            if job_budget is not None:
+                cmd.append(f"--job-budget={pool.container_path(job_budget.path)}")
+            if object_cache_dir is not None:
+                cmd.append(f"--object-cache={pool.container_path(object_cache_dir)}")
+            if bitcode_cache_dir is not None:
+                container_bitcode_path = pool.container_path(bitcode_cache_dir)
+                cmd.append(f"--bitcode-cache={container_bitcode_path}")
+                chown_paths.append(container_bitcode_path)
+            ret = pool.get_container().exec(cmd, user=user_id, return_output=True, log_path=log_path,
+                                            chown_paths=chown_paths)
+        else:
+            mapping = {repo_path: "/usr/src/repo", repo_binary_dir: "/usr/src/bin"}
+            if configure_cache_dir is not None:
+                mapping[configure_cache_dir] = "/usr/src/configure"
+                cmd.append("--configure-cache=/usr/src/configure")
+            if autoconf_cache_dir is not None:
+                mapping[autoconf_cache_dir] = "/usr/src/autoconf"
+                cmd.append("--autoconf-cache=/usr/src/autoconf")
+            if autotools_cache_dir is not None:
+                mapping[autotools_cache_dir] = "/usr/src/autotools"
+                cmd.append("--autotools-cache=/usr/src/autotools")
+            if job_budget is not None:
+                mapping[job_budget.path] = "/usr/src/jobs"
+                cmd.append("--job-budget=/usr/src/jobs")
+            if object_cache_dir is not None:
+                mapping[object_cache_dir] = "/usr/src/objects"
+                cmd.append("--object-cache=/usr/src/objects")
+            if bitcode_cache_dir is not None:
+                mapping[bitcode_cache_dir] = "/usr/src/bitcode"
+                cmd.append("--bitcode-cache=/usr/src/bitcode")
+            ret = run_docker_command_other(cmd, user=user_id, return_output=True, log_path=log_path, client=client,
+                                           directory_mapping={**mapping, **(directory_mapping or {})})
     except subprocess.CalledProcessError as e:
         end_time = time.time()
         if ((compile_timeout is not None and end_time - start_time > compile_timeout) or
@@ -409,14 +963,11 @@ def docker_batch_compile(repo_binary_dir: str, repo_path: str, compiler: str,
         else:
             # Otherwise, it might be because Docker broke down or something.
             raise e
-
-    log_path = os.path.join(repo_binary_dir, "log.pkl")
-    makefiles = []
-    if os.path.exists(log_path):
-        try:
-            with open(log_path, "rb") as f:
-                makefiles = pickle.load(f)
-        except Exception:
-            makefiles = []
-        os.remove(log_path)
+    finally:
+        # Records are flushed by the container as each Makefile finishes, and the file outlives the container, so
+        # reading it once the command returns (normally, on timeout, or after a kill) sees every finished Makefile.
+        makefiles = _read_batch_results(results_path)
+        for path in [makefile_dirs_path, results_path]:
+            if os.path.exists(path):
+                os.remove(path)
     return makefiles
@@ -0,0 +1,150 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import subprocess
+import tarfile
+from typing import Iterator, List, Optional
+
+from .utils.archive import extract_archive
+
+__all__ = [
+    "ConfigureCache",
+]
+
+
+class ConfigureCache:
+    r"""A store of the tree state produced by the configure steps (``autogen.sh``/``autoreconf`` and ``./configure``)
+    of a repository, shared by all variants that compile the repository.
+
+    The first variant to reach a Makefile directory runs the configure steps, and saves every file they create or
+    modify: generated Makefiles, ``config.h``, ``config.status``, etc. Other variants restore these files instead of
+    configuring again. The compiler of each variant is still honored, since the mock ``gcc``/``clang`` wrappers pick the
+    actual compiler through the ``COMPILER`` and ``MOCK_GCC_OVERRIDE_FLAGS`` environment variables on every invocation.
+
+    Variants may be compiled in different snapshots of the repository, so absolute paths of the repository in restored
+    files are rewritten. Saved states are protected by file locks, so the cache can be shared by concurrent processes.
+
+    :param path: Path to the directory where states are stored. It is created if it does not exist.
+    :param repo_path: Path to the repository (or the snapshot of it) being compiled.
+    """
+
+    def __init__(self, path: str, repo_path: str):
+        self.path = os.path.abspath(path)
+        self.repo_path = os.path.abspath(repo_path)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _key(self, directory: str) -> str:
+        relpath = os.path.relpath(os.path.abspath(directory), self.repo_path)
+        return hashlib.sha256(relpath.encode('utf-8')).hexdigest()[:16]
+
+    def _file(self, directory: str, suffix: str) -> str:
+        return os.path.join(self.path, self._key(directory) + suffix)
+
+    @contextlib.contextmanager
+    def lock(self, directory: str) -> Iterator[None]:
+        r"""Hold an exclusive lock on the state of the directory. Other processes calling this method with the same
+        directory block until the lock is released, which happens automatically if the holding process dies.
+        """
+        with open(self._file(directory, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def start(self, directory: str) -> int:
+        r"""Mark the start of the configure steps for the directory. Files modified after this point are saved by
+        :meth:`save`.
+
+        :return: The timestamp (in nanoseconds) to pass to :meth:`save`.
+        """
+        # Use the modification time of a new file instead of the current time, since file timestamps are taken from a
+        # coarser clock.
+        stamp_path = self._file(directory, ".stamp")
+        with open(stamp_path, "w"):
+            pass
+        return os.stat(stamp_path).st_mtime_ns
+
+    def _modified_files(self, directory: str, start_time: int) -> List[str]:
+        files = []
+        for subdir, dirs, filenames in os.walk(directory):
+            if ".git" in dirs:
+                dirs.remove(".git")
+            for name in filenames:
+                path = os.path.join(subdir, name)
+                if os.lstat(path).st_mtime_ns >= start_time:
+                    files.append(os.path.relpath(path, directory))
+        return files
+
+    def save(self, directory: str, start_time: int, error: Optional[subprocess.CalledProcessError] = None) -> None:
+        r"""Save files created or modified in the directory by the configure steps.
+
+        :param directory: The directory that was configured.
+        :param start_time: The timestamp returned by :meth:`start`.
+        :param error: If the configure steps failed, the raised exception, which is re-raised when restoring.
+        """
+        directory = os.path.abspath(directory)
+        archive_path = self._file(directory, ".tar")
+        # The PAX format keeps sub-second modification times, which `make` relies on.
+        # Symlinks are stored as the files they point to, since links are not extracted when restoring.
+        with tarfile.open(archive_path + ".tmp", "w", format=tarfile.PAX_FORMAT, dereference=True) as tar:
+            if error is None:
+                for file in self._modified_files(directory, start_time):
+                    path = os.path.join(directory, file)
+                    if os.path.isfile(path):
+                        tar.add(path, arcname=file, recursive=False)
+        os.replace(archive_path + ".tmp", archive_path)
+        meta = {"repo_path": self.repo_path}
+        if error is not None:
+            output = error.output or b""
+            if isinstance(output, bytes):
+                output = output.decode('utf-8', errors='replace')
+            meta["error"] = {"return_code": error.returncode, "cmd": error.cmd, "output": output}
+        # The metadata file is written last, so a state is only visible after it's completely saved.
+        meta_path = self._file(directory, ".json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def restore(self, directory: str) -> bool:
+        r"""Restore the saved state of the directory, if it exists.
+
+        :param directory: The directory to restore files into.
+        :return: Whether a saved state was restored.
+        :raises subprocess.CalledProcessError: If the configure steps failed when the state was saved.
+        """
+        directory = os.path.abspath(directory)
+        meta_path = self._file(directory, ".json")
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if "error" in meta:
+            error = meta["error"]
+            raise subprocess.CalledProcessError(error["return_code"], error["cmd"],
+                                                output=error["output"].encode('utf-8'))
+        try:
+            with tarfile.open(self._file(directory, ".tar")) as tar:
+                # Files are replaced instead of written into, in case they are hard links to files in the original.
+                members = extract_archive(tar, directory)
+        except tarfile.TarError:
+            return False  # configure again and overwrite the saved state
+
+        old_path = meta["repo_path"].encode('utf-8')
+        new_path = self.repo_path.encode('utf-8')
+        if old_path != new_path:
+            # Generated files (e.g. `config.status` and Makefiles) contain absolute paths of the configured repository.
+            for member in members:
+                if not member.isfile():
+                    continue
+                path = os.path.join(directory, member.name)
+                with open(path, "rb") as f:
+                    contents = f.read()
+                if old_path in contents:
+                    with open(path, "wb") as f:
+                        f.write(contents.replace(old_path, new_path))
+                    # Keep the original timestamp, otherwise `make` might decide to regenerate files.
+                    os.utime(path, (member.mtime, member.mtime))
+        return True
@@ -0,0 +1,151 @@
+import struct
+from enum import Enum
+from typing import Collection, NamedTuple, Optional
+
+__all__ = [
+    "ElfType",
+    "ElfInfo",
+    "DEFAULT_ELF_TYPES",
+    "read_elf_info",
+    "has_debug_info",
+]
+
+ELF_MAGIC = b"\x7fELF"
+ELF_HEADER_SIZE = 64  # size of the header for 64-bit ELF files; 32-bit headers are smaller
+
+ET_REL, ET_EXEC, ET_DYN, ET_CORE = 1, 2, 3, 4
+PT_INTERP = 3
+
+# Names of common `e_machine` values.
+MACHINES = {
+    2: "sparc", 3: "x86", 8: "mips", 20: "ppc", 21: "ppc64", 40: "arm", 43: "sparcv9", 62: "x86_64", 183: "aarch64",
+    243: "riscv",
+}
+
+
+class ElfType(Enum):
+    Executable = "executable"  # statically positioned executable (`ET_EXEC`)
+    PIE = "pie"  # position-independent executable (`ET_DYN` with a program interpreter)
+    Shared = "shared"  # shared library (`ET_DYN` without a program interpreter)
+    Relocatable = "relocatable"  # object file (`ET_REL`)
+    Core = "core"  # core dump (`ET_CORE`)
+
+
+# Linked binaries. Object files are the inputs of these binaries, and core dumps come from crashed tests.
+DEFAULT_ELF_TYPES = frozenset([ElfType.Executable, ElfType.PIE, ElfType.Shared])
+
+
+class ElfInfo(NamedTuple):
+    type: ElfType
+    machine: str  # architecture, e.g. "x86_64"
+    bits: int  # 32 or 64
+    debug_info: bool  # whether the file contains DWARF debugging information
+
+
+class _Header(NamedTuple):
+    fmt: str  # `struct` prefix for the byte order
+    is_64: bool
+    type: int
+    machine: int
+    phoff: int
+    shoff: int
+    phentsize: int
+    phnum: int
+    shentsize: int
+    shnum: int
+    shstrndx: int
+
+
+def _parse_header(data: bytes) -> Optional[_Header]:
+    if len(data) < 52 or data[:4] != ELF_MAGIC or data[4] not in (1, 2) or data[5] not in (1, 2):
+        return None
+    fmt = "<" if data[5] == 1 else ">"
+    is_64 = data[4] == 2
+    if is_64:
+        if len(data) < ELF_HEADER_SIZE:
+            return None
+        e_type, e_machine, _, _, phoff, shoff, _, _, phentsize, phnum, shentsize, shnum, shstrndx = \
+            struct.unpack_from(fmt + "HHIQQQIHHHHHH", data, 16)
+    else:
+        e_type, e_machine, _, _, phoff, shoff, _, _, phentsize, phnum, shentsize, shnum, shstrndx = \
+            struct.unpack_from(fmt + "HHIIIIIHHHHHH", data, 16)
+    return _Header(fmt, is_64, e_type, e_machine, phoff, shoff, phentsize, phnum, shentsize, shnum, shstrndx)
+
+
+def _has_interpreter(f, header: _Header) -> bool:
+    if header.phnum == 0 or header.phentsize < 4:
+        return False
+    f.seek(header.phoff)
+    data = f.read(header.phentsize * header.phnum)
+    for offset in range(0, len(data) - 3, header.phentsize):
+        p_type, = struct.unpack_from(header.fmt + "I", data, offset)
+        if p_type == PT_INTERP:
+            return True
+    return False
+
+
+def _has_debug_info(f, header: _Header) -> bool:
+    if header.shnum == 0 or header.shstrndx >= header.shnum:
+        return False
+    f.seek(header.shoff)
+    sections = f.read(header.shentsize * header.shnum)
+    # `sh_name` is the first field, `sh_offset` and `sh_size` follow `sh_type`, `sh_flags`, and `sh_addr`.
+    entry_fmt = header.fmt + ("IIQQQQ" if header.is_64 else "IIIIII")
+    _, _, _, _, names_offset, names_size = struct.unpack_from(entry_fmt, sections, header.shstrndx * header.shentsize)
+    f.seek(names_offset)
+    names = f.read(names_size)
+    for idx in range(header.shnum):
+        name_offset, = struct.unpack_from(header.fmt + "I", sections, idx * header.shentsize)
+        name = names[name_offset:names.find(b"\0", name_offset)]
+        if name in (b".debug_info", b".zdebug_info"):
+            return True
+    return False
+
+
+def read_elf_info(path: str, types: Optional[Collection[ElfType]] = None) -> Optional[ElfInfo]:
+    r"""Classify an ELF file by reading its header, without spawning ``file``. Program headers are only read to tell
+    position-independent executables from shared libraries, and section headers are only read for accepted files.
+
+    :param path: Path to the file.
+    :param types: If not ``None``, only ELF files of these types are accepted.
+    :return: An :class:`ElfInfo` object, or ``None`` if the file is not an accepted ELF file, or cannot be read.
+    """
+    try:
+        with open(path, "rb") as f:
+            header = _parse_header(f.read(ELF_HEADER_SIZE))
+            if header is None:
+                return None
+            if header.type == ET_EXEC:
+                elf_type = ElfType.Executable
+            elif header.type == ET_DYN:
+                if types is not None and ElfType.PIE not in types and ElfType.Shared not in types:
+                    return None
+                elf_type = ElfType.PIE if _has_interpreter(f, header) else ElfType.Shared
+            elif header.type == ET_REL:
+                elf_type = ElfType.Relocatable
+            elif header.type == ET_CORE:
+                elf_type = ElfType.Core
+            else:
+                return None
+            if types is not None and elf_type not in types:
+                return None
+            debug_info = _has_debug_info(f, header)
+    except (OSError, struct.error):
+        return None
+    return ElfInfo(elf_type, MACHINES.get(header.machine, str(header.machine)), 64 if header.is_64 else 32, debug_info)
+
+
+def has_debug_info(path: str) -> bool:
+    r"""Check whether the ELF file contains DWARF debugging information, i.e., a ``.debug_info`` section (possibly
+    compressed as ``.zdebug_info``). Only the section headers and section names are read.
+
+    :param path: Path to the ELF file.
+    """
+    try:
+        with open(path, "rb") as f:
+            header = _parse_header(f.read(ELF_HEADER_SIZE))
+            return header is not None and _has_debug_info(f, header)
+    except (OSError, struct.error):
+        return False
+
+
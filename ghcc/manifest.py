@@ -0,0 +1,221 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+__all__ = [
+    "VariantStatus",
+    "RepoStatus",
+    "CrawlManifest",
+]
+
+
+class VariantStatus:
+    Running = "running"  # started but not finished; the process might have crashed, so this is retried
+    Done = "done"
+    Failed = "failed"  # finished, but with a result that won't change when retried
+
+
+class RepoStatus:
+    Done = "done"  # all variants are finished
+    Failed = "failed"  # the repository cannot be processed, e.g. it is private or has no Makefiles
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    repo TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    commit_hash TEXT,
+    repo_size INTEGER,
+    message TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS variants (
+    repo TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    status TEXT NOT NULL,
+    commit_hash TEXT,
+    compiler TEXT,
+    flags TEXT,
+    start_time REAL,
+    end_time REAL,
+    record TEXT,
+    makefiles TEXT,
+    PRIMARY KEY (repo, variant)
+);
+CREATE TABLE IF NOT EXISTS builds (
+    commit_hash TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    compiler TEXT NOT NULL,
+    flags TEXT NOT NULL,
+    image_id TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    makefiles TEXT NOT NULL,
+    record TEXT,
+    libraries TEXT,
+    meta_info TEXT,
+    PRIMARY KEY (commit_hash, variant, compiler, flags, image_id)
+);
+"""
+
+
+class CrawlManifest:
+    r"""A crash-safe record of crawling progress, stored in an SQLite database in WAL mode.
+
+    Progress is recorded per repository, and per (repository, variant) pair, where a variant is one obfuscation
+    configuration that the repository is compiled with. Each update is committed in its own transaction, so a crash
+    loses at most the variant that was being compiled, and a restarted run can skip everything that is finished.
+
+    Successful builds are also indexed by commit hash and build configuration (see :meth:`record_build`), so forks and
+    mirrors of a repository with the same HEAD can reuse the binaries of the first build.
+
+    The manifest can be pickled and passed to worker processes. Each process (and thread) opens its own connection
+    lazily. Call :meth:`close` before forking if the manifest has been used in the parent process.
+
+    :param path: Path to the database file. It is created if it does not exist.
+    :param timeout: Number of seconds to wait when the database is locked by another writer.
+    """
+
+    def __init__(self, path: str, timeout: float = 60.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        # The setup connection is closed right away: an SQLite connection must not be open in a process that forks
+        # (e.g. to start worker processes), or the locks of the children could be corrupted.
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            with conn:
+                # The journal mode is stored in the database. Changing it needs an exclusive lock, which is not retried
+                # with the busy timeout, so it's only set here instead of for each connection.
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"path": self.path, "timeout": self.timeout}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # Connections cannot be shared with forked processes; open a new one.
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.row_factory = sqlite3.Row
+            # In WAL mode, this is still safe against application crashes, and avoids an fsync per transaction.
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    def repo_status(self, repo: str) -> Optional[str]:
+        r"""Return the status of the repository (see :class:`RepoStatus`), or ``None`` if it is not finished."""
+        row = self._connection().execute("SELECT status FROM repos WHERE repo = ?", (repo,)).fetchone()
+        return row["status"] if row is not None else None
+
+    def finished_repos(self) -> Set[str]:
+        return {row["repo"] for row in self._connection().execute("SELECT repo FROM repos")}
+
+    def finish_repo(self, repo: str, status: str, commit_hash: Optional[str] = None, repo_size: Optional[int] = None,
+                    message: Optional[str] = None) -> None:
+        r"""Mark the repository as finished, so it is skipped when the crawl is resumed.
+
+        :param status: One of :class:`RepoStatus`.
+        :param message: An optional description of why the repository finished with this status.
+        """
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO repos (repo, status, commit_hash, repo_size, message, updated_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", (repo, status, commit_hash, repo_size, message, time.time()))
+
+    def finished_variants(self, repo: str) -> Set[str]:
+        r"""Return the names of variants of the repository that are finished, either successfully or not."""
+        rows = self._connection().execute("SELECT variant FROM variants WHERE repo = ? AND status != ?",
+                                          (repo, VariantStatus.Running))
+        return {row["variant"] for row in rows}
+
+    def start_variant(self, repo: str, variant: str, commit_hash: Optional[str] = None,
+                      compiler: Optional[str] = None, flags: Optional[str] = None) -> None:
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO variants (repo, variant, status, commit_hash, compiler, flags, "
+                         "start_time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (repo, variant, VariantStatus.Running, commit_hash, compiler, flags, time.time()))
+
+    def finish_variant(self, repo: str, variant: str, status: str, record: Optional[Dict[str, Any]] = None,
+                       makefiles: Optional[List[Dict[str, Any]]] = None) -> None:
+        r"""Mark a variant as finished. The variant must have been started by :meth:`start_variant`.
+
+        :param status: One of :class:`VariantStatus`.
+        :param record: The meta-data record of the repository, which is exported by :meth:`export_json`.
+        :param makefiles: The list of Makefile entries produced by compilation, including paths and hashes of binaries.
+        """
+        with self._connection() as conn:
+            conn.execute("UPDATE variants SET status = ?, end_time = ?, record = ?, makefiles = ? "
+                         "WHERE repo = ? AND variant = ?",
+                         (status, time.time(), json.dumps(record) if record is not None else None,
+                          json.dumps(makefiles) if makefiles is not None else None, repo, variant))
+
+    def iter_variants(self, repo: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        r"""Iterate over the entries of finished variants, optionally only for a specific repository."""
+        query = "SELECT * FROM variants WHERE status != ?"
+        params: List[Any] = [VariantStatus.Running]
+        if repo is not None:
+            query += " AND repo = ?"
+            params.append(repo)
+        for row in self._connection().execute(query + " ORDER BY rowid", params):
+            entry = dict(row)
+            entry["record"] = json.loads(entry["record"]) if entry["record"] is not None else None
+            entry["makefiles"] = json.loads(entry["makefiles"]) if entry["makefiles"] is not None else None
+            yield entry
+
+    def export_json(self, path: str) -> None:
+        r"""Write meta-data records of all finished variants as a JSON list. The file is replaced atomically."""
+        records = [entry["record"] for entry in self.iter_variants() if entry["record"] is not None]
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            # One record per line, same as the format previously appended by workers.
+            f.write("[" + ",\n".join(json.dumps(record) for record in records) + "]")
+        os.replace(temp_path, path)
+
+    def record_build(self, commit_hash: str, variant: str, compiler: str, flags: Optional[str], image_id: str,
+                     repo: str, makefiles: List[Dict[str, Any]], record: Optional[Dict[str, Any]] = None,
+                     libraries: Optional[List[str]] = None, meta_info: Optional[Dict[str, Any]] = None) -> None:
+        r"""Index the results of a successful build by the commit and build configuration.
+
+        :param commit_hash: The commit that was compiled, i.e., HEAD of the repository.
+        :param image_id: ID of the Docker image the build ran in.
+        :param repo: The repository whose binary folder holds the binaries of the build.
+        :param makefiles: The list of Makefile entries produced by compilation.
+        :param record: The meta-data record of the repository.
+        :param libraries: Libraries used in compilation, if recorded.
+        :param meta_info: Additional meta-info of the repository.
+        """
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO builds (commit_hash, variant, compiler, flags, image_id, repo, "
+                         "makefiles, record, libraries, meta_info) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (commit_hash, variant, compiler, flags or "", image_id, repo, json.dumps(makefiles),
+                          *(json.dumps(value) if value is not None else None
+                            for value in [record, libraries, meta_info])))
+
+    def find_build(self, commit_hash: str, variant: str, compiler: str, flags: Optional[str],
+                   image_id: str) -> Optional[Dict[str, Any]]:
+        r"""Return the results of a previous build of the commit with the same configuration, or ``None`` if there is
+        none. Values are as passed to :meth:`record_build`."""
+        row = self._connection().execute(
+            "SELECT repo, makefiles, record, libraries, meta_info FROM builds "
+            "WHERE commit_hash = ? AND variant = ? AND compiler = ? AND flags = ? AND image_id = ?",
+            (commit_hash, variant, compiler, flags or "", image_id)).fetchone()
+        if row is None:
+            return None
+        return {key: (json.loads(row[key]) if key != "repo" and row[key] is not None else row[key])
+                for key in row.keys()}
@@ -0,0 +1,113 @@
+import os
+import shutil
+import subprocess
+from enum import Enum
+from typing import Dict, List, Optional
+
+from flutes.run import run_command
+
+__all__ = [
+    "SnapshotMethod",
+    "RepoSnapshot",
+]
+
+
+class SnapshotMethod(Enum):
+    Reflink = "reflink"  # copy-on-write copy of file contents; needs a filesystem that supports it (Btrfs, XFS, ...)
+    Overlay = "overlay"  # overlayfs mount on top of the original; needs root privileges
+    Hardlink = "hardlink"  # hard links to the original files; files modified in-place also change the original!
+    Copy = "copy"  # plain recursive copy
+
+
+# Whether reflinks are supported, keyed by device ID of the source directory.
+_reflink_supported: Dict[int, bool] = {}
+
+
+def _try_command(args: List[str], dest: str) -> bool:
+    try:
+        run_command(args)
+        return True
+    except subprocess.CalledProcessError:
+        if os.path.lexists(dest):
+            shutil.rmtree(dest, ignore_errors=True)
+        return False
+
+
+class RepoSnapshot:
+    r"""A throwaway view of a directory (usually a pristine repository checkout), which can be modified without
+    affecting the original. This can be used as a context manager, in which case the snapshot is removed on exit.
+
+    The snapshot is created by the first applicable method among ``methods``. By default, these are tried in order:
+
+    - Reflink: a copy-on-write copy, which is almost free when the filesystem supports it.
+    - Overlay: an overlayfs mount with the original as the lower layer. Only tried when running as root.
+    - Copy: a plain recursive copy.
+
+    Hard link farms (:attr:`SnapshotMethod.Hardlink`) are only used if explicitly requested, because build steps that
+    modify files in-place would also modify the original.
+
+    :param source: Path to the original directory.
+    :param dest: Path to the snapshot. Must not exist.
+    :param methods: Methods to try, in order. Defaults to reflink, overlay, and copy.
+    """
+
+    def __init__(self, source: str, dest: str, methods: Optional[List[SnapshotMethod]] = None):
+        if methods is None:
+            methods = [SnapshotMethod.Reflink, SnapshotMethod.Overlay, SnapshotMethod.Copy]
+        self.source = os.path.abspath(source)
+        self.path = os.path.abspath(dest)
+        if os.path.lexists(self.path):
+            raise ValueError(f"Snapshot destination '{dest}' already exists")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        for method in methods:
+            if self._create(method):
+                self.method = method
+                break
+        else:
+            raise ValueError(f"Failed to create snapshot of '{source}' with methods {[m.value for m in methods]}")
+
+    @property
+    def _overlay_dirs(self) -> List[str]:
+        return [self.path + ".upper", self.path + ".work"]
+
+    def _create(self, method: SnapshotMethod) -> bool:
+        if method is SnapshotMethod.Reflink:
+            device = os.stat(self.source).st_dev
+            if _reflink_supported.get(device, True):
+                _reflink_supported[device] = _try_command(
+                    ["cp", "-a", "--reflink=always", self.source, self.path], self.path)
+            return _reflink_supported[device]
+        if method is SnapshotMethod.Overlay:
+            if os.geteuid() != 0:
+                return False
+            upper_dir, work_dir = self._overlay_dirs
+            for directory in [self.path, upper_dir, work_dir]:
+                os.makedirs(directory)
+            if _try_command(["mount", "-t", "overlay", "overlay", "-o",
+                             f"lowerdir={self.source},upperdir={upper_dir},workdir={work_dir}", self.path],
+                            self.path):
+                return True
+            for directory in self._overlay_dirs:
+                shutil.rmtree(directory, ignore_errors=True)
+            return False
+        if method is SnapshotMethod.Hardlink:
+            return _try_command(["cp", "-al", self.source, self.path], self.path)
+        if method is SnapshotMethod.Copy:
+            return _try_command(["cp", "-a", self.source, self.path], self.path)
+        raise ValueError(f"Invalid snapshot method {method}")
+
+    def remove(self) -> None:
+        r"""Remove the snapshot. The original directory is not affected."""
+        if self.method is SnapshotMethod.Overlay:
+            run_command(["umount", self.path], ignore_errors=True)
+            for directory in self._overlay_dirs:
+                shutil.rmtree(directory, ignore_errors=True)
+        if os.path.lexists(self.path):
+            shutil.rmtree(self.path)
+
+    def __enter__(self) -> 'RepoSnapshot':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.remove()
@@ -1 +1,5 @@
 from .docker import *
+from .job_budget import *
+from .scheduler import *
+from .run import *
+from .archive import *
@@ -0,0 +1,43 @@
+import os
+import tarfile
+from typing import List
+
+__all__ = [
+    "extract_archive",
+]
+
+
+def _check_member(member: tarfile.TarInfo, directory: str) -> None:
+    if not (member.isfile() or member.isdir()):
+        raise tarfile.TarError(f"Archive member {member.name!r} is not a regular file or directory")
+    # Resolve existing symlinks in the destination, so members can't be written through them.
+    path = os.path.realpath(os.path.join(directory, member.name))
+    if os.path.isabs(member.name) or os.path.commonpath([directory, path]) != directory:
+        raise tarfile.TarError(f"Archive member {member.name!r} is outside of the destination")
+
+
+def extract_archive(tar: tarfile.TarFile, directory: str) -> List[tarfile.TarInfo]:
+    r"""Extract a tar archive into the directory, replacing existing files.
+
+    Archives are rejected if they contain links, device files, or members with absolute paths or paths outside the
+    directory. Existing files are removed before extraction instead of written into, in case they are hard links to
+    files elsewhere. The ``"data"`` extraction filter is also applied if it is supported.
+
+    :param tar: The opened archive.
+    :param directory: The directory to extract into.
+    :return: Members of the archive.
+    :raises tarfile.TarError: If the archive contains an unsafe member. Nothing is extracted in this case.
+    """
+    directory = os.path.realpath(directory)
+    members = tar.getmembers()
+    for member in members:
+        _check_member(member, directory)
+    for member in members:
+        path = os.path.join(directory, member.name)
+        if os.path.lexists(path) and not os.path.isdir(path):
+            os.remove(path)
+    if hasattr(tarfile, "data_filter"):  # Python 3.12, backported to 3.8.17, 3.9.17, 3.10.12, and 3.11.4
+        tar.extractall(directory, members, filter="data")
+    else:
+        tar.extractall(directory, members)
+    return members
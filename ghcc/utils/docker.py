@@ -1,22 +1,79 @@
+import atexit
 import os
+import re
+import shlex
 import subprocess
-from datetime import datetime
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Union
 
 from flutes.log import log
 from flutes.run import CommandResult, error_wrapper, run_command
 
+from .docker_api import DockerAPIError, DockerClient
+from .run import OutputRecorder, make_command_result, run_streaming_command
+
 __all__ = [
     "run_docker_command",
     "verify_docker_image",
+    "get_image_id",
+    "DockerContainer",
+    "ContainerPool",
+    "DockerClient",
+    "DockerAPIError",
 ]
 
 
+def _resolve_user(user: Optional[Union[int, Tuple[int, int]]]) -> Tuple[int, int]:
+    if user is None:
+        return os.getuid(), os.getgid()
+    if isinstance(user, tuple):
+        return user
+    return user, os.getgid()  # same as `id -g $USER` for `docker run`
+
+
+def _run_docker_command_api(client: DockerClient, command: str, cwd: Optional[str] = None,
+                            user: Optional[Union[int, Tuple[int, int]]] = None,
+                            directory_mapping: Optional[Dict[str, str]] = None,
+                            timeout: Optional[float] = None, env: Optional[Dict[str, str]] = None,
+                            log_path: Optional[str] = None, return_output: bool = False,
+                            ignore_errors: bool = False, verbose: bool = False, **kwargs) -> CommandResult:
+    # Same as the `docker run` command constructed below, but through the Docker Engine API.
+    container_env: Dict[str, str] = {}
+    if user != 0:
+        user_id, group_id = _resolve_user(user)
+        container_env.update(LOCAL_USER_ID=str(user_id), LOCAL_GROUP_ID=str(group_id), PYTHONUNBUFFERED="1")
+    container_env.update(env or {})
+    if timeout is not None:
+        command = f"timeout {timeout}s {command}"
+    if verbose:
+        log("> " + command, timestamp=False, include_proc_id=False)
+    recorder = OutputRecorder(log_path)
+    recorder.write_command(command)
+    try:
+        # The entry point runs its arguments through `bash -c`, so the command is passed as a single argument.
+        # The timeout for the container is only a safeguard in case `timeout` fails to kill the command.
+        return_code = client.run_container(
+            "gcc-custom", [command], recorder.write, env=container_env, binds=directory_mapping, working_dir=cwd,
+            timeout=(timeout + 60 if timeout is not None else None))
+    finally:
+        recorder.close()
+    # Check whether exceeded timeout limit by inspecting return code. As with the `docker` CLI, this raises even if
+    # `ignore_errors` is set.
+    if return_code == 124:
+        assert timeout is not None
+        raise error_wrapper(subprocess.TimeoutExpired(command, timeout, output=recorder.tail))
+    return make_command_result(command, return_code, recorder.tail, timeout=timeout, return_output=return_output,
+                               ignore_errors=ignore_errors)
+
+
 def run_docker_command(command: Union[str, List[str]], cwd: Optional[str] = None,
                        user: Optional[Union[int, Tuple[int, int]]] = None,
                        directory_mapping: Optional[Dict[str, str]] = None,
-                       timeout: Optional[float] = None, **kwargs) -> CommandResult:
+                       timeout: Optional[float] = None, client: Optional[DockerClient] = None,
+                       **kwargs) -> CommandResult:
     r"""Run a command inside a container based on the ``gcc-custom`` Docker image.
 
     :param command: The command to run. Should be either a `str` or a list of `str`. Note: they're treated the same way,
@@ -27,12 +84,16 @@ def run_docker_command(command: Union[str, List[str]], cwd: Optional[str] = None
         special case, pass in ``0`` to run as root.
     :param directory_mapping: Mapping of host directories to container paths. Mapping is performed via "bind mount".
     :param timeout: Maximum running time for the command. If running time exceeds the specified limit,
-        ``subprocess.TimeoutExpired`` is thrown.
+        ``subprocess.TimeoutExpired`` is thrown, even if ``ignore_errors`` is True.
+    :param client: If not ``None``, the container is run through the Docker Engine API instead of the ``docker`` CLI.
     :param kwargs: Additional keyword arguments to pass to :meth:`ghcc.utils.run_command`.
     """
     # Validate `command` argument, and append call to `bash` if `shell` is True.
     if isinstance(command, list):
         command = ' '.join(command)
+    if client is not None:
+        kwargs.pop("shell", None)
+        return _run_docker_command_api(client, command, cwd, user, directory_mapping, timeout, **kwargs)
     command = f"'{command}'"
 
     # Construct the `docker run` command.
@@ -70,8 +131,11 @@ def run_docker_command(command: Union[str, List[str]], cwd: Optional[str] = None
 def run_docker_command_other(command: Union[str, List[str]], cwd: Optional[str] = None,
                        user: Optional[Union[int, Tuple[int, int]]] = None,
                        directory_mapping: Optional[Dict[str, str]] = None,
-                       timeout: Optional[float] = None, **kwargs) -> CommandResult:
-    r"""Run a command inside a container based on the ``gcc-custom`` Docker image.
+                       timeout: Optional[float] = None, env: Optional[Dict[str, str]] = None,
+                       log_path: Optional[str] = None, client: Optional[DockerClient] = None,
+                       **kwargs) -> CommandResult:
+    r"""Run a command inside a container based on the ``gcc-custom`` Docker image. Unlike :meth:`run_docker_command`,
+    output is streamed to a log file instead of being buffered, and only a bounded tail is kept in memory.
 
     :param command: The command to run. Should be either a `str` or a list of `str`. Note: they're treated the same way,
         because a shell is always spawn in the entry point.
@@ -81,12 +145,19 @@ def run_docker_command_other(command: Union[str, List[str]], cwd: Optional[str]
         special case, pass in ``0`` to run as root.
     :param directory_mapping: Mapping of host directories to container paths. Mapping is performed via "bind mount".
     :param timeout: Maximum running time for the command. If running time exceeds the specified limit,
-        ``subprocess.TimeoutExpired`` is thrown.
-    :param kwargs: Additional keyword arguments to pass to :meth:`ghcc.utils.run_command`.
+        ``subprocess.TimeoutExpired`` is thrown, even if ``ignore_errors`` is True.
+    :param env: Environment variables to set inside the container.
+    :param log_path: Path to the file where output of the container is appended. If ``None``, output is discarded
+        except for the tail.
+    :param client: If not ``None``, the container is run through the Docker Engine API instead of the ``docker`` CLI.
+    :param kwargs: Additional keyword arguments to pass to :meth:`ghcc.utils.run_streaming_command`.
     """
     # Validate `command` argument, and append call to `bash` if `shell` is True.
     if isinstance(command, list):
         command = ' '.join(command)
+    kwargs.pop("shell", None)  # a shell is always used to expand the user ID
+    if client is not None:
+        return _run_docker_command_api(client, command, cwd, user, directory_mapping, timeout, env, log_path, **kwargs)
     command = f"'{command}'"
 
     # Construct the `docker run` command.
@@ -108,6 +179,8 @@ def run_docker_command_other(command: Union[str, List[str]], cwd: Optional[str]
         docker_command.extend(["-e", f"LOCAL_USER_ID={user_id}"])
         docker_command.extend(["-e", f"LOCAL_GROUP_ID={group_id}"])
         docker_command.extend(["-e", "PYTHONUNBUFFERED=1"]) # added
+    for key, value in (env or {}).items():
+        docker_command.extend(["-e", shlex.quote(f"{key}={value}")])
 
     docker_command.append("gcc-custom")
     if timeout is not None:
@@ -115,16 +188,8 @@ def run_docker_command_other(command: Union[str, List[str]], cwd: Optional[str]
         docker_command.extend(["timeout", f"{timeout}s"])
     docker_command.append(command)
 
-    del kwargs["return_output"] # needed since we use our own subprocess.run command
-    ret = run_command(' '.join(docker_command), shell=True, verbose=True, return_output=True, **kwargs) # original line
-    
-    cwd_str = str(cwd) if cwd is not None else None
-    ret = subprocess.run(' '.join(docker_command), check=True, capture_output=True, shell=True,
-            timeout=timeout, cwd=cwd_str, **kwargs)
-    #print(f"RET {ret.stdout.decode('utf8')}")
-    #print(f"RET ERROR {ret.stderr}")
-    ret = CommandResult(' '.join(docker_command), ret.returncode, None)
-        
+    ret = run_streaming_command(' '.join(docker_command), shell=True, log_path=log_path, **kwargs)
+
     # Check whether exceeded timeout limit by inspecting return code.
     if ret.return_code == 124:
         assert timeout is not None
@@ -132,18 +197,38 @@ def run_docker_command_other(command: Union[str, List[str]], cwd: Optional[str]
     return ret
 
 
-def verify_docker_image(verbose: bool = False, print_checked_paths: bool = False) -> bool:
+def _parse_api_timestamp(timestamp: str) -> float:
+    # The Docker Engine API returns RFC 3339 timestamps with nanosecond precision, which `datetime` can't parse.
+    match = re.match(r"(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?(Z|([+-])(\d{2}):(\d{2}))$", timestamp)
+    if match is None:
+        raise ValueError(f"Invalid timestamp '{timestamp}'")
+    if match.group(3) == "Z":
+        tz = timezone.utc
+    else:
+        offset = timedelta(hours=int(match.group(5)), minutes=int(match.group(6)))
+        tz = timezone(offset if match.group(4) == "+" else -offset)
+    date = datetime.strptime(match.group(1), "%Y-%m-%dT%H:%M:%S").replace(tzinfo=tz)
+    return date.timestamp() + float("0." + (match.group(2) or "0"))
+
+
+def verify_docker_image(verbose: bool = False, print_checked_paths: bool = False,
+                        client: Optional[DockerClient] = None) -> bool:
     r"""Checks whether the Docker image is up-to-date. This is done by verifying the modification dates for all library
     files are earlier than the Docker image build date.
 
     :param verbose: If ``True``, prints out error message telling the user to rebuild Docker image.
     :param print_checked_paths: If ``True``, prints out paths of all checked files.
+    :param client: If not ``None``, the image is inspected through the Docker Engine API instead of the ``docker`` CLI.
     """
-    output = run_command(
-        ["docker", "image", "ls", "gcc-custom", "--format", "{{.CreatedAt}}"], return_output=True).captured_output
-    assert output is not None
-    image_creation_time_string = output.decode("utf-8").strip()
-    image_creation_timestamp = datetime.strptime(image_creation_time_string, "%Y-%m-%d %H:%M:%S %z %Z").timestamp()
+    if client is not None:
+        image_creation_timestamp = _parse_api_timestamp(client.inspect_image("gcc-custom")["Created"])
+    else:
+        output = run_command(
+            ["docker", "image", "ls", "gcc-custom", "--format", "{{.CreatedAt}}"], return_output=True).captured_output
+        assert output is not None
+        image_creation_time_string = output.decode("utf-8").strip()
+        image_creation_timestamp = datetime.strptime(
+            image_creation_time_string, "%Y-%m-%d %H:%M:%S %z %Z").timestamp()
 
     repo_root: Path = Path(__file__).parent.parent.parent
     paths_to_check = ["ghcc", "scripts", ".dockerignore", "Dockerfile", "requirements.txt"]
@@ -173,3 +258,236 @@ def verify_docker_image(verbose: bool = False, print_checked_paths: bool = False
         log("ERROR: Your Docker image is out-of-date. Please rebuild the image by: "
             f"`docker build -t gcc-custom {image_path}`", "error", force_console=True)
     return up_to_date
+
+
+def get_image_id(image: str = "gcc-custom", client: Optional[DockerClient] = None) -> str:
+    r"""Return the ID of the Docker image (without the ``sha256:`` prefix), which changes whenever the image is rebuilt.
+
+    :param image: The Docker image to inspect.
+    :param client: If not ``None``, the image is inspected through the Docker Engine API instead of the ``docker`` CLI.
+    """
+    if client is not None:
+        image_id = client.inspect_image(image)["Id"]
+    else:
+        output = run_command(["docker", "image", "inspect", image, "--format", "{{.Id}}"],
+                             return_output=True).captured_output
+        assert output is not None
+        image_id = output.decode("utf-8").strip()
+    return image_id.split(":")[-1]
+
+
+POOL_LABEL = "ghcc.pool"
+
+
+class DockerContainer:
+    r"""A long-lived container based on the ``gcc-custom`` Docker image. Commands are run inside the container through
+    ``docker exec``, so the cost of starting a container (and running the entry point) is paid only once.
+
+    The container is started as root with ``sleep infinity`` as its main process. Each job drops privileges to the
+    requested user via ``gosu``, mirroring what the entry point does for ``docker run``.
+
+    :param directory_mapping: Mapping of host directories to container paths. Since mounts cannot be changed after the
+        container starts, these should be the top-level folders that all jobs work under.
+    :param image: The Docker image to use.
+    :param labels: Labels to attach to the container, used to find stale containers on teardown.
+    :param client: If not ``None``, the container is managed through the Docker Engine API instead of the ``docker``
+        CLI.
+    """
+
+    def __init__(self, directory_mapping: Optional[Dict[str, str]] = None, image: str = "gcc-custom",
+                 labels: Optional[Dict[str, str]] = None, client: Optional[DockerClient] = None):
+        self.name = f"ghcc-{uuid.uuid4().hex[:12]}"
+        self.directory_mapping = directory_mapping or {}
+        self.image = image
+        self.labels = labels or {}
+        self.client = client
+        self.num_jobs = 0
+        self.running = False
+
+    def start(self) -> None:
+        if self.client is not None:
+            self.client.create_container(self.image, ["sleep infinity"], name=self.name, env={"PYTHONUNBUFFERED": "1"},
+                                         binds=self.directory_mapping, labels=self.labels)
+            self.client.start_container(self.name)
+        else:
+            docker_command = ["docker", "run", "--detach", "--rm", "--name", self.name]
+            for host, container in self.directory_mapping.items():
+                docker_command.extend(["-v", f"{os.path.abspath(host)}:{container}"])
+            for key, value in self.labels.items():
+                docker_command.extend(["--label", f"{key}={value}"])
+            docker_command.extend(["-e", "PYTHONUNBUFFERED=1"])
+            docker_command.extend([self.image, "sleep infinity"])
+            run_command(docker_command)
+        self.running = True
+        self.num_jobs = 0
+
+    def stop(self) -> None:
+        if self.running:
+            if self.client is not None:
+                try:
+                    self.client.remove_container(self.name, force=True)
+                except DockerAPIError:
+                    pass  # already removed
+            else:
+                run_command(["docker", "rm", "--force", self.name], ignore_errors=True)
+            self.running = False
+
+    def is_healthy(self) -> bool:
+        r"""Check whether the container is still running and able to accept jobs."""
+        if not self.running:
+            return False
+        if self.client is not None:
+            try:
+                return bool(self.client.inspect_container(self.name)["State"]["Running"])
+            except DockerAPIError:
+                return False
+        ret = run_command(["docker", "exec", self.name, "true"], timeout=30, ignore_errors=True)
+        return ret.return_code == 0
+
+    def _exec(self, command: List[str], recorder: OutputRecorder, cwd: Optional[str] = None,
+              env: Optional[Dict[str, str]] = None, **kwargs) -> int:
+        if self.client is not None:
+            return self.client.exec(self.name, command, recorder.write, env=env, working_dir=cwd)
+        docker_command = ["docker", "exec"]
+        if cwd is not None:
+            docker_command.extend(["-w", cwd])
+        for key, value in (env or {}).items():
+            docker_command.extend(["-e", f"{key}={value}"])
+        docker_command.append(self.name)
+        docker_command.extend(command)
+        process = subprocess.Popen(docker_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+        assert process.stdout is not None
+        for chunk in iter(lambda: process.stdout.read1(65536), b""):  # type: ignore[union-attr]
+            recorder.write(chunk)
+        return process.wait()
+
+    def exec(self, command: Union[str, List[str]], cwd: Optional[str] = None,
+             user: Optional[Union[int, Tuple[int, int]]] = None,
+             env: Optional[Dict[str, str]] = None, chown_paths: Optional[List[str]] = None,
+             timeout: Optional[float] = None, log_path: Optional[str] = None, verbose: bool = False,
+             return_output: bool = False, ignore_errors: bool = False, **kwargs) -> CommandResult:
+        r"""Run a command inside the container. Arguments have the same meaning as in :meth:`run_docker_command_other`.
+
+        :param env: Environment variables to set inside the container for this command.
+        :param chown_paths: Container paths whose ownership should be transferred to ``user`` before running the
+            command. This replaces the ``chown -R /usr/src`` performed by the entry point on ``docker run``.
+        """
+        if isinstance(command, list):
+            command = ' '.join(command)
+        script = command
+        user_id = None
+        if user != 0:
+            user_id, group_id = _resolve_user(user)
+            prelude = ""
+            if chown_paths:
+                prelude = f"chown -R {user_id}:{group_id} {' '.join(shlex.quote(p) for p in chown_paths)} && "
+            # Same process limit as in the entry point.
+            script = (f"{prelude}exec /usr/local/bin/gosu {user_id}:{group_id} "
+                      f"bash -c {shlex.quote(f'ulimit -u 256; {command}')}")
+        exec_command = ["bash", "-c", script]
+        if timeout is not None:
+            exec_command = ["timeout", f"{timeout}s"] + exec_command
+
+        if verbose:
+            log(f"{self.name}> {command}", timestamp=False, include_proc_id=False)
+        recorder = OutputRecorder(log_path)
+        recorder.write_command(command)
+        self.num_jobs += 1
+        try:
+            return_code: Optional[int] = self._exec(exec_command, recorder, cwd=cwd, env=env, **kwargs)
+        finally:
+            recorder.close()
+            if user_id is not None:
+                # Processes left behind by the job would otherwise keep running in the shared container.
+                self._exec(["pkill", "-KILL", "-u", str(user_id)], OutputRecorder())
+
+        # Same as in `run_docker_command_other`, timeouts raise even if `ignore_errors` is set.
+        if return_code == 124:
+            assert timeout is not None
+            raise error_wrapper(subprocess.TimeoutExpired(exec_command, timeout, output=recorder.tail))
+        return make_command_result(exec_command, return_code, recorder.tail, timeout=timeout,
+                                   return_output=return_output, ignore_errors=ignore_errors)
+
+
+_pool_containers: Dict[Tuple[str, int, int], DockerContainer] = {}
+
+
+@atexit.register
+def _stop_pool_containers() -> None:
+    for container in _pool_containers.values():
+        container.stop()
+    _pool_containers.clear()
+
+
+class ContainerPool:
+    r"""A pool of long-lived ``gcc-custom`` containers, one for each worker (process or thread). A worker's container
+    is started on first use and reused for subsequent jobs, instead of launching a fresh container for every command.
+
+    Containers are health-checked before each job and recycled after ``max_jobs`` jobs. The pool object itself only
+    holds configuration, so it can be pickled and passed to worker processes; running containers are tracked per
+    process. All containers are labeled with the pool ID, so :meth:`close` can remove containers left behind by workers
+    that were killed.
+
+    :param directory_mapping: Mapping of host directories to container paths, shared by all containers in the pool.
+    :param max_jobs: Number of jobs after which a container is replaced by a fresh one. If ``None``, containers are
+        never recycled.
+    :param image: The Docker image to use.
+    :param client: If not ``None``, containers are managed through the Docker Engine API instead of the ``docker`` CLI.
+    """
+
+    def __init__(self, directory_mapping: Dict[str, str], max_jobs: Optional[int] = 50, image: str = "gcc-custom",
+                 client: Optional[DockerClient] = None):
+        self.pool_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.directory_mapping = {os.path.abspath(host): container for host, container in directory_mapping.items()}
+        self.max_jobs = max_jobs
+        self.image = image
+        self.client = client
+
+    def container_path(self, path: str) -> str:
+        r"""Translate a host path into the corresponding path inside pool containers.
+
+        :raises ValueError: If the path is not under any of the mapped directories.
+        """
+        path = os.path.abspath(path)
+        for host, container in self.directory_mapping.items():
+            if path == host or path.startswith(host + os.sep):
+                return container + path[len(host):]
+        raise ValueError(f"Path '{path}' is not mounted in containers of the pool")
+
+    def get_container(self) -> DockerContainer:
+        r"""Return a healthy container for the current worker, starting or recycling one if required."""
+        key = (self.pool_id, os.getpid(), threading.get_ident())
+        container = _pool_containers.get(key)
+        if container is not None:
+            if (self.max_jobs is not None and container.num_jobs >= self.max_jobs) or not container.is_healthy():
+                container.stop()
+                container = None
+        if container is None:
+            container = DockerContainer(self.directory_mapping, image=self.image, labels={POOL_LABEL: self.pool_id},
+                                        client=self.client)
+            container.start()
+            _pool_containers[key] = container
+        return container
+
+    def close(self) -> None:
+        r"""Stop all containers of the pool, including those started by other processes."""
+        for key in [key for key in _pool_containers if key[0] == self.pool_id]:
+            _pool_containers.pop(key).stop()
+        if self.client is not None:
+            for container_id in self.client.list_containers({POOL_LABEL: self.pool_id}):
+                try:
+                    self.client.remove_container(container_id, force=True)
+                except DockerAPIError:
+                    pass
+            return
+        ret = run_command(["docker", "ps", "--all", "--quiet", "--filter", f"label={POOL_LABEL}={self.pool_id}"],
+                          return_output=True, ignore_errors=True)
+        container_ids = (ret.captured_output or b"").decode("utf-8").split()
+        if len(container_ids) > 0:
+            run_command(["docker", "rm", "--force", *container_ids], ignore_errors=True)
+
+    def __enter__(self) -> 'ContainerPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
@@ -0,0 +1,327 @@
+import http.client
+import json
+import os
+import select
+import socket
+import struct
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+__all__ = [
+    "DockerAPIError",
+    "DockerClient",
+]
+
+DEFAULT_SOCKET_PATH = "/var/run/docker.sock"
+
+OutputFn = Callable[[bytes], None]
+# Methods that can be safely retried, since repeating them has the same effect as sending them once.
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+
+class DockerAPIError(Exception):
+    r"""An error response returned by the Docker Engine API."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Docker API returned {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    r"""An HTTP connection over a Unix domain socket."""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+def _read_exact(response: http.client.HTTPResponse, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = response.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _demultiplex(response: http.client.HTTPResponse, output_fn: OutputFn) -> None:
+    # Output of containers without a TTY is multiplexed into frames, each prefixed with an 8-byte header: one byte for
+    # the stream type (stdin/stdout/stderr), three bytes of padding, and the frame size as a big-endian uint32.
+    while True:
+        header = _read_exact(response, 8)
+        if len(header) < 8:
+            break
+        _stream_type, size = struct.unpack(">BxxxL", header)
+        output_fn(_read_exact(response, size))
+
+
+class DockerClient:
+    r"""A minimal client for the Docker Engine API over its Unix socket. This avoids the cost of forking the ``docker``
+    CLI (and a shell) for every interaction with Docker.
+
+    Short requests go through a pool of keep-alive connections. Long-running requests that stream output (logs and
+    ``exec``) use dedicated connections, since Docker takes over the connection for the stream.
+
+    The client can be pickled and passed to worker processes; connections are never shared across processes.
+
+    :param socket_path: Path to the Docker daemon socket.
+    :param max_connections: Maximum number of idle connections kept in the pool.
+    :param timeout: Socket timeout for short requests, in seconds.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, max_connections: int = 4,
+                 timeout: Optional[float] = 60.0):
+        self.socket_path = socket_path
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._init_pool()
+
+    def _init_pool(self) -> None:
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle: List[UnixHTTPConnection] = []
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"socket_path": self.socket_path, "max_connections": self.max_connections, "timeout": self.timeout}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._init_pool()
+
+    @staticmethod
+    def is_available(socket_path: str = DEFAULT_SOCKET_PATH) -> bool:
+        r"""Check whether the Docker socket exists and is accessible to the current user."""
+        return os.path.exists(socket_path) and os.access(socket_path, os.R_OK | os.W_OK)
+
+    def _get_connection(self) -> UnixHTTPConnection:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked from another process. The inherited sockets belong to the parent.
+                self._pid = os.getpid()
+                self._idle = []
+            while len(self._idle) > 0:
+                conn = self._idle.pop()
+                # An idle connection is readable only if the daemon closed it (or sent unexpected data).
+                if conn.sock is not None and len(select.select([conn.sock], [], [], 0)[0]) == 0:
+                    return conn
+                conn.close()
+        return UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+
+    def _release_connection(self, conn: UnixHTTPConnection) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_connections:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+
+    @staticmethod
+    def _url(path: str, params: Optional[Dict[str, Any]] = None) -> str:
+        if params:
+            path += "?" + urlencode({key: value for key, value in params.items() if value is not None})
+        return path
+
+    @staticmethod
+    def _raise_for_status(status: int, payload: bytes) -> None:
+        if status >= 400:
+            try:
+                message = json.loads(payload.decode("utf-8"))["message"]
+            except (ValueError, KeyError, TypeError):
+                message = payload.decode("utf-8", errors="replace")
+            raise DockerAPIError(status, message)
+
+    def request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                body: Optional[Any] = None) -> Tuple[int, bytes]:
+        r"""Perform a request on a pooled connection and return the status code and response body.
+
+        If a reused connection turns out to be closed, the request is retried on a new connection, but only if it could
+        not have been processed by the daemon: either sending it failed, or the method is idempotent. Otherwise, e.g.
+        a ``POST`` that creates a container might create a duplicate.
+
+        :raises DockerAPIError: If the daemon returned an error status.
+        """
+        url = self._url(path, params)
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        while True:
+            conn = self._get_connection()
+            reused = conn.sock is not None
+            sent = False
+            try:
+                conn.request(method, url, body=data, headers=headers)
+                sent = True
+                response = conn.getresponse()
+                payload = response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if reused and (not sent or method in IDEMPOTENT_METHODS):
+                    continue  # the daemon might have closed the idle connection; retry on a new one
+                raise
+            break
+        if response.will_close:
+            conn.close()
+        else:
+            self._release_connection(conn)
+        self._raise_for_status(response.status, payload)
+        return response.status, payload
+
+    def request_json(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                     body: Optional[Any] = None) -> Any:
+        _, payload = self.request(method, path, params, body)
+        return json.loads(payload.decode("utf-8")) if payload else None
+
+    def stream(self, method: str, path: str, output_fn: OutputFn, params: Optional[Dict[str, Any]] = None,
+               body: Optional[Any] = None, timeout: Optional[float] = None) -> None:
+        r"""Perform a request on a dedicated connection and pass the demultiplexed output stream to ``output_fn``."""
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        conn = UnixHTTPConnection(self.socket_path, timeout=timeout)
+        try:
+            conn.request(method, self._url(path, params), body=data, headers=headers)
+            response = conn.getresponse()
+            if response.status >= 400:
+                self._raise_for_status(response.status, response.read())
+            _demultiplex(response, output_fn)
+        finally:
+            conn.close()
+
+    def ping(self) -> bool:
+        try:
+            status, _ = self.request("GET", "/_ping")
+        except (OSError, http.client.HTTPException, DockerAPIError):
+            return False
+        return status == 200
+
+    def inspect_image(self, name: str) -> Dict[str, Any]:
+        return self.request_json("GET", f"/images/{quote(name, safe='')}/json")
+
+    def create_container(self, image: str, command: List[str], *, name: Optional[str] = None,
+                         env: Optional[Dict[str, str]] = None, binds: Optional[Dict[str, str]] = None,
+                         working_dir: Optional[str] = None, labels: Optional[Dict[str, str]] = None,
+                         user: Optional[str] = None) -> str:
+        r"""Create a container and return its ID.
+
+        :param binds: Mapping of host directories to container paths, mounted via "bind mount".
+        """
+        config: Dict[str, Any] = {
+            "Image": image,
+            "Cmd": command,
+            "Env": [f"{key}={value}" for key, value in (env or {}).items()],
+            "Labels": labels or {},
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Tty": False,
+            "HostConfig": {"Binds": [f"{os.path.abspath(host)}:{container}"
+                                     for host, container in (binds or {}).items()]},
+        }
+        if working_dir is not None:
+            config["WorkingDir"] = working_dir
+        if user is not None:
+            config["User"] = user
+        return self.request_json("POST", "/containers/create", {"name": name}, config)["Id"]
+
+    def start_container(self, container_id: str) -> None:
+        self.request("POST", f"/containers/{container_id}/start")
+
+    def inspect_container(self, container_id: str) -> Dict[str, Any]:
+        return self.request_json("GET", f"/containers/{container_id}/json")
+
+    def wait_container(self, container_id: str) -> int:
+        r"""Block until the container stops, and return its exit code."""
+        conn = UnixHTTPConnection(self.socket_path)  # no timeout, since waiting could take arbitrarily long
+        try:
+            conn.request("POST", f"/containers/{container_id}/wait")
+            response = conn.getresponse()
+            payload = response.read()
+        finally:
+            conn.close()
+        self._raise_for_status(response.status, payload)
+        return json.loads(payload.decode("utf-8"))["StatusCode"]
+
+    def container_logs(self, container_id: str, output_fn: OutputFn, follow: bool = False) -> None:
+        r"""Pass the combined stdout and stderr of the container to ``output_fn``. If ``follow`` is ``True``, this
+        blocks until the container stops."""
+        self.stream("GET", f"/containers/{container_id}/logs", output_fn,
+                    params={"stdout": 1, "stderr": 1, "follow": int(follow)})
+
+    def kill_container(self, container_id: str) -> None:
+        self.request("POST", f"/containers/{container_id}/kill")
+
+    def remove_container(self, container_id: str, force: bool = True) -> None:
+        self.request("DELETE", f"/containers/{container_id}", {"force": int(force)})
+
+    def list_containers(self, labels: Optional[Dict[str, str]] = None) -> List[str]:
+        r"""Return IDs of all containers (including stopped ones) that have the specified labels."""
+        filters = json.dumps({"label": [f"{key}={value}" for key, value in (labels or {}).items()]})
+        containers = self.request_json("GET", "/containers/json", {"all": 1, "filters": filters})
+        return [container["Id"] for container in containers]
+
+    def exec(self, container_id: str, command: List[str], output_fn: OutputFn, *,
+             env: Optional[Dict[str, str]] = None, working_dir: Optional[str] = None,
+             user: Optional[str] = None) -> int:
+        r"""Run a command in a running container, pass its combined output to ``output_fn``, and return its exit code.
+        """
+        config: Dict[str, Any] = {
+            "Cmd": command,
+            "Env": [f"{key}={value}" for key, value in (env or {}).items()],
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Tty": False,
+        }
+        if working_dir is not None:
+            config["WorkingDir"] = working_dir
+        if user is not None:
+            config["User"] = user
+        exec_id = self.request_json("POST", f"/containers/{container_id}/exec", body=config)["Id"]
+        self.stream("POST", f"/exec/{exec_id}/start", output_fn, body={"Detach": False, "Tty": False})
+        return self.request_json("GET", f"/exec/{exec_id}/json")["ExitCode"]
+
+    def run_container(self, image: str, command: List[str], output_fn: OutputFn, *,
+                      timeout: Optional[float] = None, **kwargs) -> Optional[int]:
+        r"""Equivalent of ``docker run --rm``: create and start a container, stream its output to ``output_fn`` until
+        it stops, and remove it.
+
+        :param timeout: If not ``None``, the container is killed after this many seconds.
+        :param kwargs: Additional keyword arguments to pass to :meth:`create_container`.
+        :return: The exit code of the container, or ``None`` if it was killed due to timeout.
+        """
+        container_id = self.create_container(image, command, **kwargs)
+        timed_out = threading.Event()
+
+        def kill_fn():
+            timed_out.set()
+            try:
+                self.kill_container(container_id)
+            except DockerAPIError:
+                pass  # container already stopped
+
+        timer = threading.Timer(timeout, kill_fn) if timeout is not None else None
+        try:
+            self.start_container(container_id)
+            if timer is not None:
+                timer.start()
+            self.container_logs(container_id, output_fn, follow=True)
+            return_code = self.wait_container(container_id)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self.remove_container(container_id, force=True)
+        return None if timed_out.is_set() else return_code
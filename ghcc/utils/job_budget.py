@@ -0,0 +1,69 @@
+import contextlib
+import fcntl
+import os
+import random
+from typing import Iterator, List
+
+__all__ = [
+    "JobBudget",
+]
+
+
+class JobBudget:
+    r"""A host-wide budget of extra ``make`` jobs, shared by all builds (and containers) on the machine.
+
+    The budget is a directory of ``size`` token files. Each build runs one job on its own, and takes as many free tokens
+    as it can (without waiting) by locking token files, up to ``max_jobs - 1``. Tokens are held until the build
+    finishes, and are released automatically if the build process dies. Thus builds can use idle cores with ``-jN``,
+    while the total number of extra jobs never exceeds ``size``.
+
+    Since GNU Make 4.2 (in the ``gcc-custom`` image) only supports jobserver pipes within a single ``make`` invocation,
+    tokens are taken once per build rather than per job.
+
+    :param path: Path to the directory of token files. It is created if it does not exist, and must be shared by all
+        builds, e.g., mounted into all containers.
+    :param size: Total number of extra jobs, usually the number of cores not already used by the compilation workers.
+    :param max_jobs: Maximum number of jobs per build.
+    """
+
+    def __init__(self, path: str, size: int, max_jobs: int = 8):
+        self.path = os.path.abspath(path)
+        self.size = size
+        self.max_jobs = max_jobs
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+            os.chmod(self.path, 0o777)  # shared by containers running as different users
+
+    def _try_lock(self, index: int) -> int:
+        token_path = os.path.join(self.path, f"token-{index}")
+        fd = os.open(token_path, os.O_RDWR | os.O_CREAT, 0o666)
+        with contextlib.suppress(PermissionError):
+            os.chmod(token_path, 0o666)  # not affected by umask; fails if created by another user, which is fine
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return -1
+        return fd
+
+    @contextlib.contextmanager
+    def acquire(self) -> Iterator[int]:
+        r"""Take free tokens for the duration of a build.
+
+        :return: The number of jobs the build may run, i.e. one plus the number of tokens taken.
+        """
+        fds: List[int] = []
+        try:
+            # Start from random tokens, so concurrent builds don't contend for the same files.
+            indices = list(range(self.size))
+            random.shuffle(indices)
+            for index in indices:
+                if len(fds) >= self.max_jobs - 1:
+                    break
+                fd = self._try_lock(index)
+                if fd != -1:
+                    fds.append(fd)
+            yield 1 + len(fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
@@ -0,0 +1,243 @@
+import collections
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Deque, Dict, FrozenSet, List, Optional, Tuple, Union
+
+import psutil
+from flutes.log import log
+from flutes.run import CommandResult, error_wrapper
+
+__all__ = [
+    "OutputRecorder",
+    "StallError",
+    "StallWatchdog",
+    "run_streaming_command",
+]
+
+MAX_TAIL_LENGTH = 8192
+MAX_STALL_CHECK_INTERVAL = 5.0  # seconds between samples of the stall watchdog
+
+
+class OutputRecorder:
+    r"""Records output of a command: everything is appended to an optional log file, while only a bounded tail is
+    kept in memory.
+
+    :param log_path: Path to the file where output is written. The file is opened in append mode, so multiple commands
+        can share the same log. If ``None``, output is only kept in memory.
+    :param tail_size: Maximum number of bytes from the end of the output that are kept in memory.
+    """
+
+    def __init__(self, log_path: Optional[str] = None, tail_size: int = MAX_TAIL_LENGTH):
+        self.tail_size = tail_size
+        self._chunks: Deque[bytes] = collections.deque()
+        self._tail_length = 0
+        self.length = 0  # total number of bytes written
+        self._log_file = open(log_path, "ab") if log_path is not None else None
+
+    def write_command(self, args: Union[str, List[str]]) -> None:
+        if self._log_file is not None:
+            self._log_file.write(f"> {args if isinstance(args, str) else ' '.join(args)}\n".encode("utf-8"))
+            self._log_file.flush()
+
+    def write(self, chunk: bytes) -> None:
+        if self._log_file is not None:
+            self._log_file.write(chunk)
+        self.length += len(chunk)
+        self._chunks.append(chunk)
+        self._tail_length += len(chunk)
+        while self._tail_length - len(self._chunks[0]) >= self.tail_size:
+            self._tail_length -= len(self._chunks.popleft())
+
+    @property
+    def tail(self) -> bytes:
+        return b"".join(self._chunks)[-self.tail_size:]
+
+    def close(self) -> None:
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+
+class StallError(subprocess.TimeoutExpired):
+    r"""Raised when a command is killed by the :class:`StallWatchdog` before its timeout. Since this is a subclass of
+    :class:`subprocess.TimeoutExpired`, callers not interested in stalls can treat it as a timeout.
+
+    :param timeout: The length of the window without progress, in seconds.
+    :param reason: Description of the stall.
+    """
+
+    def __init__(self, cmd, timeout: float, reason: str, output: Optional[bytes] = None):
+        super().__init__(cmd, timeout, output=output)
+        self.reason = reason
+
+    def __str__(self) -> str:
+        return f"Command '{self.cmd}' stalled: {self.reason}"
+
+
+class StallWatchdog:
+    r"""Detects stalls of a process tree, e.g. builds waiting on input or a network fetch. The tree is making progress
+    as long as the command writes output, its processes use CPU time, or they open new files (e.g. compiler outputs).
+    Processes that burn CPU forever are not stalled by this definition, and are left to the timeout.
+
+    :param pid: PID of the root process.
+    :param stall_timeout: The tree is stalled if there is no progress for this many seconds.
+    :param min_cpu_time: Minimum increase of total CPU time (in seconds) that counts as progress.
+    """
+
+    def __init__(self, pid: int, stall_timeout: float, min_cpu_time: float = 0.1):
+        self.pid = pid
+        self.stall_timeout = stall_timeout
+        self.min_cpu_time = min_cpu_time
+        self._output_length = -1
+        self._cpu_time = 0.0
+        self._files: FrozenSet[str] = frozenset()
+        self._last_progress = time.monotonic()
+
+    def _sample(self) -> Tuple[float, FrozenSet[str], List[str]]:
+        try:
+            parent = psutil.Process(self.pid)
+            processes = [parent] + parent.children(recursive=True)
+        except psutil.Error:
+            return self._cpu_time, self._files, []
+        cpu_time = 0.0
+        files = set()
+        names = []
+        for process in processes:
+            try:
+                with process.oneshot():
+                    # Include CPU time of finished children, e.g. short-lived compiler processes.
+                    times = process.cpu_times()
+                    cpu_time += times.user + times.system + times.children_user + times.children_system
+                    files.update(file.path for file in process.open_files())
+                    names.append(process.name())
+            except psutil.Error:
+                pass  # the process exited
+        return cpu_time, frozenset(files), names
+
+    def check(self, output_length: int) -> Optional[str]:
+        r"""Sample the process tree and check whether it is stalled.
+
+        :param output_length: Total length of the output so far.
+        :return: Description of the stall, or ``None`` if the tree is not stalled.
+        """
+        cpu_time, files, names = self._sample()
+        now = time.monotonic()
+        if (output_length != self._output_length or cpu_time - self._cpu_time >= self.min_cpu_time or
+                not files.issubset(self._files)):
+            self._output_length = output_length
+            self._cpu_time = cpu_time
+            self._files = files
+            self._last_progress = now
+            return None
+        if now - self._last_progress < self.stall_timeout:
+            return None
+        return (f"no output, CPU time, or new open files for {now - self._last_progress:.0f}s "
+                f"(processes: {', '.join(sorted(set(names)))})")
+
+
+def make_command_result(args: Union[str, List[str]], return_code: Optional[int], output: bytes, *,
+                        timeout: Optional[float] = None, return_output: bool = False,
+                        ignore_errors: bool = False, stall_timeout: Optional[float] = None,
+                        stall_reason: Optional[str] = None) -> CommandResult:
+    r"""Create the result of a finished command, raising exceptions in the same way as :meth:`flutes.run_command`.
+
+    :param return_code: The return code of the command, or ``None`` if the command timed out or stalled.
+    :param stall_reason: If not ``None``, the command was killed by the stall watchdog, and
+        :class:`StallError` is raised.
+    """
+    if return_code is None:
+        if ignore_errors:
+            return CommandResult(args, -32768, output)
+        if stall_reason is not None:
+            assert stall_timeout is not None
+            raise error_wrapper(StallError(args, stall_timeout, stall_reason, output=output))
+        assert timeout is not None
+        raise error_wrapper(subprocess.TimeoutExpired(args, timeout, output=output))
+    if return_code != 0:
+        if ignore_errors:
+            return CommandResult(args, return_code, output)
+        raise error_wrapper(subprocess.CalledProcessError(return_code, args, output=output))
+    return CommandResult(args, return_code, output if return_output else None)
+
+
+def run_streaming_command(args: Union[str, List[str]], *, log_path: Optional[str] = None,
+                          env: Optional[Dict[str, str]] = None, cwd: Optional[str] = None,
+                          timeout: Optional[float] = None, verbose: bool = False, return_output: bool = False,
+                          ignore_errors: bool = False, tail_size: int = MAX_TAIL_LENGTH,
+                          stall_timeout: Optional[float] = None, **kwargs) -> CommandResult:
+    r"""Run a command once, streaming its combined stdout and stderr to a log file while keeping only a bounded tail of
+    the output in memory. This is a drop-in replacement for :meth:`flutes.run_command` for long-running commands that
+    produce lots of output, such as compilation inside Docker.
+
+    :param args: The command to run. Should be either a `str` or a list of `str` depending on whether ``shell`` is True.
+    :param log_path: Path to the file where output is written. The file is opened in append mode, so multiple commands
+        can share the same log. If ``None``, output is only kept in memory.
+    :param env: Environment variables to set before running the command. Defaults to None.
+    :param cwd: The working directory of the command to run. If None, uses the default (probably user home).
+    :param timeout: Maximum running time for the command. If running time exceeds the specified limit, the process
+        group of the command is killed and ``subprocess.TimeoutExpired`` is thrown.
+    :param verbose: If ``True``, print out the executed command.
+    :param return_output: If ``True``, the tail of the output is returned.
+    :param ignore_errors: If ``True``, exceptions will not be raised. A special return code of -32768 indicates a
+        ``subprocess.TimeoutExpired`` error.
+    :param tail_size: Maximum number of bytes from the end of the output that are kept in memory.
+    :param stall_timeout: If not ``None``, the process group of the command is killed if it makes no progress (see
+        :class:`StallWatchdog`) for this many seconds, and :class:`StallError` is thrown.
+    :return: An instance of :class:`CommandResult`, where ``captured_output`` holds the tail of the output.
+    """
+    if verbose:
+        log((cwd or "") + "> " + repr(args), timestamp=False, include_proc_id=False)
+    recorder = OutputRecorder(log_path, tail_size)
+    recorder.write_command(args)
+
+    # New session, so that the whole process tree (e.g. the shell and its children) can be killed on timeout.
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, cwd=cwd,
+                               start_new_session=True, **kwargs)
+
+    def read_output():
+        assert process.stdout is not None
+        while True:
+            chunk = process.stdout.read1(65536)  # type: ignore[attr-defined]
+            if not chunk:
+                break
+            recorder.write(chunk)
+
+    reader = threading.Thread(target=read_output, daemon=True)
+    reader.start()
+    watchdog = StallWatchdog(process.pid, stall_timeout) if stall_timeout is not None else None
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    return_code: Optional[int] = None
+    stall_reason: Optional[str] = None
+    try:
+        while True:
+            wait_time = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if watchdog is not None:
+                interval = min(MAX_STALL_CHECK_INTERVAL, watchdog.stall_timeout / 2)
+                wait_time = interval if wait_time is None else min(wait_time, interval)
+            try:
+                return_code = process.wait(timeout=wait_time)
+                break
+            except subprocess.TimeoutExpired:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                if watchdog is None:
+                    continue
+                stall_reason = watchdog.check(recorder.length)
+                if stall_reason is not None:
+                    break
+    finally:
+        if return_code is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.wait()
+        reader.join()
+        process.stdout.close()  # type: ignore[union-attr]
+        recorder.close()
+
+    return make_command_result(args, return_code, recorder.tail, timeout=timeout, return_output=return_output,
+                               ignore_errors=ignore_errors, stall_timeout=stall_timeout, stall_reason=stall_reason)
@@ -0,0 +1,206 @@
+import itertools
+import queue
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, \
+    Tuple, TypeVar
+
+__all__ = [
+    "Task",
+    "TaskScheduler",
+]
+
+T = TypeVar('T')
+
+
+class Task:
+    r"""A unit of work managed by :class:`TaskScheduler`. Use :meth:`TaskScheduler.submit` to create tasks.
+
+    :ivar result: The return value of the task function, available after the task is done.
+    """
+
+    def __init__(self, fn: Callable[..., Any], pool: str, deps: Sequence["Task"], resource: Optional[Hashable],
+                 callback: Optional[Callable[[Any], None]], priority: Tuple):
+        self.fn = fn
+        self.pool = pool
+        self.deps = list(deps)
+        self.resource = resource
+        self.callback = callback
+        self.priority = priority
+        self.done = False
+        self.result: Any = None
+        self._num_pending_deps = 0
+        self._dependents: List["Task"] = []
+
+    def __lt__(self, other: "Task") -> bool:
+        return self.priority < other.priority
+
+
+class _Failure(NamedTuple):
+    exception: BaseException
+
+
+class TaskScheduler:
+    r"""Schedules a dynamic graph of tasks over named pools of worker threads.
+
+    Each task belongs to a pool and runs on one of its workers once all its dependencies are done. A task may also hold
+    an exclusive resource (e.g., a working directory), and tasks holding the same resource never run concurrently.
+    Among runnable tasks, the one with the smallest priority runs first.
+
+    Work is added per item by :meth:`run`: a ``start_fn`` submits the initial tasks of an item, and callbacks of tasks
+    may submit more tasks when their results are known. Each item must eventually call :meth:`emit` exactly once with
+    its final result.
+
+    If all pools have zero workers, tasks are run sequentially in the thread calling :meth:`run`.
+
+    :param pools: Mapping of pool names to the number of worker threads in the pool.
+    """
+
+    def __init__(self, pools: Dict[str, int]):
+        if all(num_workers == 0 for num_workers in pools.values()):
+            self.sequential = True
+        elif any(num_workers <= 0 for num_workers in pools.values()):
+            raise ValueError("Either all pools or no pools should have zero workers")
+        else:
+            self.sequential = False
+        self.pools = pools
+        self._cond = threading.Condition()
+        self._ready: Dict[str, List[Task]] = {pool: [] for pool in pools}
+        self._held_resources: Set[Hashable] = set()
+        self._counter = itertools.count()
+        self._output: "queue.Queue[Any]" = queue.Queue()
+        self._stopped = False
+
+    def submit(self, fn: Callable[..., Any], pool: str, *, deps: Sequence[Task] = (),
+               resource: Optional[Hashable] = None, callback: Optional[Callable[[Any], None]] = None,
+               priority: Any = 0) -> Task:
+        r"""Submit a task.
+
+        :param fn: The function to run, which takes no arguments. Results of ``deps`` can be accessed through their
+            :attr:`Task.result` attributes.
+        :param pool: Name of the pool to run the task in.
+        :param deps: Tasks that must finish before this task runs.
+        :param resource: If not ``None``, an exclusive resource held by the task while it runs.
+        :param callback: If not ``None``, called with the result of the task after it finishes, on the worker thread.
+        :param priority: Runnable tasks with smaller priorities run first. Tasks of the same priority run in order of
+            submission.
+        :return: The task object, which can be used as a dependency of other tasks.
+        """
+        if pool not in self.pools:
+            raise ValueError(f"Unknown pool '{pool}'")
+        task = Task(fn, pool, deps, resource, callback, (priority, next(self._counter)))
+        with self._cond:
+            for dep in task.deps:
+                if not dep.done:
+                    task._num_pending_deps += 1
+                    dep._dependents.append(task)
+            if task._num_pending_deps == 0:
+                self._push_ready(task)
+        return task
+
+    def emit(self, result: Any) -> None:
+        r"""Report the final result of an item."""
+        self._output.put(result)
+
+    def _push_ready(self, task: Task) -> None:
+        self._ready[task.pool].append(task)
+        self._cond.notify_all()
+
+    def _pop_ready(self, pools: Iterable[str]) -> Optional[Task]:
+        # Return the runnable task with the smallest priority in the pools, skipping tasks whose resources are held.
+        best: Optional[Task] = None
+        for pool in pools:
+            for task in sorted(self._ready[pool]):
+                if task.resource is None or task.resource not in self._held_resources:
+                    if best is None or task < best:
+                        best = task
+                    break
+        if best is not None:
+            self._ready[best.pool].remove(best)
+            if best.resource is not None:
+                self._held_resources.add(best.resource)
+        return best
+
+    def _execute(self, task: Task) -> None:
+        try:
+            task.result = task.fn()
+        except BaseException as e:
+            self._output.put(_Failure(e))
+            return
+        finally:
+            with self._cond:
+                if task.resource is not None:
+                    self._held_resources.discard(task.resource)
+                self._cond.notify_all()
+        with self._cond:
+            task.done = True
+            for dependent in task._dependents:
+                dependent._num_pending_deps -= 1
+                if dependent._num_pending_deps == 0:
+                    self._push_ready(dependent)
+            task._dependents = []
+        if task.callback is not None:
+            try:
+                task.callback(task.result)
+            except BaseException as e:
+                self._output.put(_Failure(e))
+
+    def _worker(self, pool: str) -> None:
+        while True:
+            with self._cond:
+                task = self._pop_ready([pool])
+                while task is None and not self._stopped:
+                    self._cond.wait()
+                    task = self._pop_ready([pool])
+                if task is None:
+                    return
+            self._execute(task)
+
+    def _next_output(self) -> Any:
+        if not self.sequential:
+            return self._output.get()
+        while self._output.empty():
+            with self._cond:
+                task = self._pop_ready(self.pools.keys())
+            if task is None:
+                raise RuntimeError("No runnable tasks left, but some items did not emit results")
+            self._execute(task)
+        return self._output.get()
+
+    def run(self, items: Iterable[T], start_fn: Callable[[T], None], max_in_flight: int) -> Iterator[Any]:
+        r"""Process items by submitting their tasks, and iterate over final results of items in order of completion.
+
+        :param items: The items to process. The iterable is consumed lazily.
+        :param start_fn: A function that submits the initial tasks of an item.
+        :param max_in_flight: Maximum number of items that are started but have not emitted their results. This bounds
+            the amount of resources (e.g., disk space) used by items in progress.
+        :return: An iterator over results passed to :meth:`emit`. If a task raises an exception, it is re-raised here.
+        """
+        threads = [threading.Thread(target=self._worker, args=(pool,), name=f"scheduler-{pool}-{idx}", daemon=True)
+                   for pool, num_workers in self.pools.items() for idx in range(num_workers)]
+        for thread in threads:
+            thread.start()
+
+        iterator = iter(items)
+        exhausted = False
+        in_flight = 0
+        try:
+            while True:
+                while not exhausted and in_flight < max(1, max_in_flight):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    in_flight += 1
+                    start_fn(item)
+                if in_flight == 0:
+                    break
+                value = self._next_output()
+                if isinstance(value, _Failure):
+                    raise value.exception
+                in_flight -= 1
+                yield value
+        finally:
+            with self._cond:
+                self._stopped = True
+                self._cond.notify_all()
@@ -0,0 +1,73 @@
+from typing import List, NamedTuple, Optional, Sequence
+
+__all__ = [
+    "Variant",
+    "DEFAULT_VARIANTS",
+    "select_variants",
+]
+
+
+class Variant(NamedTuple):
+    r"""Specification of a compilation variant, i.e., one obfuscation configuration that each repository is compiled
+    with.
+
+    :param name: Name of the variant. Binaries are stored under ``binary_folder/repo_owner/repo_name/name``.
+    :param compiler: The compiler to use (``"gcc"``, ``"g++"``, or ``"clang"``). If ``None``, the compiler specified
+        in the command line arguments is used.
+    :param flags: Additional compiler flags for this variant.
+    :param optimization: The optimization level, e.g. ``"O1"``.
+    :param adv_obfuscation: If ``True``, sources are rewritten by ADVobfuscator before compilation. Since this modifies
+        the repository in place, such variants are compiled after all other variants of the repository.
+    """
+    name: str
+    compiler: Optional[str] = None
+    flags: Sequence[str] = ()
+    optimization: str = "O1"
+    adv_obfuscation: bool = False
+
+    @property
+    def modifies_source(self) -> bool:
+        return self.adv_obfuscation
+
+    @property
+    def shares_bitcode(self) -> bool:
+        r"""Whether the variant is compiled with clang, so that it can share LLVM bitcode with other such variants of the
+        repository, and only differs from them in the ``-mllvm`` passes."""
+        return self.compiler == "clang"
+
+    def compiler_flags(self, base_flags: Optional[str] = None) -> str:
+        r"""Return the compiler flags for this variant, appended to the flags specified in command line arguments."""
+        return " ".join(flag for flag in [(base_flags or "").strip(), f"-{self.optimization}", *self.flags] if flag)
+
+
+def _llvm_obfuscation(*passes: str) -> List[str]:
+    # Options for Obfuscator-LLVM passes must be passed to the LLVM backend.
+    return [flag for name in passes for flag in ["-mllvm", f"-{name}"]]
+
+
+DEFAULT_VARIANTS: List[Variant] = [
+    Variant("none"),
+    Variant("llvm-obfuscation-fla", compiler="clang", flags=_llvm_obfuscation("fla")),
+    Variant("llvm-obfuscation-sub", compiler="clang", flags=_llvm_obfuscation("sub")),
+    Variant("llvm-obfuscation-bcf", compiler="clang", flags=_llvm_obfuscation("bcf")),
+    Variant("llvm-obfuscation-all", compiler="clang", flags=_llvm_obfuscation("fla", "sub", "bcf")),
+    Variant("adv-obfuscation", compiler="g++", adv_obfuscation=True),
+]
+
+
+def select_variants(names: Optional[Sequence[str]] = None, variants: Sequence[Variant] = DEFAULT_VARIANTS) \
+        -> List[Variant]:
+    r"""Select variants by name, preserving their order in ``variants``.
+
+    :param names: Names of variants to select. If ``None``, all variants are selected.
+    :param variants: The list of available variants.
+    :raises ValueError: If a name does not match any variant.
+    """
+    if names is None:
+        return list(variants)
+    available = {variant.name for variant in variants}
+    unknown = [name for name in names if name not in available]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown variant(s): {', '.join(unknown)}. Available variants are: "
+                         f"{', '.join(variant.name for variant in variants)}")
+    return [variant for variant in variants if variant.name in names]
@@ -6,13 +6,14 @@ r"""Run the cloning--compilation pipeline. What happens is:
 4. Compilation products are cleaned and the repository is archived to save space.
 """
 
+import copy
 import functools
-import random
 import json
+import random
 import os
 import shutil
 import subprocess
-from typing import Callable, Iterator, List, NamedTuple, Optional, Set
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 import flutes
 from typing import Literal
@@ -30,7 +31,10 @@ def get_args():
     parser.add_argument("--binary-folder", type=str, default="binaries/") # where compiled binaries are stored
     parser.add_argument("--archive-folder", type=str, default="archives/") # where archived repositories are stored
 
-    parser.add_argument("--n-procs", type=int, default=70) # 0 for single-threaded execution
+    parser.add_argument("--n-procs", type=int, default=70) # number of compilation workers, 0 for single-threaded execution
+    parser.add_argument("--n-clone-procs", type=int, default=8) # number of cloning workers
+    parser.add_argument("--n-archive-procs", type=int, default=4) # number of archiving workers
+    parser.add_argument("--clone-prefetch", type=int, default=8) # maximum number of cloned repos waiting for compilation
     parser.add_argument("--log-file", type=str, default="log.txt")
     parser.add_argument("--clone-timeout", type=Optional[int], default=600) # wait up to 10 minutes
     parser.add_argument("--force-reclone", type=bool, default=False) # if not, use archives when possible
@@ -45,7 +49,26 @@ def get_args():
     parser.add_argument("--recursive-clone", type=bool, default=True) # if True, use `--recursive` when `git clone`
     parser.add_argument("--record-metainfo", type=bool, default=True) # if True, record a bunch of other stuff
     parser.add_argument("--gcc-override-flags", default="-g ") # GCC flags to use during compilation, e.g. "-O2 -march=x86-64"
-    parser.add_argument("--compiler", type=str, default="gcc") # used to change compiler to "g++" for ADVObfuscator compilation
+    parser.add_argument("--compiler", type=str, default="gcc") # compiler for variants that don't specify one
+    parser.add_argument("--variants", type=str, default=None) # comma-separated names of variants to compile, defaults to all
+    parser.add_argument("--snapshot-method", choices=["auto", "none"] + [method.value for method in ghcc.SnapshotMethod],
+                        default="auto") # how each variant gets its own copy of the repository, "none" to compile in-place
+    parser.add_argument("--container-pool", type=bool, default=True) # if True, reuse long-lived containers for batch compilation
+    parser.add_argument("--container-max-jobs", type=int, default=50) # recycle a pooled container after this many jobs
+    parser.add_argument("--docker-api", type=bool, default=True) # if True, talk to the Docker daemon socket directly instead of the CLI
+    parser.add_argument("--manifest-file", type=str, default="manifest.db") # crawl progress, used to resume interrupted runs
+    parser.add_argument("--configure-cache", type=bool, default=True) # if True, run configure once per repo and share the results across variants
+    parser.add_argument("--autoconf-cache-folder", type=str, default="autoconf_cache/") # where autoconf feature test results are shared across repos, "" to disable
+    parser.add_argument("--autotools-cache-folder", type=str, default="autotools_cache/") # where autoreconf/autogen.sh outputs are shared across repos, "" to disable
+    parser.add_argument("--autotools-cache-size", type=int, default=10*1024*1024*1024) # evict least recently used autotools outputs beyond 10GB
+    parser.add_argument("--make-job-budget", type=int, default=None) # extra `make` jobs shared by all builds, defaults to #cores not used by workers
+    parser.add_argument("--max-make-jobs", type=int, default=8) # maximum number of `make` jobs per build
+    parser.add_argument("--reuse-builds", type=bool, default=True) # if True, repos whose HEAD commit was already compiled (e.g. forks) reuse its binaries
+    parser.add_argument("--bitcode-cache", type=bool, default=True) # if True, clang variants of a repo share LLVM bitcode and only rerun their passes
+    parser.add_argument("--adv-procs", type=int, default=4) # number of processes rewriting source files for ADV obfuscation
+    parser.add_argument("--elf-types", type=str, default="executable,pie,shared") # comma-separated types of ELF files collected as binaries, "" for all
+    parser.add_argument("--stall-timeout", type=float, default=300) # kill builds that make no progress for this many seconds, 0 to disable
+    parser.add_argument("--object-cache-folder", type=str, default="object_cache/") # where the mock compilers cache object files across repos, "" to disable
 
     return parser.parse_args()
 
@@ -77,6 +100,8 @@ class PipelineMetaInfo(TypedDict):
     num_makefiles: int  # total number of Makefiles
     has_gitmodules: bool  # whether repo contains a .gitmodules file
     makefiles_using_automake: int  # how many Makefiles uses `automake`
+    num_c_files: int  # number of C source files
+    num_cpp_files: int  # number of C++ source files
 
 class PipelineResult(NamedTuple):
     repo_info: RepoInfo
@@ -85,6 +110,7 @@ class PipelineResult(NamedTuple):
     makefiles: Optional[List] = None
     libraries: Optional[List[str]] = None
     meta_info: Optional[PipelineMetaInfo] = None
+    scan: Optional[ghcc.RepoScan] = None  # Makefiles and other information of the checkout, scanned after cloning
 
 def contains_in_file(file_path: str, text: str) -> bool:
     r"""Check whether the file contains a specific piece of text in its first line.
@@ -105,77 +131,114 @@ def exception_handler(e, repo_info: RepoInfo, _return: bool = False):
         # mark it as "failed to clone" so we don't deal with it anymore
         return PipelineResult(repo_info, clone_success=False)
 
-def check_obfuscation(repo_path: str):
+def check_obfuscation(repo_binary_dir: str) -> bool:
+    r"""Check whether the binaries of the ADV obfuscation variant are built from rewritten sources, using the manifest
+    of rewritten files and the list of compiled sources, which are written to the binary directory during compilation.
+    The list of compiled sources is removed afterwards.
+
+    :param repo_binary_dir: Path to the directory of compiled binaries of the variant.
+    :return: Whether at least one compiled C source was rewritten by ADVobfuscator.
     """
-    param: path: Path to the repository directory you want to search
-    returns: whether the repo ADV-Obfuscation headers were committed
+    manifest_path = os.path.join(repo_binary_dir, "adv_manifest.json")
+    sources_path = os.path.join(repo_binary_dir, "compiled_sources.txt")
+    if not os.path.exists(manifest_path) or not os.path.exists(sources_path):
+        return False
+    with open(manifest_path) as f:
+        rewritten = {entry["file"] for entry in json.load(f)}
+    with open(sources_path) as f:
+        compiled = set(f.read().split("\n")) - {""}
+    os.remove(sources_path)
+    return len(compiled & rewritten) > 0
+
+def get_repo_paths(repo_info: RepoInfo, clone_folder: str) -> Tuple[str, str, str]:
+    r"""Return the full name of the repository, the name of its folder, and the path where it is cloned to."""
+    repo_full_name = f"{repo_info.repo_owner}/{repo_info.repo_name}"
+    repo_folder_name = f"{repo_info.repo_owner}_____{repo_info.repo_name}"
+    return repo_full_name, repo_folder_name, os.path.join(clone_folder, repo_folder_name)
+
+def get_configure_cache_path(repo_path: str) -> str:
+    r"""Return the path where results of the configure steps are shared between variants of the repository."""
+    return f"{repo_path}.configure"
+
+def get_bitcode_cache_path(repo_path: str) -> str:
+    r"""Return the path where LLVM bitcode is shared between clang variants of the repository."""
+    return f"{repo_path}.bitcode"
+
+def prepare_image_cache_folder(cache_folder: str, image_id: str) -> str:
+    r"""Return the directory in the cache folder for results computed in the Docker image with the given ID. Results of
+    other images are outdated, and are removed."""
+    if os.path.exists(cache_folder):
+        for name in os.listdir(cache_folder):
+            if name != image_id:
+                flutes.log(f"Removing outdated cache '{os.path.join(cache_folder, name)}'", "warning",
+                           force_console=True)
+                shutil.rmtree(os.path.join(cache_folder, name), ignore_errors=True)
+    return os.path.join(cache_folder, image_id)
+
+def link_binaries(makefiles: List[Dict[str, Any]], source_dir: str, dest_dir: str) -> bool:
+    r"""Link binaries of a previous build into the binary folder of another repository. Hard links are used when
+    possible, so binaries shared by forks take no extra space.
+
+    :return: Whether all binaries of the previous build exist.
     """
-    obfuscated = False
-    for root, dirs, files in os.walk(repo_path):
-        for file in files:
-            if (file.endswith(".c")):
-                file_path = os.path.join(root, file)
-                with open(file_path, "rb") as f:
-                    #if bytes("OBFUSCATED", "utf8") in f.read():
-                    if bytes("#include \"/Lib/Log.h\"", "utf8") in f.read():
-                        obfuscated = True
-                        break
-        if obfuscated: break
-    return obfuscated    
+    hashes = {signature for makefile in makefiles for signature in makefile["sha256"]}
+    if not all(os.path.exists(os.path.join(source_dir, signature)) for signature in hashes):
+        return False
+    os.makedirs(dest_dir, exist_ok=True)
+    for signature in hashes:
+        source_path, dest_path = os.path.join(source_dir, signature), os.path.join(dest_dir, signature)
+        if os.path.exists(dest_path):
+            continue  # binaries are named by their hashes, so this is the same file
+        try:
+            os.link(source_path, dest_path)
+        except OSError:
+            shutil.copy2(source_path, dest_path)
+    return True
+
+def get_archive_path(repo_info: RepoInfo, archive_folder: str, compression_type: str) -> Tuple[str, str]:
+    r"""Return the path to the archive of the repository, and the ``tar`` flag for its compression type."""
+    if compression_type == "xz":
+        archive_extension = ".tar.xz"
+        tar_type_flag = "J"
+    elif compression_type == "gzip":
+        archive_extension = ".tar.gz"
+        tar_type_flag = "z"
+    else:
+        raise ValueError(f"Invalid compression type '{compression_type}'")
+    repo_full_name = f"{repo_info.repo_owner}/{repo_info.repo_name}"
+    return os.path.abspath(os.path.join(archive_folder, f"{repo_full_name}{archive_extension}")), tar_type_flag
+
+def stage_exception_handler(e, result: PipelineResult):
+    exception_handler(e, result.repo_info)
 
 @flutes.exception_wrapper(exception_handler)
-def clone_and_compile(repo_info: RepoInfo, clone_folder: str, binary_folder: str, archive_folder: str, compiler: str,
-                      recursive_clone: bool = True,
-                      clone_timeout: Optional[float] = None, compile_timeout: Optional[float] = None,
-                      force_reclone: bool = False, force_recompile: bool = False, docker_batch_compile: bool = True,
-                      max_archive_size: Optional[int] = None, compression_type: str = "gzip",
-                      record_libraries: bool = False, record_metainfo: bool = True,
-                      gcc_override_flags: Optional[str] = None, random_optimization: bool = True) -> PipelineResult:
-    r"""Perform the entire pipeline.
+def clone_repo(repo_info: RepoInfo, clone_folder: str, archive_folder: str, recursive_clone: bool = True,
+               clone_timeout: Optional[float] = None, force_reclone: bool = False, force_recompile: bool = False,
+               compression_type: str = "gzip",
+               manifest: Optional[ghcc.CrawlManifest] = None) -> PipelineResult:
+    r"""Clone the repository from GitHub, or extract it from an existing archive, and find Makefiles in it.
 
     :param repo_info: Information about the repository.
     :param clone_folder: Path to the folder where the repository will be stored. The actual destination folder will be
         ``clone_folder/repo_owner_____repo_name``, e.g., ``clone_folder/torvalds_____linux``.
         This strange notation is used in order to have a flat directory hierarchy, so we're not left with a bunch of
         empty folders for repository owners.
-    :param binary_folder: Path to the folder where compiled binaries will be stored. The actual destination folder will
-        be ``binary_folder/repo_owner/repo_name``, e.g., ``binary_folder/torvalds/linux``.
-    :param archive_folder: Path to the folder where archived repositories will be stored. The actual archive file will
+    :param archive_folder: Path to the folder where archived repositories are stored. The actual archive file will
         be ``archive_folder/repo_owner/repo_name.tar.xz``, e.g., ``archive_folder/torvalds/linux.tar.xz``.
-    :param compiler: Type of compiler to use, either "gcc" or "g++"
-        
     :param recursive_clone: If ``True``, uses ``--recursive`` when cloning.
     :param clone_timeout: Timeout for cloning, or `None` (default) for unlimited time.
-    :param compile_timeout: Timeout for compilation, or `None` (default) for unlimited time.
     :param force_reclone: If ``True``, always clone a fresh copy for compilation. If ``False``, only clone when there
         are no matching archives.
     :param force_recompile: If ``True``, the repository is compiled regardless of the value in DB.
-    :param docker_batch_compile: If ``True``, compile all Makefiles within a repository in a single Docker container.
-    :param max_archive_size: If specified, only archive repositories whose size is not larger than the given
-        value (in bytes).
-    :param compression_type: The file type of the archive to produce. Valid values are ``"gzip"`` (faster) and
-        ``"xz"`` (smaller).
-    :param record_libraries: If ``True``, record the libraries used in compilation.
-    :param record_metainfo: If ``True``, record meta-info values.
-    :param gcc_override_flags: If not ``None``, these flags will be appended to each invocation of GCC.
-    :param random_optimization: If ``True``, add a random optimization to the list of GCC flags (default is true)
+    :param compression_type: The file type of the archive. Valid values are ``"gzip"`` and ``"xz"``.
+    :param manifest: If not ``None``, repositories that cannot be cloned or contain no Makefiles are recorded in the
+        manifest.
 
-    :return: PipelineResult object, or `None` if no operations are required.
+    :return: PipelineResult object. The repository should be compiled only if ``scan.makefile_dirs`` is not empty.
     """
-    repo_full_name = f"{repo_info.repo_owner}/{repo_info.repo_name}"
+    repo_full_name, repo_folder_name, repo_path = get_repo_paths(repo_info, clone_folder)
     print(f"Cloning/compiling: {repo_full_name}") # print statement to organize compiler output
-
-    repo_folder_name = f"{repo_info.repo_owner}_____{repo_info.repo_name}"
-    repo_path = os.path.join(clone_folder, repo_folder_name)
-    if compression_type == "xz":
-        archive_extension = ".tar.xz"
-        tar_type_flag = "J"
-    elif compression_type == "gzip":
-        archive_extension = ".tar.gz"
-        tar_type_flag = "z"
-    else:
-        raise ValueError(f"Invalid compression type '{compression_type}'")
-    archive_path = os.path.abspath(os.path.join(archive_folder, f"{repo_full_name}{archive_extension}"))
+    archive_path, tar_type_flag = get_archive_path(repo_info, archive_folder, compression_type)
 
     clone_success = None
     # Skip repos that are fully processed
@@ -184,7 +247,6 @@ def clone_and_compile(repo_info: RepoInfo, clone_folder: str, binary_folder: str
             (repo_info.compiled and not force_recompile)):
         return PipelineResult(repo_info)
 
-    # Stage 1: Cloning from GitHub.
     if not force_reclone and os.path.exists(archive_path):
         # Extract the archive instead of cloning.
         try:
@@ -194,7 +256,8 @@ def clone_and_compile(repo_info: RepoInfo, clone_folder: str, binary_folder: str
             flutes.log(f"Unknown error when extracting {repo_full_name}. Captured output: '{e.output}'", "error")
             shutil.rmtree(repo_path)
             return PipelineResult(repo_info)  # return dummy info
-        repo_size = flutes.get_folder_size(repo_path)
+        scan = ghcc.scan_repo(repo_path)
+        repo_size = scan.size
     elif (repo_info is None or  # not processed
           force_reclone or
           (repo_info.clone_successful and  # not compiled
@@ -208,6 +271,8 @@ def clone_and_compile(repo_info: RepoInfo, clone_folder: str, binary_folder: str
                 flutes.log(f"{repo_full_name} skipped because folder exists", "warning")
             elif clone_result.error_type is CloneErrorType.PrivateOrNonexistent:
                 flutes.log(f"Failed to clone {repo_full_name} because repository is private or nonexistent", "warning")
+                if manifest is not None:
+                    manifest.finish_repo(repo_full_name, ghcc.RepoStatus.Failed, message="private or nonexistent")
             else:
                 if clone_result.error_type is CloneErrorType.Unknown:
                     msg = f"Failed to clone {repo_full_name} with unknown error"
@@ -228,137 +293,286 @@ def clone_and_compile(repo_info: RepoInfo, clone_folder: str, binary_folder: str
                 msg += f". Captured output: '{clone_result.captured_output!r}'"
             flutes.log(msg, "warning")
 
-        repo_size = flutes.get_folder_size(repo_path)
+        scan = ghcc.scan_repo(repo_path)
+        repo_size = scan.size
         flutes.log(f"{repo_full_name} successfully cloned ({clone_result.time:.2f}s, "
                    f"{flutes.readable_size(repo_size)})", "success")
     else:
         if not repo_info.clone_successful:
             return PipelineResult(repo_info)  # return dummy info
-        repo_size = flutes.get_folder_size(repo_path)
+        scan = ghcc.scan_repo(repo_path)
+        repo_size = scan.size
 
     # add git_commit_hash to the meta info
-    repo_info.commit_hash = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.join(clone_folder, repo_folder_name), check=True, stdout=subprocess.PIPE).stdout.decode("utf8").strip()
+    repo_info.commit_hash = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_path, check=True, stdout=subprocess.PIPE).stdout.decode("utf8").strip()
 
+    if len(scan.makefile_dirs) == 0:
+        # Repo has no Makefiles, delete.
+        shutil.rmtree(repo_path)
+        flutes.log(f"No Makefiles found in {repo_full_name}, repository deleted", "warning")
+        if manifest is not None:
+            manifest.finish_repo(repo_full_name, ghcc.RepoStatus.Failed, commit_hash=repo_info.commit_hash,
+                                 repo_size=repo_size, message="no Makefiles")
+        return PipelineResult(repo_info, clone_success=clone_success, repo_size=repo_size, makefiles=[])
+
+    return PipelineResult(repo_info, clone_success=clone_success, repo_size=repo_size, scan=scan)
+
+ADV_PRELUDE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "adv-obfuscation", "headers.c")
+
+@flutes.exception_wrapper(stage_exception_handler)
+def compile_variant(result: PipelineResult, variant: ghcc.Variant, clone_folder: str, binary_folder: str,
+                    compiler: str, compile_timeout: Optional[float] = None, docker_batch_compile: bool = True,
+                    record_libraries: bool = False, record_metainfo: bool = True,
+                    gcc_override_flags: Optional[str] = None,
+                    pool: Optional[ghcc.utils.ContainerPool] = None,
+                    docker_client: Optional[ghcc.utils.DockerClient] = None,
+                    manifest: Optional[ghcc.CrawlManifest] = None,
+                    snapshot_methods: Optional[List[ghcc.SnapshotMethod]] = None,
+                    configure_cache: bool = False,
+                    autoconf_cache_dir: Optional[str] = None, autotools_cache_dir: Optional[str] = None,
+                    autotools_cache_size: Optional[int] = None,
+                    job_budget: Optional[ghcc.utils.JobBudget] = None,
+                    object_cache_dir: Optional[str] = None, image_id: Optional[str] = None,
+                    reuse_builds: bool = False, bitcode_cache: bool = False,
+                    adv_procs: int = 0,
+                    elf_types: Optional[List[ghcc.ElfType]] = None,
+                    stall_timeout: Optional[float] = None) -> Optional[PipelineResult]:
+    r"""Compile a cloned repository with one variant.
+
+    :param result: The result of the cloning stage.
+    :param variant: The variant to compile.
+    :param clone_folder: Path to the folder where the repository is cloned.
+    :param binary_folder: Path to the folder where compiled binaries will be stored. The actual destination folder will
+        be ``binary_folder/repo_owner/repo_name/variant``, e.g., ``binary_folder/torvalds/linux/none``.
+    :param compiler: Type of compiler to use for variants that do not specify a compiler, either "gcc" or "g++"
+    :param compile_timeout: Timeout for compilation, or `None` (default) for unlimited time.
+    :param docker_batch_compile: If ``True``, compile all Makefiles within a repository in a single Docker container.
+    :param record_libraries: If ``True``, record the libraries used in compilation.
+    :param record_metainfo: If ``True``, record meta-info values.
+    :param gcc_override_flags: If not ``None``, these flags will be appended to each invocation of GCC, followed by the
+        flags of the variant.
+    :param pool: If not ``None``, batch compilation runs in long-lived containers from this pool.
+    :param docker_client: If not ``None``, Docker is accessed through the Engine API instead of the ``docker`` CLI.
+    :param manifest: If not ``None``, progress of the variant is recorded in the manifest.
+    :param snapshot_methods: If not ``None``, the variant is compiled in a snapshot of the repository, created using the
+        first applicable method in the list. Otherwise, the repository is compiled in-place, and reset afterwards.
+    :param configure_cache: If ``True``, the configure steps are run by the first variant that reaches each Makefile
+        directory, and their results are restored for the other variants. Only used with ``docker_batch_compile``.
+    :param autoconf_cache_dir: If not ``None``, path to the directory where autoconf feature test results are shared
+        between repositories. Only used with ``docker_batch_compile``.
+    :param autotools_cache_dir: If not ``None``, path to the directory where outputs of ``autogen.sh``/``autoreconf``
+        are shared between repositories. Only used with ``docker_batch_compile``.
+    :param autotools_cache_size: Maximum total size (in bytes) of the autotools cache.
+    :param job_budget: If not ``None``, builds use extra ``make`` jobs from this budget when cores are idle.
+    :param object_cache_dir: If not ``None``, path to the directory where object files are cached by the mock
+        compilers, and shared between variants, forks, and reruns. Only used with ``docker_batch_compile``.
+    :param image_id: ID of the Docker image used for compilation. If not ``None`` and a manifest is given, successful
+        builds are indexed in the manifest by commit hash, variant, compiler, flags, and image ID.
+    :param reuse_builds: If ``True``, binaries of an indexed build of the same commit (e.g. from a fork) are linked
+        into the binary folder instead of compiling the repository.
+    :param bitcode_cache: If ``True`` and the variant is compiled with clang, LLVM bitcode of each source file is shared
+        with other clang variants of the repository, so that only the ``-mllvm`` passes are run again. Only used with
+        ``docker_batch_compile``.
+    :param adv_procs: Number of processes that rewrite source files for ADV obfuscation.
+    :param elf_types: If not ``None``, only ELF files of these types are collected as binaries.
+    :param stall_timeout: If not ``None``, builds that make no progress for this many seconds are killed before the
+        timeout. Only used with ``docker_batch_compile``.
+
+    :return: PipelineResult object for this variant, or ``None`` if the variant failed.
     """
-    OBFUSCATIONS start here [resetting repository each time, moving binaries to apropriate folder]
-    """
-    flutes.log(f"{repo_full_name} being obfuscated...", "warning")
-    abs_repo_path = os.path.abspath(os.path.join(clone_folder, repo_folder_name))
-
-    gcc_override_flags += " -O1"
-    og_gcc_flags = gcc_override_flags
-    compilations = ["none", "llvm-obfuscation-fla", "llvm-obfuscation-sub", "llvm-obfuscation-bcf", "llvm-obfuscation-all", "adv-obfuscation"]
-    for comp in compilations:
-        gcc_override_flags = og_gcc_flags
-        repo_info.compiled = False
-        repo_info.obfuscation = comp
-
-        # apply ADVObfuscator (compile using original makefiles, forcing g++)
-        if comp == "adv-obfuscation":
-            compiler = "g++"
-            subprocess.run(["docker", "run", "--rm", "-v", f"{abs_repo_path}:/repos", "adv-obfuscation", "--repo-path", "/repos", "--header-lib-path", "Lib"])
-        
-        # use llvm clang compiler
-        if comp.startswith("llvm"):
-            compiler = "clang"
-            option = comp[-4:]
-            #flutes.log(f"LLVM WITH {option}", "warning")
-            if option == "-all":
-                gcc_override_flags += "-mllvm -fla -mllvm -sub -mvllvm -bcf"
+    repo_info = copy.copy(result.repo_info)  # each variant has its own record
+    repo_full_name, repo_folder_name, repo_path = get_repo_paths(repo_info, clone_folder)
+    makefile_dirs = result.scan.makefile_dirs if result.scan is not None else []
+    compiler = variant.compiler or compiler
+    gcc_override_flags = variant.compiler_flags(gcc_override_flags)
+    repo_info.compiled = False
+    repo_info.obfuscation = variant.name
+    repo_info.optimization = variant.optimization
+
+    build_key: Optional[Tuple[str, str, str, Optional[str], str]] = None
+    if manifest is not None and image_id is not None and repo_info.commit_hash:
+        build_key = (repo_info.commit_hash, variant.name, compiler, gcc_override_flags, image_id)
+    if build_key is not None and reuse_builds:
+        build = manifest.find_build(*build_key)
+        repo_binary_dir = os.path.join(binary_folder, repo_full_name, variant.name)
+        if build is not None and link_binaries(build["makefiles"], os.path.join(binary_folder, build["repo"],
+                                                                                variant.name), repo_binary_dir):
+            makefiles = build["makefiles"]
+            record = build["record"] or {}
+            for key in ["compiled", "num_makefiles", "num_makefiles_succeeded", "num_makefiles_binaries",
+                        "num_binaries"]:
+                if key in record:
+                    setattr(repo_info, key, record[key])
+            flutes.log(f"{variant.name} compilation for {repo_full_name} reused from {build['repo']} "
+                       f"(commit {repo_info.commit_hash[:8]})", "success")
+            manifest.start_variant(repo_full_name, variant.name, commit_hash=repo_info.commit_hash, compiler=compiler,
+                                   flags=gcc_override_flags)
+            manifest.finish_variant(repo_full_name, variant.name, ghcc.VariantStatus.Done,
+                                    record=repo_info.serialize(), makefiles=makefiles)
+            return result._replace(repo_info=repo_info, makefiles=makefiles, libraries=build["libraries"],
+                                   meta_info=build["meta_info"])
+
+    configure_cache_dir: Optional[str] = None
+    if configure_cache and docker_batch_compile:
+        # Created here so that it exists when ownership is transferred in a pooled container.
+        configure_cache_dir = get_configure_cache_path(repo_path)
+        os.makedirs(configure_cache_dir, exist_ok=True)
+    bitcode_cache_dir: Optional[str] = None
+    if bitcode_cache and docker_batch_compile and variant.shares_bitcode:
+        bitcode_cache_dir = get_bitcode_cache_path(repo_path)
+        os.makedirs(bitcode_cache_dir, exist_ok=True)
+
+    snapshot: Optional[ghcc.RepoSnapshot] = None
+    if snapshot_methods is not None:
+        # Build in a throwaway snapshot of the pristine checkout, so the repository doesn't have to be reset between
+        # variants, and variants can be compiled concurrently.
+        methods = snapshot_methods
+        if variant.modifies_source:
+            # Hard links would propagate in-place modifications to the original files.
+            methods = [method for method in methods if method is not ghcc.SnapshotMethod.Hardlink] or \
+                      [ghcc.SnapshotMethod.Copy]
+        snapshot = ghcc.RepoSnapshot(repo_path, f"{repo_path}.{variant.name}", methods)
+        makefile_dirs = [os.path.join(snapshot.path, os.path.relpath(directory, repo_path))
+                         for directory in makefile_dirs]
+        repo_path = snapshot.path
+
+    try:
+        repo_binary_dir = os.path.join(binary_folder, repo_full_name, variant.name)
+        os.makedirs(repo_binary_dir, exist_ok=True)
+        flutes.log(f"Starting {variant.name} compilation for {repo_full_name}...")
+
+        if manifest is not None:
+            manifest.start_variant(repo_full_name, variant.name, commit_hash=repo_info.commit_hash, compiler=compiler,
+                                   flags=gcc_override_flags)
+
+        if docker_batch_compile:
+            makefiles = ghcc.docker_batch_compile(
+                repo_binary_dir, repo_path, compiler, compile_timeout, record_libraries, gcc_override_flags,
+                user_id=(repo_info.idx % 10000) + 30000,  # user IDs 30000 ~ 39999
+                exception_log_fn=functools.partial(exception_handler, repo_info=repo_info), pool=pool,
+                log_path=os.path.join(binary_folder, repo_full_name, f"{variant.name}.log"), client=docker_client,
+                clean_repo=(snapshot is None), configure_cache_dir=configure_cache_dir,
+                autoconf_cache_dir=autoconf_cache_dir, autotools_cache_dir=autotools_cache_dir,
+                autotools_cache_size=autotools_cache_size, job_budget=job_budget, object_cache_dir=object_cache_dir,
+                bitcode_cache_dir=bitcode_cache_dir, adv_obfuscation=variant.adv_obfuscation, adv_procs=adv_procs,
+                makefile_dirs=makefile_dirs, elf_types=elf_types, stall_timeout=stall_timeout)
+        else:
+            adv_prelude = None
+            if variant.adv_obfuscation:
+                with open(ADV_PRELUDE_PATH) as f:
+                    adv_prelude = f.read()
+            makefiles = list(ghcc.compile_and_move(
+                repo_binary_dir, repo_path, makefile_dirs, compiler, compile_timeout, record_libraries,
+                gcc_override_flags, clean_repo=(snapshot is None), job_budget=job_budget, adv_prelude=adv_prelude,
+                adv_procs=adv_procs, elf_types=elf_types))
+
+        # double check - don't count the binaries produced from non-obfuscated code
+        if variant.adv_obfuscation and not check_obfuscation(repo_binary_dir):
+            subprocess.run(["rm", "-rf", repo_binary_dir])
+            flutes.log("Repo not obfuscated properly, deleted.", "warning")
+            if manifest is not None:
+                manifest.finish_variant(repo_full_name, variant.name, ghcc.VariantStatus.Failed,
+                                        record=repo_info.serialize())
+            return None
+
+        num_succeeded = sum(makefile["success"] for makefile in makefiles)
+        libraries = None
+        if record_libraries:
+            library_log_path = os.path.join(repo_binary_dir, "libraries.txt")
+            if os.path.exists(library_log_path):
+                with open(library_log_path) as f:
+                    libraries = list(set(f.read().split()))
             else:
-                gcc_override_flags += " -mllvm "+option
+                libraries = []
+        num_binaries = sum(len(makefile["binaries"]) for makefile in makefiles)
+        object_cache_stats_path = os.path.join(repo_binary_dir, "object_cache_stats.txt")
+        if os.path.exists(object_cache_stats_path):
+            with open(object_cache_stats_path) as f:
+                stats = f.read().split()
+            os.remove(object_cache_stats_path)
+            flutes.log(f"Object cache for {repo_full_name} ({variant.name}): "
+                       f"{stats.count('hit')} hit(s), {stats.count('miss')} miss(es)")
+        bytes_moved = sum(makefile["bytes_moved"] for makefile in makefiles)
+        if bytes_moved > 0:
+            move_time = max(sum(makefile["move_time"] for makefile in makefiles), 1e-3)
+            flutes.log(f"Moved {num_binaries} binaries ({flutes.readable_size(bytes_moved)}) of {repo_full_name} "
+                       f"({variant.name}) in {move_time:.2f}s ({flutes.readable_size(bytes_moved / move_time)}/s)")
+
+        msg = f"{num_succeeded} ({len(makefiles)}) out of {len(makefile_dirs)} Makefile(s) " \
+              f"in {repo_full_name} compiled (partially) with {variant.name}, yielding {num_binaries} binaries"
+        flutes.log(msg, "success" if num_succeeded == len(makefile_dirs) else "warning")
+
+        # update repo_info class attributes
+        repo_info.num_binaries = num_binaries
+        repo_info.num_makefiles = len(makefile_dirs) # total num of makefiles
+        repo_info.num_makefiles_succeeded = num_succeeded
+        repo_info.num_makefiles_binaries = len(makefiles) # num makefiles which succeeded or produced binaries
+        if len(makefiles) > 0:
+            repo_info.compiled = True
 
-        makefiles = None
-        libraries = None
         meta_info: Optional[PipelineMetaInfo] = None
-        if not repo_info.compiled or force_recompile:
-            # # SPECIAL CHECK: Do not attempt to compile OS kernels!
-            # kernel_name = None
-            # if contains_in_file(os.path.join(repo_path, "README"), "Linux kernel release"):
-            #     kernel_name = "Linux"
-            # elif contains_in_file(os.path.join(repo_path, "README"), "FreeBSD source directory"):
-            #     kernel_name = "FreeBSD"
-            # if kernel_name is not None:
-            #     shutil.rmtree(repo_path)
-            #     ghcc.log(f"Found {kernel_name} kernel in {repo_full_name}, will not attempt to compile. "
-            #              f"Repository deleted", "warning")
-            #     return PipelineResult(repo_info, clone_success=clone_success, makefiles=[])
-
-            # Stage 2: Finding Makefiles.
-            makefile_dirs = ghcc.find_makefiles(repo_path)
-
-            if len(makefile_dirs) == 0:
-                # Repo has no Makefiles, delete.
-                shutil.rmtree(repo_path)
-                flutes.log(f"No Makefiles found in {repo_full_name}, repository deleted", "warning")
-                return PipelineResult(repo_info, clone_success=clone_success, makefiles=[])
-            else:
-                pass
-
-            # Stage 3: Compile each Makefile.
-            repo_binary_dir = os.path.join(binary_folder, repo_full_name)+"/"+comp
-            if not os.path.exists(repo_binary_dir):
-                os.makedirs(repo_binary_dir)
-            flutes.log(f"Starting {comp} compilation for {repo_full_name}...")
-
-            # add optimization level to compile with (compiled everything with O1)
-            opt = "O1"
-            repo_info.optimization = opt
-
-            # print(f"gcc_override_flags {gcc_override_flags}")
-            if docker_batch_compile:
-                makefiles = ghcc.docker_batch_compile(
-                    repo_binary_dir, repo_path, compiler, compile_timeout, record_libraries, gcc_override_flags,
-                    user_id=(repo_info.idx % 10000) + 30000,  # user IDs 30000 ~ 39999
-                    exception_log_fn=functools.partial(exception_handler, repo_info=repo_info))
-            else:
-                makefiles = list(ghcc.compile_and_move(
-                    repo_binary_dir, repo_path, makefile_dirs, compile_timeout, record_libraries, gcc_override_flags))
-            
-            # double check - don't count the binaries produced from non-obfuscated code
-            if comp == "adv-obfuscation" and not check_obfuscation(repo_path):
-                subprocess.run(["rm", "-rf", repo_binary_dir])
-                flutes.log("Repo not obfuscated properly, deleted.", "warning")
-                with open("meta_data.json", "a+") as f:
-                    f.write(json.dumps(repo_info.serialize()))
-                continue
-            
-            num_succeeded = sum(makefile["success"] for makefile in makefiles)
-            if record_libraries:
-                library_log_path = os.path.join(repo_binary_dir, "libraries.txt")
-                if os.path.exists(library_log_path):
-                    with open(library_log_path) as f:
-                        libraries = list(set(f.read().split()))
-                else:
-                    libraries = []
-            num_binaries = sum(len(makefile["binaries"]) for makefile in makefiles)
-
-            msg = f"{num_succeeded} ({len(makefiles)}) out of {len(makefile_dirs)} Makefile(s) " \
-                  f"in {repo_full_name} compiled (partially), yielding {num_binaries} binaries"
-            flutes.log(msg, "success" if num_succeeded == len(makefile_dirs) else "warning")
-
-            # update repo_info class attributes
-            repo_info.num_binaries = num_binaries
-            repo_info.num_makefiles = len(makefile_dirs) # total num of makefiles
-            repo_info.num_makefiles_suceeded = num_succeeded 
-            repo_info.num_makefiles_binaries = len(makefiles) # num makefiles which succeeded or produced binaries
-            if len(makefiles) > 0:
-                repo_info.compiled = True
-            
-            if record_metainfo:
-                meta_info = PipelineMetaInfo({
-                    "num_makefiles": len(makefile_dirs),
-                    "has_gitmodules": os.path.exists(os.path.join(repo_path, ".gitmodules")),
-                    "makefiles_using_automake": sum(
-                        ghcc.contains_files(directory, ["configure.ac", "configure.in"]) for directory in makefile_dirs)
-                })
-
-            # add to meta_data.json
-            with open("meta_data.json", "a+") as f:
-                f.write(json.dumps(repo_info.serialize()))
-                f.write(",\n")
-
-    # Stage 4: Clean and zip repo.
+        if record_metainfo:
+            scan = result.scan
+            meta_info = PipelineMetaInfo({
+                "num_makefiles": len(makefile_dirs),
+                "has_gitmodules": scan.has_gitmodules,
+                "makefiles_using_automake": len(scan.automake_dirs),
+                "num_c_files": scan.num_c_files,
+                "num_cpp_files": scan.num_cpp_files,
+            })
+
+        if manifest is not None:
+            manifest.finish_variant(repo_full_name, variant.name, ghcc.VariantStatus.Done, record=repo_info.serialize(),
+                                    makefiles=makefiles)
+            if build_key is not None and len(makefiles) > 0:
+                manifest.record_build(*build_key, repo=repo_full_name, makefiles=makefiles,
+                                      record=repo_info.serialize(), libraries=libraries, meta_info=meta_info)
+
+        return result._replace(repo_info=repo_info, makefiles=makefiles, libraries=libraries, meta_info=meta_info)
+    finally:
+        if snapshot is not None:
+            snapshot.remove()
+
+def merge_variant_results(result: PipelineResult, variant_results: List[Optional[PipelineResult]]) -> PipelineResult:
+    r"""Combine results of all variants of a repository into the result passed to the archiving stage. Makefiles and
+    meta-info are taken from the last successful variant, and libraries are combined."""
+    variant_results_ = [variant_result for variant_result in variant_results if variant_result is not None]
+    if len(variant_results_) == 0:
+        return result
+    libraries: Optional[List[str]] = None
+    if any(variant_result.libraries is not None for variant_result in variant_results_):
+        libraries = sorted(set(library for variant_result in variant_results_
+                               for library in (variant_result.libraries or [])))
+    return variant_results_[-1]._replace(libraries=libraries)
+
+@flutes.exception_wrapper(stage_exception_handler)
+def archive_repo(result: PipelineResult, clone_folder: str, archive_folder: str,
+                 clone_timeout: Optional[float] = None, max_archive_size: Optional[int] = None,
+                 compression_type: str = "gzip", manifest: Optional[ghcc.CrawlManifest] = None) -> PipelineResult:
+    r"""Archive the compiled repository to save space, and remove the cloned folder.
+
+    :param result: The combined result of all variants.
+    :param clone_folder: Path to the folder where the repository is cloned.
+    :param archive_folder: Path to the folder where archived repositories will be stored. The actual archive file will
+        be ``archive_folder/repo_owner/repo_name.tar.xz``, e.g., ``archive_folder/torvalds/linux.tar.xz``.
+    :param clone_timeout: Timeout for compression, or `None` (default) for unlimited time.
+    :param max_archive_size: If specified, only archive repositories whose size is not larger than the given
+        value (in bytes).
+    :param compression_type: The file type of the archive to produce. Valid values are ``"gzip"`` (faster) and
+        ``"xz"`` (smaller).
+    :param manifest: If not ``None``, the repository is marked as finished in the manifest.
+
+    :return: The final PipelineResult object.
+    """
+    repo_info, repo_size = result.repo_info, result.repo_size
+    repo_full_name, repo_folder_name, repo_path = get_repo_paths(repo_info, clone_folder)
+    archive_path, tar_type_flag = get_archive_path(repo_info, archive_folder, compression_type)
+
+    # Results of the configure steps and bitcode are only useful while variants of the repository are being compiled.
+    for cache_path in [get_configure_cache_path(repo_path), get_bitcode_cache_path(repo_path)]:
+        if os.path.exists(cache_path):
+            shutil.rmtree(cache_path)
+
     if max_archive_size is not None and repo_size > max_archive_size:
         shutil.rmtree(repo_path)
         flutes.log(f"Removed {repo_full_name} because repository size ({flutes.readable_size(repo_size)}) "
@@ -381,10 +595,22 @@ def clone_and_compile(repo_info: RepoInfo, clone_folder: str, binary_folder: str
         elif os.path.exists(archive_path):
             os.remove(archive_path)
 
-    return PipelineResult(repo_info, clone_success=clone_success, repo_size=repo_size,
-                          makefiles=makefiles, libraries=libraries, meta_info=meta_info)
+    if manifest is not None:
+        manifest.finish_repo(repo_full_name, ghcc.RepoStatus.Done, commit_hash=repo_info.commit_hash,
+                             repo_size=repo_size)
+
+    return result
 
-def iter_repos(repo_list_path: str, max_count: Optional[int] = None) -> Iterator[RepoInfo]:
+def iter_repos(repo_list_path: str, max_count: Optional[int] = None,
+               manifest: Optional[ghcc.CrawlManifest] = None) -> Iterator[RepoInfo]:
+    r"""Iterate over repositories in the list.
+
+    :param repo_list_path: Path to the list of repository URLs, one per line.
+    :param max_count: Maximum number of repositories to iterate over, including skipped ones.
+    :param manifest: If not ``None``, repositories that are marked as finished in the manifest are skipped. Indices of
+        the remaining repositories are not affected.
+    """
+    finished_repos = manifest.finished_repos() if manifest is not None else set()
     index = 0
     with open(repo_list_path, "r") as repo_file:
         for line in repo_file:
@@ -394,9 +620,10 @@ def iter_repos(repo_list_path: str, max_count: Optional[int] = None) -> Iterator
             if url.endswith(".git"):
                 url = url[:-len(".git")]
             repo_owner, repo_name = url.split("/")[-2:]
-            
-            yield RepoInfo(index, repo_owner, repo_name, repo_size=os.path.getsize(repo_file.name),
-                clone_successful=True, compiled=False, num_makefiles=None, num_binaries=None)
+
+            if f"{repo_owner}/{repo_name}" not in finished_repos:
+                yield RepoInfo(index, repo_owner, repo_name, repo_size=os.path.getsize(repo_file.name),
+                    clone_successful=True, compiled=False, num_makefiles=None, num_binaries=None)
             index += 1
             if max_count is not None and index >= max_count:
                 break
@@ -410,10 +637,13 @@ def iter_repos(repo_list_path: str, max_count: Optional[int] = None) -> Iterator
         return msg
 
 def main() -> None:
-    if not ghcc.utils.verify_docker_image(verbose=True):
-        exit(1)
-
     args = get_args()
+
+    docker_client: Optional[ghcc.utils.DockerClient] = None
+    if args.docker_api and ghcc.utils.DockerClient.is_available():
+        docker_client = ghcc.utils.DockerClient()
+    if not ghcc.utils.verify_docker_image(verbose=True, client=docker_client):
+        exit(1)
     
     #if args.n_procs == 0:
         # Only do this on the single-threaded case.
@@ -425,7 +655,7 @@ def main() -> None:
     if os.path.exists(args.clone_folder):
         flutes.log(f"Removing contents of clone folder '{args.clone_folder}'...", "warning", force_console=True)
         ghcc.utils.run_docker_command(["rm", "-rf", "/usr/src/*"], user=0,
-                                      directory_mapping={args.clone_folder: "/usr/src"})
+                                      directory_mapping={args.clone_folder: "/usr/src"}, client=docker_client)
     else:
         flutes.log(f"Creating clone folder '{args.clone_folder}'.", "warning", force_console=True)
         subprocess.run(["mkdir", args.clone_folder])
@@ -433,10 +663,12 @@ def main() -> None:
     # set random seed for random_optimization flags
     random.seed(42)
 
-    # create and start meta_data.json file
-    with open("meta_data.json", "w+") as f:
-        f.write("[")
-        f.close()
+    manifest = ghcc.CrawlManifest(args.manifest_file)
+    if args.force_recompile:
+        flutes.log(f"Ignoring finished repositories in manifest '{args.manifest_file}'", "warning", force_console=True)
+    else:
+        flutes.log(f"Resuming from manifest '{args.manifest_file}' "
+                   f"({len(manifest.finished_repos())} repositories finished)", "warning", force_console=True)
 
     flutes.log("Crawling starts...", "warning", force_console=True)
     libraries: Set[str] = set()
@@ -449,21 +681,163 @@ def main() -> None:
             with open(args.record_libraries, "w") as f:
                 f.write("\n".join(libraries))
 
-    with flutes.safe_pool(args.n_procs, closing=[flush_libraries]) as pool:
-        iterator = iter_repos(args.repo_list_file, args.max_repos)
-        pipeline_fn: Callable[[RepoInfo], Optional[PipelineResult]] = functools.partial(
-            clone_and_compile,
-            clone_folder=args.clone_folder, binary_folder=args.binary_folder, archive_folder=args.archive_folder,
-            compiler=args.compiler, recursive_clone=args.recursive_clone,
-            clone_timeout=args.clone_timeout, compile_timeout=args.compile_timeout,
-            force_reclone=args.force_reclone, force_recompile=args.force_recompile,
-            docker_batch_compile=args.docker_batch_compile,
-            max_archive_size=args.max_archive_size, compression_type=args.compression_type,
-            record_libraries=(args.record_libraries is not None), record_metainfo=args.record_metainfo,
-            gcc_override_flags=args.gcc_override_flags)
+    # Cached results and indexed builds are only valid for the image they're computed in.
+    autoconf_cache_dir: Optional[str] = None
+    autotools_cache_dir: Optional[str] = None
+    object_cache_dir: Optional[str] = None
+    image_id: Optional[str] = None
+    if args.docker_batch_compile:
+        image_id = ghcc.utils.get_image_id(client=docker_client)[:12]
+        # Caches are created here, so their directories have permissions for all container users.
+        if args.autoconf_cache_folder:
+            autoconf_cache_dir = prepare_image_cache_folder(args.autoconf_cache_folder, image_id)
+            ghcc.AutoconfCache(autoconf_cache_dir)
+        if args.autotools_cache_folder:
+            autotools_cache_dir = prepare_image_cache_folder(args.autotools_cache_folder, image_id)
+            ghcc.AutotoolsCache(autotools_cache_dir)
+        if args.object_cache_folder:
+            object_cache_dir = prepare_image_cache_folder(args.object_cache_folder, image_id)
+            os.makedirs(object_cache_dir, exist_ok=True)
+            os.chmod(object_cache_dir, 0o2770)
+
+    # Each compilation worker uses one core on its own. Cores left idle are given to builds as extra `make` jobs.
+    job_budget: Optional[ghcc.utils.JobBudget] = None
+    job_budget_size = args.make_job_budget
+    if job_budget_size is None:
+        job_budget_size = max(0, (os.cpu_count() or 1) - max(1, args.n_procs))
+    if job_budget_size > 0 and args.max_make_jobs > 1:
+        # Under the clone folder, so that it's visible in pooled containers.
+        job_budget = ghcc.utils.JobBudget(os.path.join(args.clone_folder, ".make-jobs"), job_budget_size,
+                                          args.max_make_jobs)
+
+    container_pool: Optional[ghcc.utils.ContainerPool] = None
+    if args.docker_batch_compile and args.container_pool:
+        os.makedirs(args.binary_folder, exist_ok=True)
+        pool_mapping = {args.clone_folder: "/usr/src/repos", args.binary_folder: "/usr/src/binaries"}
+        if autoconf_cache_dir is not None:
+            pool_mapping[args.autoconf_cache_folder] = "/usr/src/autoconf"
+        if autotools_cache_dir is not None:
+            pool_mapping[args.autotools_cache_folder] = "/usr/src/autotools"
+        if object_cache_dir is not None:
+            pool_mapping[args.object_cache_folder] = "/usr/src/objects"
+        container_pool = ghcc.utils.ContainerPool(pool_mapping, max_jobs=args.container_max_jobs,
+                                                  client=docker_client)
+
+    iterator = iter_repos(args.repo_list_file, args.max_repos,
+                          manifest=(manifest if not args.force_recompile else None))
+    variants = ghcc.select_variants(args.variants.split(",") if args.variants is not None else None)
+    snapshot_methods: Optional[List[ghcc.SnapshotMethod]] = None
+    if args.snapshot_method == "auto":
+        snapshot_methods = [ghcc.SnapshotMethod.Reflink, ghcc.SnapshotMethod.Overlay, ghcc.SnapshotMethod.Copy]
+        if container_pool is not None:
+            # Mounts created after a container starts are not visible through its bind mounts.
+            snapshot_methods.remove(ghcc.SnapshotMethod.Overlay)
+    elif args.snapshot_method != "none":
+        snapshot_methods = [ghcc.SnapshotMethod(args.snapshot_method), ghcc.SnapshotMethod.Copy]
+    clone_fn = functools.partial(
+        clone_repo,
+        clone_folder=args.clone_folder, archive_folder=args.archive_folder, recursive_clone=args.recursive_clone,
+        clone_timeout=args.clone_timeout, force_reclone=args.force_reclone, force_recompile=args.force_recompile,
+        compression_type=args.compression_type, manifest=manifest)
+    compile_fn = functools.partial(
+        compile_variant,
+        clone_folder=args.clone_folder, binary_folder=args.binary_folder, compiler=args.compiler,
+        compile_timeout=args.compile_timeout, docker_batch_compile=args.docker_batch_compile,
+        record_libraries=(args.record_libraries is not None), record_metainfo=args.record_metainfo,
+        gcc_override_flags=args.gcc_override_flags, pool=container_pool, docker_client=docker_client,
+        manifest=manifest, snapshot_methods=snapshot_methods, configure_cache=args.configure_cache,
+        autoconf_cache_dir=autoconf_cache_dir, autotools_cache_dir=autotools_cache_dir,
+        autotools_cache_size=args.autotools_cache_size, job_budget=job_budget, object_cache_dir=object_cache_dir,
+        image_id=image_id, reuse_builds=(args.reuse_builds and not args.force_recompile),
+        bitcode_cache=args.bitcode_cache, adv_procs=args.adv_procs,
+        elf_types=[ghcc.ElfType(elf_type) for elf_type in args.elf_types.split(",")] if args.elf_types else None,
+        stall_timeout=(args.stall_timeout or None))
+    archive_fn = functools.partial(
+        archive_repo,
+        clone_folder=args.clone_folder, archive_folder=args.archive_folder, clone_timeout=args.clone_timeout,
+        max_archive_size=args.max_archive_size, compression_type=args.compression_type, manifest=manifest)
+
+    # Each repository is split into tasks: clone -> one task per variant -> archive. Tasks are dispatched to pools of
+    # workers, so variants of a slow repository don't hold up other work. Earlier repositories have higher priority.
+    sequential = args.n_procs == 0
+    scheduler = ghcc.utils.TaskScheduler({
+        "clone": 0 if sequential else max(1, args.n_clone_procs),
+        "compile": args.n_procs,
+        "archive": 0 if sequential else max(1, args.n_archive_procs),
+    })
+
+    def schedule_variants(result: Optional[PipelineResult]) -> None:
+        # Called when cloning is finished. Exceptions raised by callbacks abort the whole run, and the repository
+        # would never emit its result, so failures are handled here instead.
+        if result is None or result.scan is None or len(result.scan.makefile_dirs) == 0:
+            scheduler.emit(result)
+            return
+        repo_full_name, _, repo_path = get_repo_paths(result.repo_info, args.clone_folder)
+        # Decide which variants to compile before submitting any task, so a failure here leaves nothing running.
+        try:
+            finished_variants = manifest.finished_variants(repo_full_name) if not args.force_recompile else set()
+        except Exception as e:
+            exception_handler(e, result.repo_info)
+            shutil.rmtree(repo_path, ignore_errors=True)
+            try:
+                manifest.finish_repo(repo_full_name, ghcc.RepoStatus.Failed, commit_hash=result.repo_info.commit_hash,
+                                     repo_size=result.repo_size, message=f"scheduling failed: {e}")
+            except Exception as manifest_error:
+                flutes.log_exception(manifest_error, f"Failed to mark {repo_full_name} as failed")
+            scheduler.emit(result)
+            return
+        pending_variants: List[ghcc.Variant] = []
+        # Without snapshots, variants that modify sources are compiled after all other variants.
+        for variant in sorted(variants, key=lambda v: v.modifies_source):
+            if variant.name in finished_variants:
+                flutes.log(f"{variant.name} compilation for {repo_full_name} already finished, skipped")
+            else:
+                pending_variants.append(variant)
+
+        tasks: List[ghcc.utils.Task] = []
+        submit_error: Optional[Exception] = None
+        try:
+            bitcode_task: Optional[ghcc.utils.Task] = None
+            for variant in pending_variants:
+                if snapshot_methods is not None:
+                    # Each variant is compiled in its own snapshot, so all variants can run concurrently.
+                    deps, resource = [], None
+                else:
+                    # Variants share the working tree of the repository, so they hold it as an exclusive resource.
+                    deps, resource = (list(tasks) if variant.modifies_source else []), repo_path
+                if bitcode_task is not None and variant.shares_bitcode and bitcode_task not in deps:
+                    # Wait for the first clang variant to generate the bitcode, instead of generating it concurrently.
+                    deps = deps + [bitcode_task]
+                task = scheduler.submit(functools.partial(compile_fn, result, variant), "compile", deps=deps,
+                                        resource=resource, priority=result.repo_info.idx)
+                if bitcode_task is None and variant.shares_bitcode and args.bitcode_cache and args.docker_batch_compile:
+                    bitcode_task = task
+                tasks.append(task)
+        except Exception as e:
+            exception_handler(e, result.repo_info)
+            submit_error = e
+
+        def archive() -> Optional[PipelineResult]:
+            merged_result = merge_variant_results(result, [task.result for task in tasks])
+            if submit_error is not None:
+                # Not all variants were compiled, so the repository is not marked as finished. Variants that did
+                # finish are recorded, and only the others are compiled when the crawl is resumed.
+                return archive_fn(merged_result, manifest=None)
+            return archive_fn(merged_result)
+
+        # The archive task is submitted even if submission failed partway, so the repository is cleaned up and only
+        # emits its result after all of its tasks are finished.
+        scheduler.submit(archive, "archive", deps=tasks, callback=scheduler.emit, priority=result.repo_info.idx)
+
+    def start_repo(repo_info: RepoInfo) -> None:
+        scheduler.submit(functools.partial(clone_fn, repo_info), "clone", callback=schedule_variants,
+                         priority=repo_info.idx)
+
+    try:
         repo_count = 0
-        
-        for result in pool.imap_unordered(pipeline_fn, iterator):
+        # Clone workers stay at most `clone_prefetch` repositories ahead of the compile workers, which bounds the disk
+        # space used by the clone folder.
+        for result in scheduler.run(iterator, start_repo, max_in_flight=max(1, args.n_procs) + args.clone_prefetch):
             repo_count += 1
             if repo_count % 100 == 0:
                 flutes.log(f"Processed {repo_count} repositories", force_console=True)
@@ -475,12 +849,14 @@ def main() -> None:
                 libraries.update(result.libraries)
                 if repo_count % 10 == 0:  # flush every 10 repos
                     flush_libraries()
-    
-    # complete meta_data.json file
-    subprocess.run("sed -i '$ s/.$//' meta_data.json", shell=True)
-    with open("meta_data.json", "a+") as f:
-        f.write("]")
-        f.close()
+    finally:
+        flush_libraries()
+        if container_pool is not None:
+            container_pool.close()  # removes containers left behind by workers
+
+    # Export records of all finished variants, including those from previous runs.
+    manifest.export_json("meta_data.json")
+    manifest.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,34 @@
+r"""Precompiled ADVobfuscator headers for the ``adv-obfuscation`` variant.
+
+Every C file rewritten by ADVobfuscator starts with the includes in ``adv-obfuscation/headers.c``, which pull in the
+template-heavy ADVobfuscator library. The ``gcc-custom`` image contains the same includes as ``ADV_HEADER``, compiled
+into precompiled headers under ``ADV_HEADER.gch/`` with the flags used by the mock g++. Injecting the header with
+``-include`` lets g++ load a precompiled header instead of parsing the library for each source file, and the includes
+in the source are then skipped by the ``HEADERFILE`` guard.
+
+The header is only injected if ``MOCK_GCC_ADV_PCH`` is set, which :meth:`ghcc.compile_and_move` does for the
+``adv-obfuscation`` variant. Other builds with ``COMPILER=g++`` compile sources that were not rewritten, so the header
+would change their meaning.
+
+g++ picks the first precompiled header in the directory that is valid for the flags of the compilation. If none is
+valid (e.g. for sources compiled with different ``-D`` flags), the header is parsed as usual.
+"""
+import os
+from typing import List
+
+ADV_HEADER = "/Lib/ADVobfuscator.h"
+
+
+def include_flags(args: List[str]) -> List[str]:
+    r"""Return the flags to inject the precompiled header, if the arguments compile C sources rewritten by
+    ADVobfuscator and the precompiled headers exist.
+
+    :param args: Arguments passed to the mock compiler.
+    """
+    if len(os.environ.get("MOCK_GCC_ADV_PCH", "").strip()) == 0:
+        return []
+    if not any(not arg.startswith("-") and arg.endswith(".c") for arg in args):
+        return []
+    if not os.path.isdir(ADV_HEADER + ".gch"):
+        return []
+    return ["-include", ADV_HEADER]
@@ -2,12 +2,11 @@
 #print("IN batch_make.py **********")
 
 import functools
+import json
 import multiprocessing as mp
 import os
 import pickle
-import queue
-import time
-from typing import Dict, List, Optional
+from typing import Dict, Optional
 
 import argtyped
 import flutes
@@ -21,16 +20,35 @@ class Arguments(argtyped.Arguments):
     record_libraries: Switch = False
     gcc_override_flags: Optional[str] = None
     use_makefile_info_pkl: Switch = False
+    use_makefile_dirs_json: Switch = False  # read Makefile directories found by the host instead of scanning the repo
     single_process: Switch = False  # useful for debugging
     verbose: Switch = False
     compiler: str # type of compiler to use, "gcc" or "g++"
+    repo_path: str = "/usr/src/repo"  # these differ from the defaults when run in a pooled container
+    binary_path: str = "/usr/src/bin"
+    clean: Switch = True  # disable with `--no-clean` when compiling in a throwaway snapshot of the repository
+    configure_cache: Optional[str] = None  # directory where configure results are shared by variants of the repository
+    autoconf_cache: Optional[str] = None  # directory where autoconf feature test results are shared by all repositories
+    autotools_cache: Optional[str] = None  # directory where outputs of autoreconf/autogen.sh are shared by all repositories
+    autotools_cache_size: Optional[int] = None  # maximum total size of the autotools cache in bytes
+    job_budget: Optional[str] = None  # directory of tokens for extra `make` jobs, shared by all builds on the machine
+    job_budget_size: int = 0
+    max_make_jobs: int = 8
+    object_cache: Optional[str] = None  # directory where object files are cached by the mock compilers
+    bitcode_cache: Optional[str] = None  # directory where LLVM bitcode is shared by clang variants of the repository
+    adv_obfuscation: Switch = False  # rewrite C files with ADVobfuscator before compilation
+    adv_procs: int = 0  # number of processes rewriting files for ADV obfuscation
+    elf_types: Optional[str] = None  # comma-separated types of ELF files to collect, e.g. "executable,pie"; all if unset
+    stall_timeout: Optional[float] = None  # kill builds that make no progress for this many seconds
 
 
 args = Arguments()
 
 TIMEOUT_TOLERANCE = 5  # allow worker process to run for maximum 5 seconds beyond timeout
-REPO_PATH = "/usr/src/repo"
-BINARY_PATH = "/usr/src/bin"
+ADV_PRELUDE_PATH = "/Lib/ADVobfuscator.h"  # includes of the ADVobfuscator library, see `adv-obfuscation/headers.c`
+REPO_PATH = args.repo_path
+BINARY_PATH = args.binary_path
+RESULTS_PATH = os.path.join(BINARY_PATH, ghcc.compile.BATCH_RESULTS_FILE)
 
 
 def compile_makefiles():
@@ -55,65 +73,73 @@ def compile_makefiles():
         makefile_dirs = list(makefile_info.keys())
         kwargs = {"compile_fn": compile_fn, "hash_fn": hash_fn}
     else:
-        makefile_dirs = ghcc.find_makefiles(REPO_PATH)
+        if args.use_makefile_dirs_json:
+            with open(os.path.join(BINARY_PATH, "makefile_dirs.json")) as f:
+                makefile_dirs = [os.path.abspath(os.path.join(REPO_PATH, path)) for path in json.load(f)]
+        else:
+            makefile_dirs = ghcc.find_makefiles(REPO_PATH)
         kwargs = {"compile_fn": ghcc.unsafe_make}
 
+    configure_cache = None
+    if args.configure_cache is not None:
+        configure_cache = ghcc.ConfigureCache(args.configure_cache, REPO_PATH)
+    autoconf_cache = None
+    if args.autoconf_cache is not None:
+        autoconf_cache = ghcc.AutoconfCache(args.autoconf_cache)
+    autotools_cache = None
+    if args.autotools_cache is not None:
+        autotools_cache = ghcc.AutotoolsCache(args.autotools_cache, args.autotools_cache_size)
+    job_budget = None
+    if args.job_budget is not None:
+        job_budget = ghcc.utils.JobBudget(args.job_budget, args.job_budget_size, args.max_make_jobs)
+    elf_types = None
+    if args.elf_types is not None:
+        elf_types = [ghcc.ElfType(elf_type) for elf_type in args.elf_types.split(",") if elf_type]
+    adv_prelude = None
+    if args.adv_obfuscation:
+        with open(ADV_PRELUDE_PATH) as f:
+            adv_prelude = f.read()
+
     for makefile in ghcc.compile_and_move(
             BINARY_PATH, REPO_PATH, makefile_dirs, compiler=args.compiler,
             compile_timeout=args.compile_timeout, record_libraries=args.record_libraries,
-            gcc_override_flags=args.gcc_override_flags, **kwargs):
+            gcc_override_flags=args.gcc_override_flags, clean_repo=args.clean, configure_cache=configure_cache,
+            autoconf_cache=autoconf_cache, autotools_cache=autotools_cache, job_budget=job_budget,
+            object_cache_dir=args.object_cache, bitcode_cache_dir=args.bitcode_cache, adv_prelude=adv_prelude,
+            adv_procs=args.adv_procs, elf_types=elf_types, stall_timeout=args.stall_timeout, **kwargs):
         makefile['directory'] = os.path.relpath(makefile['directory'], REPO_PATH)
         yield makefile
 
 
-def worker(q: mp.Queue):
-    for makefile in compile_makefiles():
-        q.put(makefile)
-
-
-def read_queue(makefiles: List, q: 'mp.Queue'):
-    try:
-        while True:
-            makefiles.append(q.get_nowait())
-    except queue.Empty:
-        pass  # queue empty, wait until next round
-    except (OSError, ValueError):
-        pass  # data in queue could be corrupt, e.g. if worker process is terminated while enqueueing
+def worker():
+    # Write one JSON record per finished Makefile, and flush it immediately. Results of finished Makefiles are then
+    # available to the host even if the worker is killed, and no queue has to be drained before terminating it.
+    with open(RESULTS_PATH, "a") as f:
+        for makefile in compile_makefiles():
+            f.write(json.dumps(makefile) + "\n")
+            f.flush()
 
 
 def main():
     if args.single_process:
-        makefiles = list(compile_makefiles())
+        worker()
     else:
-        q = mp.Queue()
-        process = mp.Process(target=worker, args=(q,))
+        process = mp.Process(target=worker)
         process.start()
-        start_time = time.time()
-
-        makefiles: List = []
-        while process.is_alive():
-            time.sleep(2)  # no rush
-            cur_time = time.time()
-            # Get stuff out of the queue before possible termination -- otherwise it might deadlock.
-            # See https://docs.python.org/3/library/multiprocessing.html#multiprocessing-programming,
-            # the "Joining processes that use queues" section.
-            read_queue(makefiles, q)
-            # Note that it's still possible to have deadlocks if the child process pushed new elements into the queue
-            # after we read and before we terminate. A better solution would be to send a message to the child and ask
-            # it to quit, and only terminate when it doesn't respond. However, this current implementation is probably
-            # good enough for most cases.
-            if cur_time - start_time > args.compile_timeout + TIMEOUT_TOLERANCE:
-                process.terminate()
-                print(f"Timeout ({args.compile_timeout}s), killed", flush=True)
+        process.join(args.compile_timeout + TIMEOUT_TOLERANCE)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+            print(f"Timeout ({args.compile_timeout}s), killed", flush=True)
+            if args.clean:
                 ghcc.clean(REPO_PATH)  # clean up after the worker process
-                break
-        read_queue(makefiles, q)
 
     flutes.kill_proc_tree(os.getpid(), including_parent=False)  # make sure all subprocesses are dead
-    with open(os.path.join(BINARY_PATH, "log.pkl"), "wb") as f:
-        pickle.dump(makefiles, f)
     flutes.run_command(["chmod", "-R", "g+w", BINARY_PATH])
     flutes.run_command(["chmod", "-R", "g+w", REPO_PATH])
+    for cache_path in [args.configure_cache, args.bitcode_cache]:
+        if cache_path is not None and os.path.exists(cache_path):
+            flutes.run_command(["chmod", "-R", "g+w", cache_path])
 
 
 if __name__ == '__main__':
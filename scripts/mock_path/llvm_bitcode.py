@@ -0,0 +1,137 @@
+r"""Compilation through shared LLVM bitcode for the mock clang, so that LLVM obfuscation variants of a repository only
+run the clang frontend once per source file.
+
+Enabled by setting ``MOCK_GCC_BITCODE_CACHE`` to a directory shared by the variants. Each single-source compilation
+(``-c``) is split into three steps:
+
+1. The frontend emits unoptimized bitcode (``-emit-llvm -Xclang -disable-llvm-passes``). The bitcode is cached, keyed
+   like :mod:`object_cache`, but without the ``-mllvm`` options. Other variants reuse it instead of parsing the source.
+2. ``opt`` runs the optimization pipeline with the ``-mllvm`` options of the variant (e.g. ``-fla``), which enables the
+   Obfuscator-LLVM passes in the same way as in clang.
+3. clang generates the object file from the optimized bitcode, with all other flags of the invocation.
+
+Linking and archiving are run by ``make`` as usual. Invocations that cannot be split (e.g. without optimization, since
+``opt`` has no ``-O0`` pipeline) and any failure in the last two steps fall back to a normal compilation.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+import object_cache
+
+OPT_LEVELS = ("-O1", "-O2", "-O3", "-Os", "-Oz")
+# Flags that only affect preprocessing or dependency files, which are not needed to generate code from bitcode.
+PREPROCESSOR_FLAGS_WITH_VALUE = ("-D", "-U", "-I", "-include", "-isystem", "-iquote", "-idirafter", "-MF", "-MT", "-MQ")
+PREPROCESSOR_FLAGS = ("-MD", "-MMD", "-MP")
+# Language options, which are not allowed for LLVM IR inputs.
+LANGUAGE_FLAGS = ("-std=", "-ansi")
+
+
+def _split_args(args: List[str]) -> Optional[Dict[str, List[str]]]:
+    r"""Split the arguments into arguments for the frontend, options for ``opt``, and arguments for code generation."""
+    frontend_args: List[str] = [args[0]]
+    opt_options: List[str] = []
+    codegen_args: List[str] = [args[0]]
+    opt_level = None
+    idx = 1
+    while idx < len(args):
+        arg = args[idx]
+        if arg == "-mllvm" and idx + 1 < len(args):
+            opt_options.append(args[idx + 1])
+            idx += 2
+            continue
+        if arg.startswith("-O"):
+            opt_level = arg
+        if arg in PREPROCESSOR_FLAGS_WITH_VALUE or arg in ("-x", "-o"):
+            frontend_args.extend(args[idx:idx + 2])
+            idx += 2
+            continue
+        frontend_args.append(arg)
+        if not (arg in PREPROCESSOR_FLAGS or arg.startswith(PREPROCESSOR_FLAGS_WITH_VALUE + LANGUAGE_FLAGS) or
+                arg.endswith(object_cache.SOURCE_EXTENSIONS)):
+            codegen_args.append(arg)
+        idx += 1
+    if opt_level not in OPT_LEVELS:
+        return None
+    return {"frontend": frontend_args, "opt": [opt_level] + opt_options, "codegen": codegen_args}
+
+
+def _replace_output(args: List[str], output: str) -> List[str]:
+    index = len(args) - 1 - args[::-1].index("-o")
+    return args[:index + 1] + [output] + args[index + 2:]
+
+
+def _emit_bitcode(args: List[str], out_file: str, dep_file: Optional[str], bitcode_path: str,
+                  env: Dict[bytes, bytes]) -> bool:
+    frontend_args = _replace_output(args, bitcode_path) + ["-emit-llvm", "-Xclang", "-disable-llvm-passes"]
+    if dep_file is not None:
+        # Keep the names that dependency files would have when compiling directly to the object file.
+        if not any(arg.startswith(("-MT", "-MQ")) for arg in args):
+            frontend_args += ["-MT", out_file]
+        if not any(arg.startswith("-MF") for arg in args):
+            frontend_args += ["-MF", dep_file]
+    process = subprocess.run(frontend_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    if process.returncode != 0:
+        return False  # diagnostics are reported by the normal compilation
+    sys.stdout.buffer.write(process.stdout)
+    sys.stderr.buffer.write(process.stderr)
+    return True
+
+
+def run_compiler(args: List[str], env: Dict[bytes, bytes]) -> int:
+    r"""Run the real compiler with the given arguments, through shared bitcode if possible.
+
+    :param args: The complete command line for the real compiler.
+    :param env: Environment variables for the real compiler.
+    :return: The return code of the compiler.
+    """
+    cache_dir = os.environ.get("MOCK_GCC_BITCODE_CACHE", "").strip()
+    enabled = len(cache_dir) > 0 and os.environ.get("COMPILER") == "clang"
+    split_args = _split_args(args) if enabled else None
+    parsed = object_cache.parse_compile_args(split_args["frontend"]) if split_args is not None else None
+    if parsed is None:
+        return object_cache.run(args, env)
+    preprocess_args, out_file, dep_file = parsed
+    frontend_args = split_args["frontend"]
+    base_dir = object_cache.base_dir()
+
+    key = object_cache.compute_key(frontend_args, preprocess_args, env)
+    if key is None:
+        return object_cache.run(args, env)
+    entry_dir = os.path.join(cache_dir, key[:2])
+    bitcode_path = os.path.join(entry_dir, key + ".bc")
+    dep_path = os.path.join(entry_dir, key + ".d")
+    base_dir_bytes = base_dir.encode('utf-8')
+    compiler_dir = os.path.dirname(os.path.realpath(shutil.which(args[0], path=env[b"PATH"].decode('utf-8')) or
+                                                    args[0]))
+
+    temp_dir = tempfile.mkdtemp(prefix="mock-gcc-")
+    try:
+        if os.path.exists(bitcode_path) and (dep_file is None or os.path.exists(dep_path)):
+            if dep_file is not None:
+                object_cache.copy_replace(dep_path, dep_file, object_cache.BASE_DIR_PLACEHOLDER, base_dir_bytes)
+            sys.stderr.write(f"Mock GCC: Bitcode reused: {out_file}\n")
+        else:
+            temp_bitcode_path = os.path.join(temp_dir, "frontend.bc")
+            if not _emit_bitcode(frontend_args, out_file, dep_file, temp_bitcode_path, env):
+                return object_cache.run(args, env)
+            os.makedirs(entry_dir, exist_ok=True)
+            if dep_file is not None:
+                object_cache.store_file(dep_file, dep_path, base_dir_bytes, object_cache.BASE_DIR_PLACEHOLDER)
+            object_cache.store_file(temp_bitcode_path, bitcode_path)
+
+        optimized_path = os.path.join(temp_dir, "optimized.bc")
+        opt_args = [os.path.join(compiler_dir, "opt"), *split_args["opt"], bitcode_path, "-o", optimized_path]
+        codegen_args = split_args["codegen"] + [
+            "-Xclang", "-disable-llvm-passes", "-Wno-unused-command-line-argument", optimized_path, "-o", out_file]
+        for step_args in [opt_args, codegen_args]:
+            returncode = object_cache.run(step_args, env)
+            if returncode != 0:
+                sys.stderr.write("Mock GCC: Compilation through bitcode failed, compiling normally\n")
+                return object_cache.run(args, env)
+        return 0
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
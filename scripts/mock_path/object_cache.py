@@ -0,0 +1,206 @@
+r"""A content-addressed cache of object files for the mock compilers, similar to ``ccache``.
+
+Enabled by setting ``MOCK_GCC_OBJECT_CACHE`` to the cache directory. Only invocations that compile a single source file
+into an object file (``-c``) are cached. The key is a hash of:
+
+- The identity of the real compiler (path, size, and modification time of the executable).
+- The full list of arguments, including flags appended by the mock compiler.
+- The working directory, relative to ``MOCK_GCC_CACHE_BASEDIR`` (usually the repository root).
+- The preprocessed source.
+
+The base directory is removed from arguments, the working directory, and file names in linemarkers of the preprocessed
+source, so objects are shared by reruns, snapshots, and forks of a repository, and by vendored copies of libraries. This
+relies on the mock compiler remapping the base directory to ``.`` in debug info, which it does for all compilations,
+so cached objects are the same as compiled ones. The rest of the preprocessed source is hashed as is, so sources that embed absolute paths (e.g.
+through ``__FILE__``) are not shared.
+
+Cache entries are read-only, and directories are only writable by the group of the host user, which all containers run
+in.
+
+Dependency files generated with ``-MD``/``-MMD`` are cached along with the objects. A line with ``hit`` or ``miss``
+is appended to ``MOCK_GCC_CACHE_STATS`` (if set) for each cacheable invocation.
+"""
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
+
+SOURCE_EXTENSIONS = (".c", ".cc", ".cp", ".cpp", ".cxx", ".c++", ".C", ".i", ".ii")
+# Flags that write other outputs (profiling notes, temporary files), which are not cached.
+UNCACHEABLE_FLAGS = ("-save-temps", "--coverage", "-ftest-coverage", "-fprofile-arcs", "-fprofile-generate", "-M",
+                     "-MM", "-E", "-S")
+DEPENDENCY_FLAGS = ("-MD", "-MMD", "-MP")
+DEPENDENCY_FLAGS_WITH_VALUE = ("-MF", "-MT", "-MQ")
+BASE_DIR_PLACEHOLDER = b"@MOCK_GCC_CACHE_BASEDIR@"
+
+
+def run(args: List[str], env: Dict[bytes, bytes]) -> int:
+    # Redirecting to a pipe could prevent GCC producing colored output.
+    process = subprocess.Popen(args, stdout=sys.stdout, stderr=sys.stderr, env=env)
+    process.wait()
+    return process.returncode
+
+
+def parse_compile_args(args: List[str]) -> Optional[Tuple[List[str], str, Optional[str]]]:
+    r"""Return the arguments for preprocessing, the output file, and the dependency file, or ``None`` if the invocation
+    is not cacheable."""
+    # The working directory is part of the key, relative to the base directory. Omit it from the preprocessed output.
+    preprocess_args = [args[0], "-E", "-fno-working-directory"]
+    sources = []
+    out_file = None
+    dep_file = None
+    writes_deps = False
+    idx = 1
+    while idx < len(args):
+        arg = args[idx]
+        if arg in UNCACHEABLE_FLAGS or arg == "-":
+            return None
+        if arg == "-o":
+            out_file = args[idx + 1]
+            idx += 2
+            continue
+        if arg in DEPENDENCY_FLAGS:
+            writes_deps = writes_deps or arg != "-MP"
+        elif arg in DEPENDENCY_FLAGS_WITH_VALUE:
+            if arg == "-MF":
+                dep_file = args[idx + 1]
+            idx += 2
+            continue
+        elif arg.startswith(DEPENDENCY_FLAGS_WITH_VALUE):
+            if arg.startswith("-MF"):
+                dep_file = arg[len("-MF"):]
+        elif arg == "-c" or arg.startswith("-l"):
+            pass
+        else:
+            if not arg.startswith("-") and arg.endswith(SOURCE_EXTENSIONS):
+                sources.append(arg)
+            preprocess_args.append(arg)
+        idx += 1
+    if "-c" not in args or len(sources) != 1 or out_file is None or not out_file.endswith(".o"):
+        return None
+    if writes_deps and dep_file is None:
+        dep_file = os.path.splitext(out_file)[0] + ".d"
+    return preprocess_args, out_file, (dep_file if writes_deps else None)
+
+
+def compiler_identity(compiler: str, env: Dict[bytes, bytes]) -> bytes:
+    path = shutil.which(compiler, path=env[b"PATH"].decode('utf-8')) or compiler
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8')
+
+
+def copy_replace(src: str, dest: str, old: bytes, new: bytes) -> None:
+    r"""Copy the file, replacing all occurrences of ``old`` with ``new`` in its contents."""
+    with open(src, "rb") as f:
+        contents = f.read()
+    with open(dest, "wb") as f:
+        f.write(contents.replace(old, new) if len(old) > 0 else contents)
+
+
+def store_file(src: str, dest: str, old: bytes = b"", new: bytes = b"") -> None:
+    r"""Copy the file into the cache, optionally replacing ``old`` with ``new`` in its contents."""
+    # Write to a temporary file first, so concurrent readers never see a partial file.
+    temp_path = f"{dest}.{os.getpid()}.tmp"
+    if len(old) > 0:
+        copy_replace(src, temp_path, old, new)
+    else:
+        shutil.copyfile(src, temp_path)
+    os.chmod(temp_path, 0o444)
+    os.replace(temp_path, dest)
+
+
+def _record(stat: str) -> None:
+    stats_path = os.environ.get("MOCK_GCC_CACHE_STATS", "").strip()
+    if len(stats_path) > 0:
+        # Small appends are atomic, so parallel builds can share the file.
+        with open(stats_path, "a") as f:
+            f.write(stat + "\n")
+
+
+def base_dir() -> str:
+    r"""Return the absolute path of ``MOCK_GCC_CACHE_BASEDIR``, or an empty string if it is not set."""
+    path = os.environ.get("MOCK_GCC_CACHE_BASEDIR", "").strip()
+    return os.path.abspath(path) if len(path) > 0 else ""
+
+
+def compute_key(args: List[str], preprocess_args: List[str], env: Dict[bytes, bytes]) -> Optional[str]:
+    r"""Compute the cache key of a compilation, or return ``None`` if the source cannot be preprocessed.
+
+    :param args: The complete command line for the real compiler.
+    :param preprocess_args: The command line to preprocess the source, as returned by :meth:`parse_compile_args`.
+    :param env: Environment variables for the real compiler.
+    """
+    base_dir_bytes = base_dir().encode('utf-8')
+
+    def normalize(value: bytes) -> bytes:
+        return value.replace(base_dir_bytes, b"") if len(base_dir_bytes) > 0 else value
+
+    try:
+        preprocessed = subprocess.run(preprocess_args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                      env=env).stdout
+        if len(base_dir_bytes) > 0:
+            # Linemarkers (`# 1 "/path/to/repo/src/main.c"`) only end up in debug info, where the base directory is
+            # remapped. Other occurrences are kept, since they may be compiled into the object as strings.
+            preprocessed = re.sub(rb'^(# \d+ ")' + re.escape(base_dir_bytes), rb"\1", preprocessed, flags=re.MULTILINE)
+        hash_obj = hashlib.sha256()
+        hash_obj.update(compiler_identity(args[0], env) + b"\0")
+        hash_obj.update(normalize("\0".join(args).encode('utf-8')) + b"\0")
+        hash_obj.update(normalize(os.getcwd().encode('utf-8')) + b"\0")
+        hash_obj.update(preprocessed)
+    except Exception:
+        return None  # preprocessing errors are reported by the actual compilation
+    return hash_obj.hexdigest()
+
+
+def run_compiler(args: List[str], env: Dict[bytes, bytes],
+                 compile_fn: Callable[[List[str], Dict[bytes, bytes]], int] = run) -> int:
+    r"""Run the real compiler with the given arguments, or restore its outputs from the cache.
+
+    :param args: The complete command line for the real compiler.
+    :param env: Environment variables for the real compiler.
+    :param compile_fn: The method to call for compilation on a cache miss, and for invocations that are not cached.
+    :return: The return code of the compiler.
+    """
+    cache_dir = os.environ.get("MOCK_GCC_OBJECT_CACHE", "").strip()
+    parsed = parse_compile_args(args) if len(cache_dir) > 0 else None
+    if parsed is None:
+        return compile_fn(args, env)
+    preprocess_args, out_file, dep_file = parsed
+
+    base_dir_bytes = base_dir().encode('utf-8')
+    key = compute_key(args, preprocess_args, env)
+    if key is None:
+        return compile_fn(args, env)
+    entry_dir = os.path.join(cache_dir, key[:2])
+    object_path = os.path.join(entry_dir, key + ".o")
+    dep_path = os.path.join(entry_dir, key + ".d")
+
+    if os.path.exists(object_path) and (dep_file is None or os.path.exists(dep_path)):
+        try:
+            shutil.copyfile(object_path, out_file)
+            if dep_file is not None:
+                # Dependency files may contain absolute paths, e.g. in CMake builds.
+                copy_replace(dep_path, dep_file, BASE_DIR_PLACEHOLDER, base_dir_bytes)
+            _record("hit")
+            sys.stderr.write(f"Mock GCC: Object cache hit: {out_file}\n")
+            return 0
+        except OSError:
+            pass  # possibly evicted concurrently, compile instead
+
+    returncode = compile_fn(args, env)
+    _record("miss")
+    if returncode == 0 and os.path.exists(out_file):
+        try:
+            if not os.path.exists(entry_dir):
+                os.makedirs(entry_dir, exist_ok=True)
+                os.chmod(entry_dir, 0o2770)  # shared by containers running as different users in the same group
+            if dep_file is not None:
+                store_file(dep_file, dep_path, base_dir_bytes, BASE_DIR_PLACEHOLDER)
+            store_file(out_file, object_path)  # the object is stored last, since its existence marks a valid entry
+        except OSError as e:
+            sys.stderr.write(f"Mock GCC: Failed to store object in cache: {e}\n")
+    return returncode
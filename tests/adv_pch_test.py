@@ -0,0 +1,30 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+MOCK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "mock_path")
+ADV_HEADER = "/Lib/ADVobfuscator.h"  # precompiled in the `gcc-custom` image
+
+
+@unittest.skipIf(not os.path.isdir(ADV_HEADER + ".gch"), "Precompiled ADVobfuscator headers are not installed")
+class ADVPrecompiledHeaderTest(unittest.TestCase):
+    def test_precompiled_header_used(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            with open(ADV_HEADER) as f:
+                prelude = f.read()
+            with open(os.path.join(tempdir, "main.c"), "w") as f:
+                f.write(prelude + 'int main() { return OBFUSCATED("hello")[0] == 0; }\n')
+            env = {"PATH": MOCK_PATH + ":" + os.environ["PATH"], "COMPILER": "g++", "MOCK_GCC_OVERRIDE_FLAGS": "-O1",
+                   "MOCK_GCC_ADV_PCH": "1"}
+            for flags in [[], ["-fPIC"]]:
+                # `-H` prints included headers, with a "!" mark for valid precompiled headers.
+                process = subprocess.run(["gcc", "-c", "main.c", "-o", "main.o", "-H", *flags], cwd=tempdir, env=env,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+                self.assertIn(f"! {ADV_HEADER}.gch/", process.stderr.decode('utf-8'))
+
+            # The header is not injected for other builds with g++.
+            del env["MOCK_GCC_ADV_PCH"]
+            process = subprocess.run(["gcc", "-c", "main.c", "-o", "main.o", "-H"], cwd=tempdir, env=env,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+            self.assertNotIn(f"{ADV_HEADER}.gch/", process.stderr.decode('utf-8'))
@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import ghcc
+
+PRELUDE = '#include "/Lib/Log.h"\n'
+MOCK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "mock_path")
+
+
+class ADVObfuscationTest(unittest.TestCase):
+    def assertRewrite(self, code: str, expected: str) -> None:
+        rewritten, _, _ = ghcc.obfuscate_source(code, PRELUDE)
+        self.assertEqual(PRELUDE + expected, rewritten)
+
+    def test_literals(self) -> None:
+        self.assertRewrite('int main() { printf("%s\\n", "a\\"b"); }\n',
+                           'int main() { printf(OBFUSCATED("%s\\n"), OBFUSCATED("a\\"b")); }\n')
+        self.assertRewrite('printf("%" PRIu64 "\\n", x);', 'printf(OBFUSCATED("%" PRIu64 "\\n"), x);')
+        self.assertRewrite('puts("multi \\\nline");', 'puts(OBFUSCATED("multi \\\nline"));')
+        self.assertRewrite("char c = '\"'; puts(\"x\");", "char c = '\"'; puts(OBFUSCATED(\"x\"));")
+
+    def test_kept_literals(self) -> None:
+        code = ('#include "foo.h"\n'
+                '#define MSG "hello" \\\n'
+                '    "world"\n'
+                '/* "comment" */ // "comment"\n'
+                'extern "C" {\n'
+                'static char buf[] = "array";\n'
+                'char grid[][4] = {"ab", "cd"};\n'
+                'void f() { asm volatile("nop"); }\n'
+                '_Static_assert(1, "message");\n'
+                'wchar_t *w = L"wide";\n'
+                '}\n')
+        self.assertRewrite(code, code)
+        self.assertRewrite('const char *names[] = {"a", "b"};',
+                           'const char *names[] = {OBFUSCATED("a"), OBFUSCATED("b")};')
+
+    def test_unterminated_quotes(self) -> None:
+        # Apostrophes in directives don't start character literals that continue on the next line.
+        self.assertRewrite("#warning don't\nint main() { puts(\"x\"); }\n",
+                           "#warning don't\nint main() { puts(OBFUSCATED(\"x\")); }\n")
+        code = "#if 0 it's\n#include \"foo.h\"\n#endif\n"
+        self.assertRewrite(code, code)
+
+    def test_idempotent(self) -> None:
+        rewritten, num_literals, header = ghcc.obfuscate_source('int main() { puts("x"); }\n', PRELUDE)
+        self.assertEqual((1, True), (num_literals, header))
+        self.assertEqual((rewritten, 0, False), ghcc.obfuscate_source(rewritten, PRELUDE))
+
+    def test_obfuscate_repo(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.makedirs(os.path.join(tempdir, "src"))
+            os.makedirs(os.path.join(tempdir, ".git"))
+            files = {"main.c": 'int main() { puts("a"); puts("b"); }\n',
+                     "src/util.c": "int util() { return 0; }\n",
+                     "src/util.h": 'static const char *name = "x";\n',
+                     ".git/hooks.c": 'const char *x = "y";\n'}
+            for path, code in files.items():
+                with open(os.path.join(tempdir, path), "w") as f:
+                    f.write(code)
+            manifest_path = os.path.join(tempdir, "manifest.json")
+            for n_procs in [0, 2]:
+                manifest = ghcc.obfuscate_repo(tempdir, PRELUDE, n_procs=n_procs, manifest_path=manifest_path)
+                with open(manifest_path) as f:
+                    self.assertEqual(manifest, json.load(f))
+                if n_procs == 0:
+                    self.assertEqual([{"file": "main.c", "literals": 2, "header": True},
+                                      {"file": "src/util.c", "literals": 0, "header": True}], manifest)
+                else:  # already rewritten
+                    self.assertEqual([{"file": "main.c", "literals": 0, "header": False},
+                                      {"file": "src/util.c", "literals": 0, "header": False}], manifest)
+            for path, code in files.items():
+                with open(os.path.join(tempdir, path)) as f:
+                    rewritten = f.read()
+                if path.endswith(".c") and not path.startswith(".git"):
+                    self.assertTrue(rewritten.startswith(PRELUDE))
+                else:
+                    self.assertEqual(code, rewritten)
+
+    def test_compile_and_move(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            repo_path = os.path.join(tempdir, "repo")
+            for directory in ["a", "b"]:
+                os.makedirs(os.path.join(repo_path, directory))
+                with open(os.path.join(repo_path, directory, "main.c"), "w") as f:
+                    f.write('int main() { puts("x"); }\n')
+            subprocess.run(["git", "init", "-q"], cwd=repo_path, check=True)
+            subprocess.run(["git", "add", "."], cwd=repo_path, check=True)
+            subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test", "commit", "-q", "-m", "init"],
+                           cwd=repo_path, check=True)
+            binary_dir = os.path.join(tempdir, "binaries")
+            os.makedirs(binary_dir)
+
+            sources = []
+
+            def compile_fn(directory: str, clean_repo: bool, **kwargs) -> ghcc.CompileResult:
+                self.assertFalse(clean_repo)  # cleaned before the rewrite
+                with open(os.path.join(directory, "main.c")) as f:
+                    sources.append(f.read())
+                return ghcc.CompileResult(success=True, elf_files=[])
+
+            makefile_dirs = [os.path.join(repo_path, directory) for directory in ["a", "b"]]
+            with mock.patch("ghcc.compile.obfuscate_repo", wraps=ghcc.obfuscate_repo) as obfuscate_repo:
+                list(ghcc.compile_and_move(binary_dir, repo_path, makefile_dirs, "g++", compile_fn=compile_fn,
+                                           adv_prelude=PRELUDE))
+            self.assertEqual(1, obfuscate_repo.call_count)  # rewritten once for all Makefiles
+            self.assertEqual([PRELUDE + 'int main() { puts(OBFUSCATED("x")); }\n'] * 2, sources)
+            with open(os.path.join(binary_dir, "adv_manifest.json")) as f:
+                self.assertEqual(2, len(json.load(f)))
+            with open(os.path.join(repo_path, "a", "main.c")) as f:
+                self.assertEqual('int main() { puts("x"); }\n', f.read())  # repository is reset afterwards
+
+
+@unittest.skipIf(shutil.which("gcc") is None, "GCC is not installed")
+class CompiledSourceLogTest(unittest.TestCase):
+    def test_source_log(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.makedirs(os.path.join(tempdir, "src"))
+            with open(os.path.join(tempdir, "src", "main.c"), "w") as f:
+                f.write("int main() { return 0; }\n")
+            with open(os.path.join(tempdir, "src", "broken.c"), "w") as f:
+                f.write("int main() { return }\n")
+            log_path = os.path.join(tempdir, "sources.txt")
+            env = {"PATH": MOCK_PATH + ":" + os.environ["PATH"], "COMPILER": "gcc",
+                   "MOCK_GCC_SOURCE_LOG": log_path, "MOCK_GCC_SOURCE_BASEDIR": tempdir}
+            for name in ["main.c", "broken.c"]:
+                subprocess.run(["gcc", "-c", name], cwd=os.path.join(tempdir, "src"), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            with open(log_path) as f:
+                self.assertEqual("src/main.c\n", f.read())  # failed compilations are not recorded
@@ -0,0 +1,89 @@
+import os
+import subprocess
+import tempfile
+import unittest
+from typing import Dict, Optional
+
+import ghcc
+
+# Mimics how autoconf-generated configure scripts use the site file and the cache file.
+CONFIGURE_SCRIPT = r"""
+cache_file=/dev/null
+. "$CONFIG_SITE"
+if test -f "$cache_file"; then . "$cache_file"; fi
+: ${ac_cv_header_stdlib_h=yes}
+echo "ac_cv_header_stdlib_h=\${ac_cv_header_stdlib_h=$ac_cv_header_stdlib_h}" > "$cache_file"
+echo "ac_cv_env_CC_value=gcc" >> "$cache_file"
+echo "ac_cv_path_install='$PWD/install-sh -c'" >> "$cache_file"
+echo "ac_cv_lib_foo_bar=\${ac_cv_lib_foo_bar=yes}" >> "$cache_file"
+echo 'ac_cv_func_foo=${ac_cv_func_foo=`touch pwned`}' >> "$cache_file"
+echo "$ac_cv_header_stdlib_h" > result.txt
+printf "CFLAGS='-g -O2'\nCPPFLAGS='%s'\nLDFLAGS='%s'\nLIBS='%s'\n" "$CPPFLAGS$EXTRA_CPPFLAGS" "$LDFLAGS" "$LIBS" \
+    > config.log
+"""
+
+
+class AutoconfCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = ghcc.AutoconfCache(os.path.join(self.tempdir.name, "cache"))
+        self.directory = os.path.join(self.tempdir.name, "repo")
+        os.makedirs(self.directory)
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _configure(self, compiler: str, env: Optional[Dict[str, str]] = None) -> str:
+        env = env or {}
+        with self.cache.configure_env(compiler, self.directory, env) as site_env:
+            subprocess.run(["sh", "-c", CONFIGURE_SCRIPT], cwd=self.directory,
+                           env={"PATH": os.environ["PATH"], **env, **site_env}, check=True)
+        with open(os.path.join(self.directory, "result.txt")) as f:
+            return f.read().strip()
+
+    def test_shared_results(self) -> None:
+        self.assertEqual("yes", self._configure("gcc"))
+        with open(self.cache.cache_path("gcc")) as f:
+            lines = f.read().splitlines()
+        # Precious variables, paths of the configured directory, project-specific checks, and values that are not
+        # literals are not shared.
+        self.assertEqual(["ac_cv_header_stdlib_h=${ac_cv_header_stdlib_h=yes}"], lines)
+        self.assertEqual(0o660, os.stat(self.cache.cache_path("gcc")).st_mode & 0o777)
+
+        # Results are loaded by later runs.
+        with open(self.cache.cache_path("gcc"), "w") as f:
+            f.write("ac_cv_header_stdlib_h=${ac_cv_header_stdlib_h=cached}\n")
+        self.assertEqual("cached", self._configure("gcc"))
+        # Each compiler has its own cache.
+        self.assertEqual("yes", self._configure("clang"))
+
+    def test_compiler_flags(self) -> None:
+        self.assertEqual("yes", self._configure("gcc"))
+        with open(self.cache.cache_path("gcc"), "w") as f:
+            f.write("ac_cv_header_stdlib_h=${ac_cv_header_stdlib_h=cached}\n")
+        # Runs with different flags use different caches.
+        env = {"CFLAGS": "-m32"}
+        self.assertEqual("yes", self._configure("gcc", env))
+        self.assertTrue(os.path.exists(self.cache.cache_path("gcc", env)))
+        self.assertEqual("cached", self._configure("gcc", {"CFLAGS": ""}))
+
+    def test_flags_added_by_configure(self) -> None:
+        # Results of a configure script that adds include directories of the project are not shared.
+        self.assertEqual("yes", self._configure("gcc", {"EXTRA_CPPFLAGS": "-Iinclude"}))
+        self.assertFalse(os.path.exists(self.cache.cache_path("gcc")))
+
+    def test_tampered_cache(self) -> None:
+        with open(self.cache.cache_path("gcc"), "w") as f:
+            f.write("ac_cv_header_stdlib_h=${ac_cv_header_stdlib_h=`echo pwned`}\n")
+        # Entries that are not literal assignments are dropped when loading the shared cache.
+        self.assertEqual("yes", self._configure("gcc"))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "pwned")))
+        # ... and replaced in the shared cache by the next merge.
+        with open(self.cache.cache_path("gcc")) as f:
+            self.assertEqual(["ac_cv_header_stdlib_h=${ac_cv_header_stdlib_h=yes}"], f.read().splitlines())
+
+    def test_failed_configure(self) -> None:
+        with self.assertRaises(subprocess.CalledProcessError):
+            with self.cache.configure_env("gcc", self.directory):
+                raise subprocess.CalledProcessError(1, ["./configure"])
+        self.assertFalse(os.path.exists(self.cache.cache_path("gcc")))
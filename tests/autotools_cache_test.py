@@ -0,0 +1,121 @@
+import hashlib
+import io
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+
+import ghcc
+
+
+class AutotoolsCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = ghcc.AutotoolsCache(os.path.join(self.tempdir.name, "cache"))
+        self.repos = [os.path.join(self.tempdir.name, name) for name in ["repo", "fork"]]
+        for repo in self.repos:
+            os.makedirs(os.path.join(repo, "m4"))
+            self._write(repo, "configure.ac", "AC_INIT([test], [1.0])\n")
+            self._write(repo, "Makefile.am", "bin_PROGRAMS = test\n")
+            self._write(repo, "m4/macros.m4", "dnl macros\n")
+            self._write(repo, "main.c", "int main() { return 0; }\n")
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _write(self, directory: str, file: str, contents: str) -> None:
+        with open(os.path.join(directory, file), "w") as f:
+            f.write(contents)
+
+    def _generate(self, directory: str) -> None:
+        self._write(directory, "configure", "#!/bin/sh\n")
+        self._write(directory, "Makefile.in", "all:\n")
+
+    def test_key(self) -> None:
+        key = self.cache.key(self.repos[0])
+        self.assertEqual(key, self.cache.key(self.repos[1]))
+        # Files other than autotools inputs don't affect the key.
+        self._write(self.repos[1], "main.c", "int main() { return 1; }\n")
+        self.assertEqual(key, self.cache.key(self.repos[1]))
+        self._write(self.repos[1], "m4/macros.m4", "dnl other macros\n")
+        self.assertNotEqual(key, self.cache.key(self.repos[1]))
+
+    def test_save_and_restore(self) -> None:
+        repo, fork = self.repos
+        key = self.cache.key(repo)
+        self.assertFalse(self.cache.restore(repo, key))
+        snapshot = self.cache.snapshot(repo)
+        self._generate(repo)
+        self.assertTrue(self.cache.save(repo, key, snapshot))
+
+        self.assertTrue(self.cache.restore(fork, key))
+        with open(os.path.join(fork, "Makefile.in")) as f:
+            self.assertEqual("all:\n", f.read())
+        # Restored outputs must be newer than the inputs.
+        self.assertGreaterEqual(os.path.getmtime(os.path.join(fork, "Makefile.in")),
+                                os.path.getmtime(os.path.join(fork, "Makefile.am")))
+
+    def test_symlinks_saved_as_files(self) -> None:
+        repo, fork = self.repos
+        key = self.cache.key(repo)
+        snapshot = self.cache.snapshot(repo)
+        self._generate(repo)
+        self._write(self.tempdir.name, "install-sh", "#!/bin/sh\n")
+        os.symlink(os.path.join(self.tempdir.name, "install-sh"), os.path.join(repo, "install-sh"))
+        self.assertTrue(self.cache.save(repo, key, snapshot))
+
+        self.assertTrue(self.cache.restore(fork, key))
+        self.assertFalse(os.path.islink(os.path.join(fork, "install-sh")))
+        with open(os.path.join(fork, "install-sh")) as f:
+            self.assertEqual("#!/bin/sh\n", f.read())
+
+    def test_modified_archive(self) -> None:
+        repo, fork = self.repos
+        key = self.cache.key(repo)
+        snapshot = self.cache.snapshot(repo)
+        self._generate(repo)
+        self.assertTrue(self.cache.save(repo, key, snapshot))
+        archive_path = os.path.join(self.cache.path, key + ".tar")
+        for name in os.listdir(self.cache.path):
+            self.assertEqual(0o660, os.stat(os.path.join(self.cache.path, name)).st_mode & 0o777)
+
+        # Archives replaced after they are saved are not restored.
+        with tarfile.open(archive_path, "w") as tar:
+            info = tarfile.TarInfo("configure")
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b"evil"))
+        self.assertFalse(self.cache.restore(fork, key))
+        self.assertFalse(os.path.exists(os.path.join(fork, "configure")))
+
+    def test_unsafe_archive(self) -> None:
+        repo = self.repos[0]
+        for name in ["../outside", os.path.join(self.tempdir.name, "outside")]:
+            with tarfile.open(os.path.join(self.cache.path, "unsafe.tar"), "w") as tar:
+                info = tarfile.TarInfo(name)
+                info.size = 4
+                tar.addfile(info, io.BytesIO(b"evil"))
+            with open(os.path.join(self.cache.path, "unsafe.tar"), "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            with open(os.path.join(self.cache.path, "unsafe.sha256"), "w") as f:
+                f.write(digest + "\n")
+            self.assertFalse(self.cache.restore(repo, "unsafe"))
+            self.assertFalse(os.path.exists(os.path.join(self.tempdir.name, "outside")))
+
+    def test_configured_outputs_not_saved(self) -> None:
+        repo = self.repos[0]
+        snapshot = self.cache.snapshot(repo)
+        self._generate(repo)
+        self._write(repo, "config.status", "#!/bin/sh\n")
+        self.assertFalse(self.cache.save(repo, self.cache.key(repo), snapshot))
+
+    def test_eviction(self) -> None:
+        repo = self.repos[0]
+        cache = ghcc.AutotoolsCache(self.cache.path, max_size=15 * 1024)  # each archive takes at least 10KB
+        for key in ["old", "new"]:
+            snapshot = cache.snapshot(repo)
+            self._generate(repo)
+            cache.save(repo, key, snapshot)
+            time.sleep(0.01)
+        self.assertFalse(cache.restore(repo, "old"))
+        self.assertTrue(cache.restore(repo, "new"))
@@ -1,8 +1,14 @@
+import errno
+import hashlib
+import json
 import os
+import shutil
 import subprocess
 import tempfile
+import time
 import unittest
 from typing import List
+from unittest import mock
 
 import flutes
 
@@ -99,3 +105,156 @@ class CompileTest(unittest.TestCase):
         with open(library_log_path) as f:
             recorded_libraries = f.read().split()
             assert set(libraries) == set(recorded_libraries)
+
+
+class RepoScanTest(unittest.TestCase):
+    def test_scan_repo(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            files = ["Makefile", "a/b/makefile", "a/b/configure.ac", "c/GNUmakefile", "c/main.c", "c/util.cpp",
+                     "d/Makefile", "d/configure", "d/e/main.c", ".git/hooks/Makefile", ".gitmodules"]
+            for file in files:
+                os.makedirs(os.path.join(tempdir, os.path.dirname(file)), exist_ok=True)
+                with open(os.path.join(tempdir, file), "w") as f:
+                    f.write(file)
+            os.symlink(os.path.join(tempdir, "d"), os.path.join(tempdir, "a", "link"))
+
+            scan = ghcc.scan_repo(tempdir)
+            expected_dirs = [subdir for subdir, dirs, _ in os.walk(tempdir)
+                             if ghcc.contains_files(subdir, ["makefile"]) and ".git" not in subdir.split(os.sep)]
+            self.assertEqual(expected_dirs, scan.makefile_dirs)
+            self.assertEqual([os.path.join(tempdir, "a", "b")], scan.automake_dirs)
+            self.assertEqual([os.path.join(tempdir, "d")], scan.configure_dirs)
+            self.assertTrue(scan.has_gitmodules)
+            self.assertEqual((2, 1), (scan.num_c_files, scan.num_cpp_files))
+            self.assertEqual(flutes.get_folder_size(tempdir), scan.size)
+
+
+class HashAndMoveTest(unittest.TestCase):
+    def _compile_and_move(self, tempdir: str) -> None:
+        repo_path = os.path.join(tempdir, "repo")
+        binary_dir = os.path.join(tempdir, "binaries")
+        os.makedirs(os.path.join(repo_path, "obj"))
+        os.makedirs(binary_dir)
+        contents = {"a": b"a" * (3 * ghcc.compile.HASH_CHUNK_SIZE + 1), "obj/b": b"b", "obj/c": b"b", "d": b""}
+        for path, content in contents.items():
+            with open(os.path.join(repo_path, path), "wb") as f:
+                f.write(content)
+
+        def compile_fn(directory: str, **kwargs) -> ghcc.CompileResult:
+            return ghcc.CompileResult(success=True, elf_files=list(contents.keys()))
+
+        makefiles = list(ghcc.compile_and_move(binary_dir, repo_path, [repo_path], "gcc", compile_fn=compile_fn,
+                                               clean_repo=False))
+        self.assertEqual(1, len(makefiles))
+        hashes = [hashlib.sha256(content).hexdigest() for content in contents.values()]
+        self.assertEqual(hashes, makefiles[0]["sha256"])
+        self.assertEqual(sum(len(content) for content in contents.values()), makefiles[0]["bytes_moved"])
+        self.assertEqual(sorted(set(hashes)), sorted(os.listdir(binary_dir)))  # no temporary files are left
+        for signature, content in zip(hashes, contents.values()):
+            with open(os.path.join(binary_dir, signature), "rb") as f:
+                self.assertEqual(content, f.read())
+        for path in contents:
+            self.assertFalse(os.path.exists(os.path.join(repo_path, path)))
+
+    def test_rename(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            self._compile_and_move(tempdir)
+
+    def test_cross_device(self) -> None:
+        def rename(src: str, dst: str) -> None:
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+        with tempfile.TemporaryDirectory() as tempdir, mock.patch("os.rename", rename):
+            self._compile_and_move(tempdir)
+
+
+class SnapshotDiffTest(unittest.TestCase):
+    def test_find_products(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            for path in ["Makefile", "src/main.c", "src/old.o", ".git/HEAD"]:
+                os.makedirs(os.path.join(tempdir, os.path.dirname(path)), exist_ok=True)
+                with open(os.path.join(tempdir, path), "w") as f:
+                    f.write(path)
+
+            def make_fn(directory: str, **kwargs) -> None:
+                os.makedirs(os.path.join(directory, "build", "dir with spaces"))
+                for path in ["build/dir with spaces/prögram", "src/old.o", "src/main.o", ".git/index"]:
+                    with open(os.path.join(directory, path), "w") as f:
+                        f.write("changed " + path)
+                os.symlink("main.o", os.path.join(directory, "src", "link.o"))
+
+            result = ghcc.compile._make_skeleton(tempdir, clean_repo=False, make_fn=make_fn,
+                                                 check_file_fn=lambda directory, file: file != "Makefile")
+            self.assertTrue(result.success)
+            self.assertEqual(["build/dir with spaces/prögram", "src/main.o", "src/old.o"], result.elf_files)
+
+
+class TimeBudgetTest(unittest.TestCase):
+    def test_fair_budget(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            repo_path = os.path.join(tempdir, "repo")
+            binary_dir = os.path.join(tempdir, "binaries")
+            os.makedirs(binary_dir)
+            files = ["Makefile", "main.c"] + [f"{directory}/{name}" for directory in ["a", "b"]
+                                              for name in ["Makefile"] + [f"{idx}.c" for idx in range(10)]]
+            for path in files:
+                os.makedirs(os.path.join(repo_path, os.path.dirname(path)), exist_ok=True)
+                with open(os.path.join(repo_path, path), "w") as f:
+                    f.write(path)
+            makefile_dirs = sorted(ghcc.find_makefiles(repo_path))
+
+            now = [0.0]
+            timeouts = {}
+
+            def compile_fn(directory: str, timeout: float, **kwargs) -> ghcc.CompileResult:
+                name = os.path.relpath(directory, repo_path)
+                timeouts[name] = timeout
+                now[0] += timeout if name == "." else 10.0  # the top-level build hangs until its timeout
+                return ghcc.CompileResult(success=(name != "."), elf_files=[])
+
+            with mock.patch("time.time", lambda: now[0]):
+                makefiles = list(ghcc.compile_and_move(binary_dir, repo_path, makefile_dirs, "gcc",
+                                                       compile_timeout=900, compile_fn=compile_fn, clean_repo=False))
+            self.assertEqual(["a", "b"], [os.path.relpath(makefile["directory"], repo_path) for makefile in makefiles])
+            # Costs are 22, 11, and 11. Time left unused by "a" goes to "b".
+            self.assertEqual({".": 450.0, "a": 225.0, "b": 440.0}, timeouts)
+
+
+@unittest.skipIf(shutil.which("make") is None, "Make is not installed")
+class StallTest(unittest.TestCase):
+    def test_stalled_build(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            with open(os.path.join(tempdir, "Makefile"), "w") as f:
+                f.write("all:\n\ttouch partial\n\tread line; sleep 30\n")
+            start_time = time.time()
+            result = ghcc.unsafe_make(tempdir, timeout=60, clean_repo=False, stall_timeout=1)
+            self.assertLess(time.time() - start_time, 30)
+            self.assertEqual(ghcc.CompileErrorType.Stalled, result.error_type)
+            self.assertIn("sleep", result.stall_reason)
+
+
+class BatchResultsTest(unittest.TestCase):
+    def test_read_results(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, ghcc.compile.BATCH_RESULTS_FILE)
+            self.assertEqual([], ghcc.compile._read_batch_results(path))
+            makefiles = [{"directory": "a", "success": True, "binaries": ["prögram"], "sha256": ["0" * 64]},
+                         {"directory": ".", "success": False, "binaries": [], "sha256": []}]
+            with open(path, "w") as f:
+                for makefile in makefiles:
+                    f.write(json.dumps(makefile) + "\n")
+                f.write('{"directory": "b", "succ')  # killed while writing
+            self.assertEqual(makefiles, ghcc.compile._read_batch_results(path))
+
+    def test_cleanup_on_error(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            def fail(*args, **kwargs):
+                with open(os.path.join(tempdir, ghcc.compile.BATCH_RESULTS_FILE), "w") as f:
+                    f.write(json.dumps({"directory": ".", "success": True, "binaries": [], "sha256": []}) + "\n")
+                raise subprocess.CalledProcessError(1, ["batch_make.py"], output=b"Docker failed")
+
+            with mock.patch("ghcc.compile.run_docker_command_other", side_effect=fail):
+                with self.assertRaises(subprocess.CalledProcessError):
+                    ghcc.docker_batch_compile(tempdir, os.path.join(tempdir, "repo"), "gcc",
+                                              makefile_dirs=[os.path.join(tempdir, "repo")])
+            self.assertEqual([], os.listdir(tempdir))
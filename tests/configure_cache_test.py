@@ -0,0 +1,73 @@
+import os
+import subprocess
+import tarfile
+import tempfile
+import unittest
+
+import ghcc
+
+
+class ConfigureCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tempdir.name, "cache")
+        self.repos = [os.path.join(self.tempdir.name, name) for name in ["repo.none", "repo.clang"]]
+        for repo in self.repos:
+            os.makedirs(os.path.join(repo, "src"))
+            with open(os.path.join(repo, "src", "configure"), "w") as f:
+                f.write("#!/bin/sh\n")
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _read(self, *path: str) -> str:
+        with open(os.path.join(*path)) as f:
+            return f.read()
+
+    def test_save_and_restore(self) -> None:
+        source, target = [os.path.join(repo, "src") for repo in self.repos]
+        cache = ghcc.ConfigureCache(self.cache_dir, self.repos[0])
+        self.assertFalse(cache.restore(source))
+
+        start_time = cache.start(source)
+        with open(os.path.join(source, "Makefile"), "w") as f:
+            f.write(f"srcdir = {source}\n")
+        with open(os.path.join(source, "config.h"), "w") as f:
+            f.write("#define HAVE_STDLIB_H 1\n")
+        cache.save(source, start_time)
+
+        # Restore in another snapshot of the repository; absolute paths should be rewritten.
+        cache = ghcc.ConfigureCache(self.cache_dir, self.repos[1])
+        self.assertTrue(cache.restore(target))
+        self.assertEqual(f"srcdir = {target}\n", self._read(target, "Makefile"))
+        self.assertEqual("#define HAVE_STDLIB_H 1\n", self._read(target, "config.h"))
+        # Timestamps are kept, so `make` doesn't regenerate files.
+        self.assertAlmostEqual(os.stat(os.path.join(source, "config.h")).st_mtime,
+                               os.stat(os.path.join(target, "config.h")).st_mtime, places=5)
+
+    def test_failed_configure(self) -> None:
+        source, target = [os.path.join(repo, "src") for repo in self.repos]
+        cache = ghcc.ConfigureCache(self.cache_dir, self.repos[0])
+        start_time = cache.start(source)
+        cache.save(source, start_time, error=subprocess.CalledProcessError(1, ["./configure"], output=b"error"))
+
+        cache = ghcc.ConfigureCache(self.cache_dir, self.repos[1])
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            cache.restore(target)
+        self.assertEqual(b"error", context.exception.output)
+
+    def test_unsafe_archive(self) -> None:
+        source = os.path.join(self.repos[0], "src")
+        cache = ghcc.ConfigureCache(self.cache_dir, self.repos[0])
+        cache.save(source, cache.start(source))
+        # Replace the saved files with a symlink that points outside the directory, followed by a file written through
+        # the symlink.
+        with tarfile.open(cache._file(source, ".tar"), "w") as tar:
+            info = tarfile.TarInfo("link")
+            info.type = tarfile.SYMTYPE
+            info.linkname = self.tempdir.name
+            tar.addfile(info)
+            tar.addfile(tarfile.TarInfo("link/outside"))
+        self.assertFalse(cache.restore(source))
+        self.assertFalse(os.path.lexists(os.path.join(source, "link")))
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir.name, "outside")))
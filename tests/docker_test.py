@@ -0,0 +1,212 @@
+import http.client
+import http.server
+import json
+import os
+import pickle
+import socketserver
+import struct
+import subprocess
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from typing import Dict, List, Tuple
+
+import ghcc
+
+
+class ContainerPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.clone_folder = os.path.join(self.tempdir.name, "repos")
+        self.pool = ghcc.utils.ContainerPool({self.clone_folder: "/usr/src/repos"}, max_jobs=5)
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def test_container_path(self) -> None:
+        repo_path = os.path.join(self.clone_folder, "owner_____name")
+        self.assertEqual("/usr/src/repos/owner_____name", self.pool.container_path(repo_path))
+        self.assertEqual("/usr/src/repos", self.pool.container_path(self.clone_folder))
+        with self.assertRaises(ValueError):
+            self.pool.container_path(self.clone_folder + "_other")
+
+    def test_pickle(self) -> None:
+        # The pool is passed to worker processes, so it must survive pickling with the same identity.
+        pool = pickle.loads(pickle.dumps(self.pool))
+        self.assertEqual(self.pool.pool_id, pool.pool_id)
+        self.assertEqual(self.pool.directory_mapping, pool.directory_mapping)
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeDockerDaemon"
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.num_connections += 1
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def address_string(self) -> str:
+        return "fake-docker"
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json",
+              close: bool = False) -> None:
+        self.send_response(status)
+        if status != 204:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        if close:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, obj) -> None:
+        self._send(status, json.dumps(obj).encode("utf-8"))
+
+    def _send_stream(self, output: List[Tuple[int, bytes]]) -> None:
+        body = b"".join(struct.pack(">BxxxL", stream, len(data)) + data for stream, data in output)
+        self._send(200, body, content_type="application/vnd.docker.raw-stream", close=True)
+
+    def _route(self, method: str) -> None:
+        url = urllib.parse.urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length > 0 else None
+        self.server.requests.append((method, url.path))
+        parts = url.path.strip("/").split("/")
+        if url.path == "/_ping":
+            self._send(200, b"OK", content_type="text/plain")
+        elif url.path == "/images/gcc-custom/json":
+            self._send_json(200, {"Created": "2020-01-02T03:04:05.123456789Z"})
+        elif url.path == "/containers/create":
+            self.server.created.append(body)
+            if self.server.drop_responses:
+                self.close_connection = True  # processed, but the connection breaks before the response is sent
+                return
+            self._send_json(201, {"Id": "container"})
+        elif parts[0] == "containers" and method == "DELETE":
+            self._send(204)
+        elif parts[0] == "containers" and parts[-1] in ["start", "kill"]:
+            self._send(204)
+        elif parts[0] == "containers" and parts[-1] == "logs":
+            self._send_stream(self.server.output)
+        elif parts[0] == "containers" and parts[-1] == "wait":
+            self._send_json(200, {"StatusCode": self.server.return_code})
+        elif parts[0] == "containers" and parts[-1] == "exec":
+            self.server.created.append(body)
+            self._send_json(201, {"Id": "exec"})
+        elif parts[0] == "exec" and parts[-1] == "start":
+            self._send_stream(self.server.output)
+        elif parts[0] == "exec" and parts[-1] == "json":
+            self._send_json(200, {"ExitCode": self.server.return_code})
+        else:
+            self._send_json(404, {"message": f"no such endpoint: {url.path}"})
+
+    def do_GET(self) -> None:
+        self._route("GET")
+
+    def do_POST(self) -> None:
+        self._route("POST")
+
+    def do_DELETE(self) -> None:
+        self._route("DELETE")
+
+
+class FakeDockerDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        super().__init__(socket_path, FakeDockerHandler)
+        self.num_connections = 0
+        self.requests: List[Tuple[str, str]] = []
+        self.created: List[Dict] = []
+        self.output = [(1, b"hello\n"), (2, b"world\n")]
+        self.return_code = 0
+        self.drop_responses = False
+
+
+class DockerClientTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        socket_path = os.path.join(self.tempdir.name, "docker.sock")
+        self.daemon = FakeDockerDaemon(socket_path)
+        self.thread = threading.Thread(target=self.daemon.serve_forever, daemon=True)
+        self.thread.start()
+        self.client = ghcc.utils.DockerClient(socket_path)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.daemon.shutdown()
+        self.daemon.server_close()
+        self.tempdir.cleanup()
+
+    def test_connection_reuse(self) -> None:
+        for _ in range(5):
+            self.assertTrue(self.client.ping())
+            self.client.inspect_image("gcc-custom")
+        self.assertEqual(1, self.daemon.num_connections)
+
+        with self.assertRaises(ghcc.utils.DockerAPIError) as cm:
+            self.client.request("GET", "/nonexistent")
+        self.assertEqual(404, cm.exception.status)
+
+    def test_no_retry_after_processing(self) -> None:
+        self.assertTrue(self.client.ping())
+        self.daemon.drop_responses = True
+        with self.assertRaises((OSError, http.client.HTTPException)):
+            self.client.create_container("gcc-custom", ["true"])
+        # The daemon might have created the container, so the request must not be sent again.
+        self.assertEqual(1, len(self.daemon.created))
+
+    def test_run_docker_command(self) -> None:
+        log_path = os.path.join(self.tempdir.name, "output.log")
+        result = ghcc.utils.run_docker_command(["echo", "hello"], user=(1000, 1001), timeout=10, client=self.client,
+                                               directory_mapping={self.tempdir.name: "/usr/src"},
+                                               return_output=True, log_path=log_path)
+        self.assertEqual(b"hello\nworld\n", result.captured_output)
+        config = self.daemon.created[-1]
+        self.assertEqual("gcc-custom", config["Image"])
+        self.assertEqual(["timeout 10s echo hello"], config["Cmd"])
+        self.assertIn("LOCAL_USER_ID=1000", config["Env"])
+        self.assertIn("LOCAL_GROUP_ID=1001", config["Env"])
+        self.assertEqual([f"{self.tempdir.name}:/usr/src"], config["HostConfig"]["Binds"])
+        # The container is always removed.
+        self.assertEqual("DELETE", self.daemon.requests[-1][0])
+        with open(log_path, "rb") as f:
+            self.assertTrue(f.read().endswith(b"hello\nworld\n"))
+        # With only a user ID, the group is the group of the current user, as with the `docker` CLI.
+        ghcc.utils.run_docker_command(["echo", "hello"], user=1000, client=self.client)
+        self.assertIn(f"LOCAL_GROUP_ID={os.getgid()}", self.daemon.created[-1]["Env"])
+
+    def test_run_docker_command_errors(self) -> None:
+        self.daemon.return_code = 2
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            ghcc.utils.run_docker_command("false", client=self.client)
+        self.assertEqual(2, cm.exception.returncode)
+        self.assertEqual(b"hello\nworld\n", cm.exception.output)
+
+        self.daemon.return_code = 124  # killed by `timeout` inside the container
+        with self.assertRaises(subprocess.TimeoutExpired):
+            ghcc.utils.run_docker_command("sleep 100", timeout=1, client=self.client)
+        # Timeouts are reported in the same way as through the `docker` CLI, even if errors are ignored.
+        with self.assertRaises(subprocess.TimeoutExpired):
+            ghcc.utils.run_docker_command("sleep 100", timeout=1, client=self.client, ignore_errors=True)
+
+    def test_container_exec(self) -> None:
+        container = ghcc.utils.DockerContainer({self.tempdir.name: "/usr/src"}, client=self.client)
+        container.start()
+        result = container.exec("make", cwd="/usr/src", user=0, return_output=True)
+        self.assertEqual(b"hello\nworld\n", result.captured_output)
+        self.assertEqual(["bash", "-c", "make"], self.daemon.created[-1]["Cmd"])
+        self.assertEqual(1, container.num_jobs)
+        container.stop()
+
+    def test_verify_docker_image(self) -> None:
+        from ghcc.utils.docker import _parse_api_timestamp
+        self.assertAlmostEqual(1577934245.123457, _parse_api_timestamp("2020-01-02T03:04:05.123456789Z"), places=5)
+        self.assertEqual(1577934245.0, _parse_api_timestamp("2020-01-02T05:04:05+02:00"))
+        # The image is older than the source files, so it's out-of-date.
+        self.assertFalse(ghcc.utils.verify_docker_image(client=self.client))
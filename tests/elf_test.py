@@ -0,0 +1,45 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import ghcc
+
+
+@unittest.skipIf(shutil.which("gcc") is None, "GCC is not installed")
+class ElfTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tempdir.name, "main.c"), "w") as f:
+            f.write("int main() { return 0; }\n")
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _compile(self, output: str, *args: str) -> str:
+        subprocess.run(["gcc", "main.c", "-o", output, *args], cwd=self.tempdir.name, check=True)
+        return os.path.join(self.tempdir.name, output)
+
+    def test_classify(self) -> None:
+        binaries = {
+            "main.o": (["-c", "-g"], ghcc.ElfType.Relocatable, True),
+            "main_pie": (["-fPIE", "-pie", "-g"], ghcc.ElfType.PIE, True),
+            "main_exec": (["-no-pie"], ghcc.ElfType.Executable, False),
+            "libmain.so": (["-shared", "-fPIC"], ghcc.ElfType.Shared, False),
+        }
+        for output, (args, elf_type, debug_info) in binaries.items():
+            path = self._compile(output, *args)
+            info = ghcc.read_elf_info(path)
+            self.assertEqual(elf_type, info.type, output)
+            self.assertEqual(64, info.bits)
+            self.assertEqual(debug_info, info.debug_info, output)
+            self.assertEqual(debug_info, ghcc.has_debug_info(path), output)
+            accepted = ghcc.read_elf_info(path, ghcc.DEFAULT_ELF_TYPES) is not None
+            self.assertEqual(elf_type is not ghcc.ElfType.Relocatable, accepted, output)
+
+    def test_not_elf(self) -> None:
+        path = os.path.join(self.tempdir.name, "main.c")
+        self.assertIsNone(ghcc.read_elf_info(path))
+        self.assertFalse(ghcc.has_debug_info(path))
+        self.assertIsNone(ghcc.read_elf_info(os.path.join(self.tempdir.name, "nonexistent")))
@@ -0,0 +1,29 @@
+import tempfile
+import unittest
+
+from ghcc.utils import JobBudget
+
+
+class JobBudgetTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def test_acquire(self) -> None:
+        budget = JobBudget(self.tempdir.name, size=5, max_jobs=4)
+        with budget.acquire() as jobs:
+            self.assertEqual(4, jobs)
+            # Only the remaining tokens are available to other builds.
+            with budget.acquire() as other_jobs:
+                self.assertEqual(3, other_jobs)
+                with budget.acquire() as no_extra_jobs:
+                    self.assertEqual(1, no_extra_jobs)
+        # Tokens are released after builds finish.
+        with budget.acquire() as jobs:
+            self.assertEqual(4, jobs)
+
+    def test_empty_budget(self) -> None:
+        with JobBudget(self.tempdir.name, size=0).acquire() as jobs:
+            self.assertEqual(1, jobs)
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+MOCK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "mock_path")
+OBFUSCATOR_CLANG = "/build/bin/clang"  # the Obfuscator-LLVM build in the `gcc-custom` image
+
+
+@unittest.skipIf(not os.path.exists(OBFUSCATOR_CLANG), "Obfuscator-LLVM is not installed")
+class LLVMBitcodeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tempdir.name, "bitcode")
+        self.repos = [os.path.join(self.tempdir.name, name) for name in ["repo.fla", "repo.sub"]]
+        for repo in self.repos:
+            os.makedirs(repo)
+            with open(os.path.join(repo, "main.c"), "w") as f:
+                f.write("int f(int x) { return x > 0 ? x + 1 : x - 1; }\n"
+                        "int main() { return f(0); }\n")
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _compile(self, repo: str, flags: str) -> str:
+        env = {
+            "PATH": MOCK_PATH + ":" + os.environ["PATH"],
+            "COMPILER": "clang",
+            "MOCK_GCC_OVERRIDE_FLAGS": flags,
+            "MOCK_GCC_BITCODE_CACHE": self.cache_dir,
+            "MOCK_GCC_CACHE_BASEDIR": repo,
+        }
+        process = subprocess.run(["clang", "-c", "main.c", "-o", "main.o"], cwd=repo, env=env, check=True,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        return process.stderr.decode('utf-8')
+
+    def test_shared_bitcode(self) -> None:
+        self.assertNotIn("Bitcode reused", self._compile(self.repos[0], "-O1 -mllvm -fla"))
+        self.assertIn("Bitcode reused", self._compile(self.repos[1], "-O1 -mllvm -sub"))
+        for repo in self.repos:
+            self.assertTrue(os.path.exists(os.path.join(repo, "main.o")))
@@ -0,0 +1,84 @@
+import functools
+import json
+import os
+import pickle
+import tempfile
+import unittest
+
+import flutes
+
+import ghcc
+
+
+def _record_variant(manifest: ghcc.CrawlManifest, repo: str, variant: str) -> None:
+    manifest.start_variant(repo, variant, commit_hash="abc", compiler="gcc", flags="-O1")
+    manifest.finish_variant(repo, variant, ghcc.VariantStatus.Done, record={"repo": repo, "obfuscation": variant},
+                            makefiles=[{"directory": "/", "success": True, "binaries": ["a.out"], "sha256": ["0"]}])
+
+
+def _record_variants(manifest: ghcc.CrawlManifest, repo: str) -> None:
+    for variant in ["none", "llvm-obfuscation-fla"]:
+        _record_variant(manifest, repo, variant)
+
+
+class CrawlManifestTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "manifest.db")
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def test_resume(self) -> None:
+        manifest = ghcc.CrawlManifest(self.path)
+        _record_variant(manifest, "foo/bar", "none")
+        manifest.start_variant("foo/bar", "adv-obfuscation")  # interrupted
+        manifest.finish_repo("foo/private", ghcc.RepoStatus.Failed, message="private or nonexistent")
+        manifest.close()
+
+        # Reopen, as if the crawl is restarted.
+        manifest = ghcc.CrawlManifest(self.path)
+        self.assertEqual({"none"}, manifest.finished_variants("foo/bar"))
+        self.assertEqual({"foo/private"}, manifest.finished_repos())
+        self.assertEqual(ghcc.RepoStatus.Failed, manifest.repo_status("foo/private"))
+        self.assertIsNone(manifest.repo_status("foo/bar"))
+        entry, = manifest.iter_variants("foo/bar")
+        self.assertEqual("abc", entry["commit_hash"])
+        self.assertEqual(["0"], entry["makefiles"][0]["sha256"])
+        self.assertLessEqual(entry["start_time"], entry["end_time"])
+        manifest.close()
+
+    def test_concurrent_writers(self) -> None:
+        manifest = ghcc.CrawlManifest(self.path)
+        manifest = pickle.loads(pickle.dumps(manifest))
+        repos = [f"owner/repo{idx}" for idx in range(20)]
+        with flutes.safe_pool(4) as pool:
+            for _ in pool.imap_unordered(functools.partial(_record_variants, manifest), repos):
+                pass
+        for repo in repos:
+            self.assertEqual({"none", "llvm-obfuscation-fla"}, manifest.finished_variants(repo))
+
+        json_path = os.path.join(self.tempdir.name, "meta_data.json")
+        manifest.export_json(json_path)
+        with open(json_path) as f:
+            records = json.load(f)
+        self.assertEqual(40, len(records))
+        manifest.close()
+
+    def test_build_index(self) -> None:
+        manifest = ghcc.CrawlManifest(self.path)
+        makefiles = [{"directory": "src", "success": True, "binaries": ["a.out"], "sha256": ["0"]}]
+        manifest.record_build("abc", "none", "gcc", None, "image", repo="foo/bar", makefiles=makefiles,
+                              libraries=["m"])
+        manifest.close()
+
+        manifest = ghcc.CrawlManifest(self.path)
+        build = manifest.find_build("abc", "none", "gcc", None, "image")
+        self.assertEqual("foo/bar", build["repo"])
+        self.assertEqual(makefiles, build["makefiles"])
+        self.assertEqual(["m"], build["libraries"])
+        self.assertIsNone(build["meta_info"])
+        # Any difference in the configuration is a different build.
+        self.assertIsNone(manifest.find_build("abc", "none", "gcc", "-O2", "image"))
+        self.assertIsNone(manifest.find_build("abc", "none", "gcc", None, "other-image"))
+        manifest.close()
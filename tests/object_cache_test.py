@@ -0,0 +1,82 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+MOCK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "mock_path")
+
+
+@unittest.skipIf(shutil.which("gcc") is None, "GCC is not installed")
+class ObjectCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tempdir.name, "cache")
+        self.repos = [os.path.join(self.tempdir.name, name) for name in ["repo", "fork"]]
+        for repo in self.repos:
+            os.makedirs(os.path.join(repo, "src"))
+            with open(os.path.join(repo, "src", "main.c"), "w") as f:
+                f.write("int main() { return 0; }\n")
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _compile(self, repo: str, *args: str, use_cache: bool = True) -> None:
+        env = {
+            "PATH": MOCK_PATH + ":" + os.environ["PATH"],
+            "COMPILER": "gcc",
+            "MOCK_GCC_CACHE_BASEDIR": repo,
+            "MOCK_GCC_CACHE_STATS": os.path.join(self.tempdir.name, "stats.txt"),
+        }
+        if use_cache:
+            env["MOCK_GCC_OBJECT_CACHE"] = self.cache_dir
+        subprocess.run(["gcc", "-c", "main.c", "-o", "main.o", *args], cwd=os.path.join(repo, "src"), env=env,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _stats(self) -> str:
+        with open(os.path.join(self.tempdir.name, "stats.txt")) as f:
+            return f.read()
+
+    def test_shared_between_forks(self) -> None:
+        self._compile(self.repos[0], "-MMD")
+        self._compile(self.repos[1], "-MMD")
+        self.assertEqual("miss\nhit\n", self._stats())
+        for repo in self.repos:
+            self.assertTrue(os.path.exists(os.path.join(repo, "src", "main.o")))
+            with open(os.path.join(repo, "src", "main.d")) as f:
+                self.assertEqual("main.o: main.c\n", f.read())
+
+    def test_absolute_include_paths(self) -> None:
+        for repo in self.repos:
+            os.makedirs(os.path.join(repo, "include"))
+            with open(os.path.join(repo, "include", "config.h"), "w") as f:
+                f.write("#define VERSION 1\n")
+            with open(os.path.join(repo, "src", "main.c"), "w") as f:
+                f.write('#include "config.h"\nint main() { return VERSION; }\n')
+        # Linemarkers of the header contain the absolute path of the repository.
+        self._compile(self.repos[0], "-I" + os.path.join(self.repos[0], "include"), "-g")
+        self._compile(self.repos[1], "-I" + os.path.join(self.repos[1], "include"), "-g")
+        self.assertEqual("miss\nhit\n", self._stats())
+
+    def test_read_only_entries(self) -> None:
+        self._compile(self.repos[0])
+        for subdir, _, files in os.walk(self.cache_dir):
+            for name in files:
+                self.assertEqual(0o444, os.stat(os.path.join(subdir, name)).st_mode & 0o777)
+
+    def test_different_flags(self) -> None:
+        self._compile(self.repos[0])
+        self._compile(self.repos[1], "-DNDEBUG")
+        self.assertEqual("miss\nmiss\n", self._stats())
+
+    def test_debug_info_without_cache(self) -> None:
+        # Debug info doesn't depend on whether the cache is enabled.
+        self._compile(self.repos[0], use_cache=False)
+        with open(os.path.join(self.repos[0], "src", "main.o"), "rb") as f:
+            uncached = f.read()
+        self.assertNotIn(self.repos[0].encode('utf-8'), uncached)
+        self._compile(self.repos[1])
+        self._compile(self.repos[0])
+        self.assertEqual("miss\nhit\n", self._stats())
+        with open(os.path.join(self.repos[0], "src", "main.o"), "rb") as f:
+            self.assertEqual(uncached, f.read())
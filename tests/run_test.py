@@ -0,0 +1,57 @@
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+
+import ghcc
+
+
+class StreamingCommandTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tempdir.name, "output.log")
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def test_bounded_tail(self) -> None:
+        result = ghcc.utils.run_streaming_command(
+            "for i in $(seq 1 2000); do echo line$i; done; echo error >&2", shell=True,
+            log_path=self.log_path, return_output=True, tail_size=64)
+        self.assertEqual(0, result.return_code)
+        self.assertLessEqual(len(result.captured_output), 64)
+        self.assertTrue(result.captured_output.endswith(b"line2000\nerror\n"))
+        # The full output goes to the log file.
+        with open(self.log_path, "rb") as f:
+            output = f.read()
+        self.assertIn(b"line1\n", output)
+        self.assertIn(b"error\n", output)
+
+    def test_return_code(self) -> None:
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            ghcc.utils.run_streaming_command(["bash", "-c", "echo failed; exit 3"])
+        self.assertEqual(3, cm.exception.returncode)
+        self.assertEqual(b"failed\n", cm.exception.output)
+        result = ghcc.utils.run_streaming_command(["bash", "-c", "exit 3"], ignore_errors=True)
+        self.assertEqual(3, result.return_code)
+
+    def test_timeout(self) -> None:
+        # Background children must be killed as well, otherwise reading the output would block.
+        with self.assertRaises(subprocess.TimeoutExpired):
+            ghcc.utils.run_streaming_command("sleep 30 & sleep 30", shell=True, timeout=0.5)
+        result = ghcc.utils.run_streaming_command(["sleep", "30"], timeout=0.5, ignore_errors=True)
+        self.assertEqual(-32768, result.return_code)
+
+    def test_stall(self) -> None:
+        start_time = time.time()
+        with self.assertRaises(ghcc.utils.StallError) as cm:
+            ghcc.utils.run_streaming_command("echo started; sleep 30", shell=True, timeout=30, stall_timeout=1)
+        self.assertLess(time.time() - start_time, 10)
+        self.assertIn("sleep", cm.exception.reason)
+        self.assertEqual(b"started\n", cm.exception.output)
+        # Builds that keep writing output, or keep using CPU, are not stalled.
+        ghcc.utils.run_streaming_command("for i in $(seq 1 8); do echo $i; sleep 0.4; done", shell=True,
+                                         stall_timeout=1)
+        ghcc.utils.run_streaming_command(["python", "-c", "import time\nstart = time.time()\n"
+                                                           "while time.time() - start < 3: pass"], stall_timeout=1)
@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+from typing import List
+
+import ghcc
+
+
+class TaskSchedulerTest(unittest.TestCase):
+    def _run_graph(self, num_workers: int) -> None:
+        scheduler = ghcc.utils.TaskScheduler({"first": num_workers, "second": num_workers})
+        lock = threading.Lock()
+        log: List[str] = []
+        running = set()
+
+        def step(item: int, name: str) -> str:
+            with lock:
+                # Tasks holding the same resource should never run concurrently.
+                self.assertNotIn(item, running)
+                running.add(item)
+            time.sleep(0.001)
+            with lock:
+                running.remove(item)
+                log.append(f"{item}-{name}")
+            return name
+
+        def start(item: int) -> None:
+            def expand(_result: str) -> None:
+                tasks = [scheduler.submit(lambda name=name: step(item, name), "second", resource=item, priority=item)
+                         for name in ["b", "c", "d"]]
+                scheduler.submit(lambda: "".join(task.result for task in tasks), "first", deps=tasks,
+                                 callback=lambda result: scheduler.emit((item, result)), priority=item)
+
+            scheduler.submit(lambda: step(item, "a"), "first", callback=expand, priority=item)
+
+        results = list(scheduler.run(range(10), start, max_in_flight=3))
+        self.assertEqual([(item, "bcd") for item in range(10)], sorted(results))
+        for item in range(10):
+            self.assertLess(log.index(f"{item}-a"), min(log.index(f"{item}-{name}") for name in "bcd"))
+
+    def test_graph(self) -> None:
+        self._run_graph(num_workers=4)
+
+    def test_sequential(self) -> None:
+        self._run_graph(num_workers=0)
+
+    def test_max_in_flight(self) -> None:
+        scheduler = ghcc.utils.TaskScheduler({"pool": 4})
+        lock = threading.Lock()
+        counts = {"in_flight": 0, "max": 0}
+
+        def start(item: int) -> None:
+            with lock:
+                counts["in_flight"] += 1
+                counts["max"] = max(counts["max"], counts["in_flight"])
+
+            def finish() -> int:
+                time.sleep(0.005)
+                with lock:
+                    counts["in_flight"] -= 1
+                return item
+
+            scheduler.submit(finish, "pool", callback=scheduler.emit)
+
+        self.assertEqual(list(range(20)), sorted(scheduler.run(range(20), start, max_in_flight=2)))
+        self.assertLessEqual(counts["max"], 2)
+
+    def test_exception(self) -> None:
+        scheduler = ghcc.utils.TaskScheduler({"pool": 2})
+
+        def fail() -> None:
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            list(scheduler.run(range(5), lambda _: scheduler.submit(fail, "pool"), max_in_flight=2))
+
+
+class VariantTest(unittest.TestCase):
+    def test_variants(self) -> None:
+        variant = ghcc.Variant("llvm", compiler="clang", flags=["-mllvm", "-fla"], optimization="O2")
+        self.assertEqual("-g -O2 -mllvm -fla", variant.compiler_flags("-g "))
+        self.assertEqual("-O1", ghcc.Variant("none").compiler_flags(None))
+
+        self.assertEqual(ghcc.DEFAULT_VARIANTS, ghcc.select_variants())
+        names = [variant.name for variant in ghcc.select_variants(["adv-obfuscation", "none"])]
+        self.assertEqual(["none", "adv-obfuscation"], names)
+        with self.assertRaises(ValueError):
+            ghcc.select_variants(["nonexistent"])
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+import ghcc
+
+
+class RepoSnapshotTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tempdir.name, "repo")
+        os.makedirs(os.path.join(self.source, "src"))
+        with open(os.path.join(self.source, "src", "main.c"), "w") as f:
+            f.write("int main() { return 0; }\n")
+        subprocess.run(["git", "init", "-q"], cwd=self.source, check=True)
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _read(self, *path: str) -> str:
+        with open(os.path.join(*path)) as f:
+            return f.read()
+
+    def test_snapshot_methods(self) -> None:
+        for methods in [None, [ghcc.SnapshotMethod.Copy], [ghcc.SnapshotMethod.Reflink, ghcc.SnapshotMethod.Copy]]:
+            dest = os.path.join(self.tempdir.name, "repo.variant")
+            with ghcc.RepoSnapshot(self.source, dest, methods) as snapshot:
+                self.assertTrue(os.path.isdir(os.path.join(snapshot.path, ".git")))
+                # Modifications and new files in the snapshot must not affect the original.
+                with open(os.path.join(snapshot.path, "src", "main.c"), "w") as f:
+                    f.write("modified")
+                with open(os.path.join(snapshot.path, "src", "main.o"), "w") as f:
+                    f.write("object")
+                self.assertEqual("int main() { return 0; }\n", self._read(self.source, "src", "main.c"))
+                self.assertFalse(os.path.exists(os.path.join(self.source, "src", "main.o")))
+            self.assertFalse(os.path.exists(dest))
+
+    def test_hardlink(self) -> None:
+        dest = os.path.join(self.tempdir.name, "repo.variant")
+        with ghcc.RepoSnapshot(self.source, dest, [ghcc.SnapshotMethod.Hardlink]) as snapshot:
+            self.assertIs(ghcc.SnapshotMethod.Hardlink, snapshot.method)
+            self.assertTrue(os.path.samefile(os.path.join(self.source, "src", "main.c"),
+                                             os.path.join(snapshot.path, "src", "main.c")))
+        self.assertTrue(os.path.exists(os.path.join(self.source, "src", "main.c")))
+
+    def test_existing_destination(self) -> None:
+        with self.assertRaises(ValueError):
+            ghcc.RepoSnapshot(self.source, self.source)